@@ -0,0 +1,135 @@
+"""
+Analysis result cache and request coalescing
+
+Results are cached in the ``analysis`` cache under the SHA-256 of the image
+bytes and the model version, so identical bytes under any image row are
+segmented once per model. Entries expire after the cache's ``TIMEOUT`` and
+are culled above its ``MAX_ENTRIES``.
+
+Concurrent requests for the same key are coalesced: within a process, one
+thread runs inference while the others wait for its result; across
+processes sharing the cache, a short-lived lock entry makes later workers
+wait for the result instead of starting their own inference.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+
+METRIC_FIELDS = ["dice_score", "iou_score", "precision", "recall"]
+
+
+def result_cache():
+    """The cache holding analysis results"""
+    return caches["analysis"]
+
+
+def content_key(image, model_version):
+    """
+    Cache key of the analysis of ``image`` by ``model_version``.
+
+    Images without a content-addressed blob are keyed by their row, so they
+    are still coalesced with themselves.
+    """
+    if image.blob_id is not None:
+        return f"analysis:{image.blob.sha256}:{model_version}"
+    return f"analysis:image-{image.pk}:{model_version}"
+
+
+def result_entry(analysis):
+    """The parts of ``analysis`` that another image can reuse"""
+    return {
+        "image_id": analysis.image_id,
+        "model_version": analysis.model_version,
+        "results": analysis.results,
+        "processing_time": analysis.processing_time,
+        **{field: getattr(analysis, field) for field in METRIC_FIELDS},
+    }
+
+
+def cache_result(key, analysis):
+    """Cache the result of ``analysis`` under ``key``"""
+    result_cache().set(key, result_entry(analysis))
+
+
+def cached_result(key):
+    """
+    Return the cached result for ``key``, or None.
+
+    Entries whose mask file has since been deleted are dropped.
+    """
+    entry = result_cache().get(key)
+    if entry is None:
+        return None
+    mask = entry["results"].get("mask")
+    if mask and not default_storage.exists(mask["name"]):
+        result_cache().delete(key)
+        return None
+    return entry
+
+
+class SingleFlight:
+    """
+    Run one call per key at a time; concurrent callers share its outcome.
+
+    ``do`` returns ``(result, shared)`` where ``shared`` is True for callers
+    that waited on another thread's call. An exception raised by the call
+    is raised in every waiter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = function()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def wait_for_result(key, timeout=None, poll_interval=0.1):
+    """
+    Claim ``key`` for this process, or wait for the process that holds it.
+
+    Returns ``(entry, claimed)``: the cached result once another process
+    finishes, or ``(None, True)`` once the claim is taken by this process,
+    which must then run inference and call ``release``. A claim expires
+    after ``timeout`` seconds so a dead worker does not block others.
+    """
+    timeout = timeout or settings.ANALYSIS_QUEUE["COALESCE_TIMEOUT"]
+    lock = f"{key}:lock"
+    deadline = time.monotonic() + timeout
+    while True:
+        entry = cached_result(key)
+        if entry is not None:
+            return entry, False
+        if result_cache().add(lock, True, timeout):
+            return None, True
+        if time.monotonic() >= deadline:
+            # The holder is stuck; run inference here rather than never
+            return None, False
+        time.sleep(poll_interval)
+
+
+def release(key):
+    """Drop this process's claim on ``key``"""
+    result_cache().delete(f"{key}:lock")
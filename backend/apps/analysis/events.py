@@ -0,0 +1,231 @@
+"""
+Publish/subscribe of analysis progress events
+
+Workers publish ``started``, ``progress``, ``completed`` and ``failed``
+events for each job to the image owner's channel; the server-sent events
+endpoint forwards them to that user's open connections. Events carry what
+the client needs to update its view, so nothing is read from the database
+to deliver them.
+
+``LocalBroker`` delivers within one process, which is enough when workers
+run inside the ASGI server. ``UDPBroker`` is a local stand-in for a shared
+pub/sub service: any process publishes datagrams to an address, on loopback
+or a private network, and the ASGI process listening on it fans them out to
+its subscribers.
+"""
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+
+def events_setting(name):
+    """Return a value from the ANALYSIS_EVENTS settings dict"""
+    return settings.ANALYSIS_EVENTS[name]
+
+
+class Subscription:
+    """
+    Events for one user, read by one connection on its event loop.
+
+    Publishers may run in any thread. When more than ``queue_size`` events
+    are waiting, newer ones are dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, broker, user_id, queue_size):
+        self.broker = broker
+        self.user_id = user_id
+        self.dropped = 0
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(queue_size)
+
+    def put(self, event):
+        """Queue an event from any thread"""
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The connection's event loop has already closed
+            self.close()
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def get(self, timeout=None):
+        """Next event, or None after ``timeout`` seconds without one"""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        """Stop receiving events"""
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalBroker:
+    """In-process fan-out of events to the subscriptions of each user"""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, event):
+        """Send ``event`` to every subscription of ``user_id``"""
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id, event):
+        """Queue ``event`` on this process's subscriptions of ``user_id``"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+        return len(subscriptions)
+
+    def subscribe(self, user_id):
+        """Subscribe the running event loop to the events of ``user_id``"""
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscribers(self, user_id):
+        """Number of open subscriptions of ``user_id`` in this process"""
+        with self._lock:
+            return len(self._subscriptions.get(user_id, ()))
+
+    def close(self):
+        """Release resources held by the broker"""
+
+
+class UDPBroker(LocalBroker):
+    """
+    Events relayed between processes over a UDP socket.
+
+    Publishing is a fire-and-forget datagram, so a worker never blocks on a
+    slow or absent listener. The first subscription binds ``address`` and
+    starts a thread that delivers received events to local subscriptions;
+    only one process can listen on an address.
+    """
+
+    def __init__(self, address, queue_size=100):
+        super().__init__(queue_size)
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self._sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._listener = None
+
+    def publish(self, user_id, event):
+        payload = json.dumps(
+            {"user_id": user_id, "event": event}, cls=DjangoJSONEncoder
+        )
+        try:
+            self._sender.sendto(payload.encode(), self.address)
+        except OSError as exc:
+            logger.warning("Could not publish analysis event: %s", exc)
+
+    def subscribe(self, user_id):
+        self.listen()
+        return super().subscribe(user_id)
+
+    def listen(self):
+        """Bind the listening socket and start the receiving thread"""
+        with self._lock:
+            if self._listener is not None:
+                return
+            listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            listener.bind(self.address)
+            self._listener = listener
+        threading.Thread(
+            target=self._receive, args=(listener,), name="analysis-events", daemon=True
+        ).start()
+
+    def _receive(self, listener):
+        while True:
+            try:
+                payload, _ = listener.recvfrom(65535)
+            except OSError:
+                # Closed by close()
+                return
+            try:
+                message = json.loads(payload)
+                self.deliver(message["user_id"], message["event"])
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Ignoring malformed analysis event datagram")
+
+    def close(self):
+        self._sender.close()
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+
+
+def create_broker():
+    """Build the broker configured in ANALYSIS_EVENTS"""
+    backend = events_setting("BACKEND")
+    if backend == "udp":
+        return UDPBroker(events_setting("ADDRESS"), events_setting("QUEUE_SIZE"))
+    if backend == "local":
+        return LocalBroker(events_setting("QUEUE_SIZE"))
+    raise ValueError(f"Unknown ANALYSIS_EVENTS backend {backend!r}")
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide event broker, creating it on first use"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = create_broker()
+        return _broker
+
+
+def publish_event(image, event_type, **data):
+    """
+    Publish an event about ``image`` to its owner.
+
+    Errors are logged, never raised, so a broken channel cannot fail an
+    analysis.
+    """
+    event = {"type": event_type, "image_id": image.pk, "time": time.time(), **data}
+    try:
+        get_broker().publish(image.user_id, event)
+    except Exception:
+        logger.exception(
+            "Could not publish %s event for image %s", event_type, image.pk
+        )
+
+
+def format_event(event):
+    """Encode an event as a server-sent events message"""
+    data = json.dumps(event, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return f"event: {event['type']}\ndata: {data}\n\n"
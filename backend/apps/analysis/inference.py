@@ -0,0 +1,268 @@
+"""
+Micro-batching inference engine
+
+Worker threads submit preprocessed images one at a time. A single batching
+thread gathers them until ``max_batch_size`` images are waiting or the oldest
+one has waited ``max_wait_ms``, then runs one forward pass for the whole
+batch. On CPU this turns many small matmuls into a few large ones.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+BASELINE_MODEL_VERSION = "otsu-baseline"
+
+
+@dataclass
+class Prediction:
+    """Output of the engine for a single image"""
+
+    mask: np.ndarray
+    confidence: float
+    batch_size: int
+    inference_time: float
+    model_version: str
+    # Foreground probability per pixel, for blending overlapping tiles
+    probabilities: np.ndarray = None
+
+
+def otsu_threshold(pixels):
+    """Return the Otsu threshold of a uint8 array"""
+    hist = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 0
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    cum_mean = np.cumsum(hist * levels)
+    mean_bg = np.divide(cum_mean, weight_bg, out=np.zeros(256), where=weight_bg > 0)
+    mean_fg = np.divide(
+        cum_mean[-1] - cum_mean, weight_fg, out=np.zeros(256), where=weight_fg > 0
+    )
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between))
+
+
+class ThresholdModel:
+    """
+    Fallback segmentation model used when no trained model is configured.
+
+    Produces a foreground probability map by Otsu thresholding each image, so
+    the pipeline can run end to end without model weights.
+    """
+
+    version = BASELINE_MODEL_VERSION
+    memory_bytes = 0
+
+    def predict(self, batch):
+        pixels = np.rint(batch[..., 0] * 255).astype(np.uint8)
+        thresholds = np.array([otsu_threshold(p) for p in pixels], dtype=np.uint8)
+        return (pixels > thresholds[:, None, None]).astype(np.float32)[..., None]
+
+
+class KerasModel:
+    """Segmentation model loaded from a Keras/SavedModel file"""
+
+    backend = "tensorflow"
+
+    def __init__(self, path, version=""):
+        import tensorflow as tf
+
+        self.path = Path(path)
+        self.version = version or self.path.stem
+        self._model = tf.keras.models.load_model(self.path, compile=False)
+        # float32 weights
+        self.memory_bytes = self._model.count_params() * 4
+
+    def predict(self, batch):
+        # Calling the model directly avoids the per-call overhead of predict()
+        return np.asarray(self._model(batch, training=False))
+
+
+def quantize(values, detail):
+    """Convert float values to the dtype of a TFLite tensor"""
+    if detail["dtype"] == np.float32:
+        return values.astype(np.float32, copy=False)
+    scale, zero_point = detail["quantization"]
+    limits = np.iinfo(detail["dtype"])
+    quantized = np.rint(values / scale + zero_point)
+    return np.clip(quantized, limits.min, limits.max).astype(detail["dtype"])
+
+
+def dequantize(values, detail):
+    """Convert a TFLite tensor back to float values"""
+    if detail["dtype"] == np.float32:
+        return values
+    scale, zero_point = detail["quantization"]
+    return (values.astype(np.float32) - zero_point) * scale
+
+
+class TFLiteModel:
+    """
+    Segmentation model exported to TensorFlow Lite, typically int8-quantized.
+
+    Predictions are recorded as ``<version>+tflite`` so results of the
+    quantized export are never mistaken for the float32 model's. The
+    interpreter is not thread-safe; the engine only calls ``predict`` from
+    its batching thread.
+    """
+
+    backend = "tflite"
+
+    def __init__(self, path, version="", num_threads=0):
+        import tensorflow as tf
+
+        self.path = Path(path)
+        self.version = f"{version or self.path.stem}+{self.backend}"
+        self._interpreter = tf.lite.Interpreter(
+            model_path=str(self.path), num_threads=num_threads or None
+        )
+        self._batch_size = None
+        # int8 weights are one byte each, so the file size is a fair estimate
+        self.memory_bytes = self.path.stat().st_size
+
+    def predict(self, batch):
+        interpreter = self._interpreter
+        if len(batch) != self._batch_size:
+            index = interpreter.get_input_details()[0]["index"]
+            interpreter.resize_tensor_input(index, batch.shape)
+            interpreter.allocate_tensors()
+            self._input = interpreter.get_input_details()[0]
+            self._output = interpreter.get_output_details()[0]
+            self._batch_size = len(batch)
+        interpreter.set_tensor(self._input["index"], quantize(batch, self._input))
+        interpreter.invoke()
+        return dequantize(interpreter.get_tensor(self._output["index"]), self._output)
+
+
+def preprocess(pixels, input_size, out=None):
+    """
+    Resize a 2D uint8 array to the model input and scale it to [0, 1].
+
+    With ``out``, an existing float32 ``(input_size, input_size, 1)`` array,
+    the result is written into it instead of a new array.
+    """
+    if pixels.shape != (input_size, input_size):
+        resized = Image.fromarray(pixels).resize(
+            (input_size, input_size), Image.BILINEAR
+        )
+        pixels = np.asarray(resized)
+    if out is None:
+        return (pixels.astype(np.float32) / 255.0)[..., None]
+    out[..., 0] = pixels
+    out /= 255.0
+    return out
+
+
+class InferenceEngine:
+    """Gathers single-image requests into batched forward passes"""
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=20):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._requests = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def model_version(self):
+        return self.model.version
+
+    def submit(self, tensor):
+        """Queue one preprocessed (H, W, C) tensor and return a Future"""
+        if self._closed:
+            raise RuntimeError("Inference engine is closed")
+        self._ensure_started()
+        future = Future()
+        self._requests.put((tensor, future))
+        return future
+
+    def predict(self, tensor):
+        """Run inference for one tensor, blocking until its batch completes"""
+        return self.submit(tensor).result()
+
+    def close(self):
+        """Stop the batching thread once queued requests are served"""
+        self._closed = True
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="inference-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _gather(self, first):
+        """Collect requests until the batch is full or the wait expires"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._requests.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            self.run_batch(self._gather(first))
+
+    def run_batch(self, batch):
+        """Run one forward pass and resolve the futures of ``batch``"""
+        tensors = [tensor for tensor, _ in batch]
+        try:
+            started = time.perf_counter()
+            probabilities = self.model.predict(np.stack(tensors))
+            elapsed = time.perf_counter() - started
+        except Exception as exc:
+            logger.exception("Batched inference failed for %d image(s)", len(batch))
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+
+        for (_, future), probs in zip(batch, probabilities):
+            probs = probs[..., 0] if probs.ndim == 3 else probs
+            mask = probs > 0.5
+            future.set_result(
+                Prediction(
+                    mask=mask,
+                    confidence=float(np.where(mask, probs, 1 - probs).mean()),
+                    batch_size=len(batch),
+                    inference_time=elapsed / len(batch),
+                    model_version=self.model.version,
+                    probabilities=probs,
+                )
+            )
+
+
+def model_setting(name):
+    """Return a value from the ANALYSIS_MODEL settings dict"""
+    return settings.ANALYSIS_MODEL[name]
@@ -0,0 +1,423 @@
+"""
+Database-backed analysis job queue
+
+Jobs are claimed with a lease: a worker marks a job as running until
+``leased_until`` and keeps extending it while the job runs. If the worker
+dies, the lease expires and the job becomes visible to other workers again. Claims are made with a conditional UPDATE so
+two workers can never hold the same job, even on databases without
+``SELECT ... FOR UPDATE SKIP LOCKED``.
+
+Which jobs are claimed next is decided by ``schedule_jobs``: priority
+classes are served strictly in order, and within a class users share the
+workers by weight, so one user's bulk backlog cannot hold up everyone
+else's jobs of the same class.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from apps.images.models import MedicalImage
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, F, Min, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import AnalysisBatch, AnalysisJob
+
+
+def queue_setting(name):
+    """Return a value from the ANALYSIS_QUEUE settings dict"""
+    return settings.ANALYSIS_QUEUE[name]
+
+
+# Priority classes, most pressing first
+PRIORITIES = list(AnalysisJob.Priority)
+
+
+def _leasable(now):
+    """Filter matching jobs a worker may claim at ``now``"""
+    return Q(status=AnalysisJob.Status.PENDING, available_at__lte=now) | Q(
+        status=AnalysisJob.Status.RUNNING, leased_until__lt=now
+    )
+
+
+def enqueue_job(
+    image,
+    kind=AnalysisJob.Kind.ANALYSIS,
+    max_attempts=None,
+    model_version="",
+    priority=AnalysisJob.Priority.ROUTINE,
+):
+    """
+    Queue a job of ``kind`` for an image and return it.
+
+    If the image already has a pending or running job of that kind and model
+    version, that job is returned instead of creating a duplicate; a pending
+    one is raised to ``priority`` if that is more pressing.
+    """
+    active = AnalysisJob.objects.filter(
+        image=image,
+        kind=kind,
+        model_version=model_version,
+        status__in=[AnalysisJob.Status.PENDING, AnalysisJob.Status.RUNNING],
+    )
+    with transaction.atomic():
+        job = active.first()
+        if job is None:
+            try:
+                with transaction.atomic():
+                    job = AnalysisJob.objects.create(
+                        image=image,
+                        kind=kind,
+                        model_version=model_version,
+                        priority=priority,
+                        max_attempts=max_attempts or queue_setting("MAX_ATTEMPTS"),
+                        available_at=timezone.now(),
+                    )
+                return job
+            except IntegrityError:
+                # A concurrent request queued the same job first
+                job = active.get()
+        if PRIORITIES.index(priority) < PRIORITIES.index(job.priority):
+            if AnalysisJob.objects.filter(
+                pk=job.pk, status=AnalysisJob.Status.PENDING
+            ).update(priority=priority):
+                job.priority = priority
+    return job
+
+
+def enqueue_jobs(
+    image_ids,
+    kind=AnalysisJob.Kind.ANALYSIS,
+    max_attempts=None,
+    batch=None,
+    model_version="",
+    priority=AnalysisJob.Priority.ROUTINE,
+):
+    """
+    Queue a job of ``kind`` for each image id with one INSERT.
+
+    Images that already have a pending or running job of that kind and model
+    version are skipped, including jobs queued concurrently, which the
+    database drops. New jobs are attached to ``batch`` when given. Returns
+    the jobs passed to the INSERT, which include any the database dropped.
+    """
+    image_ids = list(dict.fromkeys(image_ids))
+    with transaction.atomic():
+        active = set(
+            AnalysisJob.objects.filter(
+                image_id__in=image_ids,
+                kind=kind,
+                model_version=model_version,
+                status__in=[AnalysisJob.Status.PENDING, AnalysisJob.Status.RUNNING],
+            ).values_list("image_id", flat=True)
+        )
+        now = timezone.now()
+        max_attempts = max_attempts or queue_setting("MAX_ATTEMPTS")
+        return AnalysisJob.objects.bulk_create(
+            [
+                AnalysisJob(
+                    image_id=image_id,
+                    kind=kind,
+                    model_version=model_version,
+                    priority=priority,
+                    batch=batch,
+                    max_attempts=max_attempts,
+                    available_at=now,
+                )
+                for image_id in image_ids
+                if image_id not in active
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def enqueue_analysis(
+    image, max_attempts=None, model_version="", priority=AnalysisJob.Priority.ROUTINE
+):
+    """
+    Queue an image for analysis and stamp ``analysis_started_at``.
+
+    An empty ``model_version`` leaves the choice of model to the worker's
+    default.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = enqueue_job(
+            image, AnalysisJob.Kind.ANALYSIS, max_attempts, model_version, priority
+        )
+        MedicalImage.objects.filter(pk=image.pk).update(analysis_started_at=now)
+    image.analysis_started_at = now
+    return job
+
+
+def enqueue_batch(
+    user,
+    images,
+    max_attempts=None,
+    model_version="",
+    priority=AnalysisJob.Priority.ROUTINE,
+):
+    """
+    Queue analysis for a selection of images as one AnalysisBatch.
+
+    ``images`` is a MedicalImage queryset. Images that are already analyzed
+    or already queued are left out. The jobs are created with one INSERT and
+    ``analysis_started_at`` is stamped with one UPDATE; no image is loaded
+    or saved. Returns the batch and the ids of the images it queued.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        image_ids = list(
+            images.filter(analyzed=False).order_by().values_list("pk", flat=True)
+        )
+        batch = AnalysisBatch.objects.create(user=user)
+        enqueue_jobs(
+            image_ids,
+            AnalysisJob.Kind.ANALYSIS,
+            max_attempts,
+            batch,
+            model_version,
+            priority,
+        )
+        # bulk_create returns every object, including rows the database
+        # dropped because another request queued the same job meanwhile
+        queued = list(batch.jobs.values_list("image_id", flat=True))
+        MedicalImage.objects.filter(pk__in=queued).update(analysis_started_at=now)
+    return batch, queued
+
+
+def fail_expired_leases(now=None):
+    """Mark jobs whose lease expired after their final attempt as failed"""
+    now = now or timezone.now()
+    return AnalysisJob.objects.filter(
+        status=AnalysisJob.Status.RUNNING,
+        leased_until__lt=now,
+        attempts__gte=F("max_attempts"),
+    ).update(
+        status=AnalysisJob.Status.FAILED,
+        last_error="Lease expired after final attempt",
+        leased_until=None,
+        finished_at=now,
+    )
+
+
+def _running_by_user(now):
+    """Number of jobs of each user held under an unexpired lease"""
+    return dict(
+        AnalysisJob.objects.filter(
+            status=AnalysisJob.Status.RUNNING, leased_until__gte=now
+        )
+        .values("image__user_id")
+        .annotate(running=Count("id"))
+        .order_by()
+        .values_list("image__user_id", "running")
+    )
+
+
+def schedule_jobs(now, limit=1):
+    """
+    Ids of up to ``limit`` leasable jobs to run next, in order.
+
+    Jobs are taken from the most pressing priority class with leasable work.
+    Within it, the next job goes to the user with the fewest running jobs
+    relative to their ``USER_WEIGHTS`` weight, the longest-waiting user first
+    on ties, and is that user's oldest job of the class. Users already
+    running ``USER_CONCURRENCY`` jobs are passed over except for stat jobs.
+    """
+    cap = queue_setting("USER_CONCURRENCY")
+    weights = queue_setting("USER_WEIGHTS")
+    running = defaultdict(int, _running_by_user(now))
+    leasable = AnalysisJob.objects.filter(_leasable(now)).filter(
+        attempts__lt=F("max_attempts")
+    )
+    # One entry per priority class and user with leasable jobs
+    flows = list(
+        leasable.values("priority", "image__user_id")
+        .annotate(oldest=Min("available_at"))
+        .order_by()
+    )
+
+    def share(flow):
+        user_id = flow["image__user_id"]
+        return (
+            PRIORITIES.index(flow["priority"]),
+            running[user_id] / weights.get(user_id, 1.0),
+            flow["oldest"],
+        )
+
+    picked = []
+    while flows and len(picked) < limit:
+        eligible = [
+            flow
+            for flow in flows
+            if not cap
+            or flow["priority"] == AnalysisJob.Priority.STAT
+            or running[flow["image__user_id"]] < cap
+        ]
+        if not eligible:
+            break
+        flow = min(eligible, key=share)
+        candidates = (
+            leasable.filter(
+                priority=flow["priority"], image__user_id=flow["image__user_id"]
+            )
+            .exclude(pk__in=picked)
+            .order_by("available_at", "id")
+        )
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True, of=("self",))
+        job_id = candidates.values_list("id", flat=True).first()
+        if job_id is None:
+            flows.remove(flow)
+            continue
+        picked.append(job_id)
+        running[flow["image__user_id"]] += 1
+    return picked
+
+
+def lease_jobs(worker_id, limit=1, visibility_timeout=None):
+    """
+    Claim up to ``limit`` jobs for ``worker_id``, chosen by ``schedule_jobs``.
+
+    Claimed jobs are hidden from other workers for ``visibility_timeout``
+    seconds. Returns the leased jobs with their images loaded.
+    """
+    now = timezone.now()
+    timeout = visibility_timeout or queue_setting("VISIBILITY_TIMEOUT")
+    leased_until = now + timedelta(seconds=timeout)
+
+    fail_expired_leases(now)
+
+    with transaction.atomic():
+        candidate_ids = schedule_jobs(now, limit)
+        if not candidate_ids:
+            return []
+
+        AnalysisJob.objects.filter(_leasable(now), pk__in=candidate_ids).update(
+            status=AnalysisJob.Status.RUNNING,
+            attempts=F("attempts") + 1,
+            leased_by=worker_id,
+            leased_until=leased_until,
+            first_leased_at=Coalesce(
+                "first_leased_at", Value(now, output_field=models.DateTimeField())
+            ),
+            started_at=now,
+        )
+
+    return list(
+        AnalysisJob.objects.select_related("image").filter(
+            pk__in=candidate_ids,
+            status=AnalysisJob.Status.RUNNING,
+            leased_by=worker_id,
+            leased_until=leased_until,
+        )
+    )
+
+
+def _owned(job):
+    """Filter matching ``job`` only while its lease is still held"""
+    return AnalysisJob.objects.filter(
+        pk=job.pk,
+        status=AnalysisJob.Status.RUNNING,
+        leased_by=job.leased_by,
+        leased_until=job.leased_until,
+    )
+
+
+def extend_lease(job, visibility_timeout=None):
+    """
+    Hide a running job for another ``visibility_timeout`` seconds from now.
+
+    Returns False if the lease was lost.
+    """
+    timeout = visibility_timeout or queue_setting("VISIBILITY_TIMEOUT")
+    leased_until = timezone.now() + timedelta(seconds=timeout)
+    updated = _owned(job).update(leased_until=leased_until)
+    if updated:
+        job.leased_until = leased_until
+    return bool(updated)
+
+
+def complete_job(job):
+    """Mark a leased job as succeeded. Returns False if the lease was lost."""
+    now = timezone.now()
+    updated = _owned(job).update(
+        status=AnalysisJob.Status.SUCCEEDED,
+        leased_until=None,
+        finished_at=now,
+        last_error="",
+    )
+    if updated:
+        job.status = AnalysisJob.Status.SUCCEEDED
+        job.leased_until = None
+        job.finished_at = now
+    return bool(updated)
+
+
+def fail_job(job, error):
+    """
+    Record a failed attempt.
+
+    The job is rescheduled with exponential backoff until it runs out of
+    attempts, after which it is marked as failed. Returns False if the lease
+    was lost.
+    """
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        delay = queue_setting("RETRY_BACKOFF") * 2 ** max(job.attempts - 1, 0)
+        changes = {
+            "status": AnalysisJob.Status.PENDING,
+            "available_at": now + timedelta(seconds=delay),
+        }
+    else:
+        changes = {"status": AnalysisJob.Status.FAILED, "finished_at": now}
+    changes.update(last_error=str(error)[:2000], leased_until=None)
+
+    updated = _owned(job).update(**changes)
+    if updated:
+        for field, value in changes.items():
+            setattr(job, field, value)
+    return bool(updated)
+
+
+def queue_wait_report(since=None):
+    """
+    Queue wait by priority class.
+
+    For each class: the jobs pending now and the age in seconds of the
+    oldest, and the number, mean, median, 95th percentile and maximum of the
+    waits in seconds of jobs first leased since ``since`` (the last hour by
+    default).
+    """
+    now = timezone.now()
+    since = since or now - timedelta(hours=1)
+    pending = {
+        row["priority"]: row
+        for row in AnalysisJob.objects.filter(status=AnalysisJob.Status.PENDING)
+        .values("priority")
+        .annotate(count=Count("id"), oldest=Min("created_at"))
+        .order_by()
+    }
+    waits = defaultdict(list)
+    leased = AnalysisJob.objects.filter(first_leased_at__gte=since).values_list(
+        "priority", "created_at", "first_leased_at"
+    )
+    for priority, created_at, first_leased_at in leased.iterator():
+        waits[priority].append((first_leased_at - created_at).total_seconds())
+
+    report = {}
+    for priority in PRIORITIES:
+        row = pending.get(priority)
+        values = np.array(waits[priority])
+        report[priority.value] = {
+            "pending": row["count"] if row else 0,
+            "oldest_pending": ((now - row["oldest"]).total_seconds() if row else None),
+            "started": len(values),
+            "mean_wait": float(values.mean()) if len(values) else None,
+            "p50_wait": float(np.percentile(values, 50)) if len(values) else None,
+            "p95_wait": float(np.percentile(values, 95)) if len(values) else None,
+            "max_wait": float(values.max()) if len(values) else None,
+        }
+    return report
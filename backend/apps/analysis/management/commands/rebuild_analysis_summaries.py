@@ -0,0 +1,19 @@
+"""
+Rebuild per-user analysis summaries from the image and analysis tables
+"""
+from django.core.management.base import BaseCommand
+
+from ...summary import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard summaries maintained on every upload and analysis"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, nargs="+", help="Only these user ids")
+
+    def handle(self, *args, **options):
+        summaries = rebuild_summaries(options["users"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {len(summaries)} analysis summary(ies)")
+        )
@@ -0,0 +1,60 @@
+"""
+Recompute segmentation metrics of stored analyses against reference masks
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Analysis
+from ...pipeline import index_reference_masks, recompute_metrics
+from ...registry import UnknownModelVersion
+
+
+class Command(BaseCommand):
+    help = (
+        "Score analyses of one model version against reference masks and "
+        "store dice, IoU, precision and recall"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "references",
+            help="Directory of reference masks named <image id> or <sha256>",
+        )
+        parser.add_argument(
+            "--images", type=int, nargs="+", help="Only these image ids"
+        )
+        parser.add_argument(
+            "--model-version",
+            help="Registered model version to score (default: the default model)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=256,
+            help="Analyses predicted, scored and saved together",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            references = index_reference_masks(options["references"])
+        except OSError as exc:
+            raise CommandError(f"Cannot read reference masks: {exc}")
+
+        analyses = Analysis.objects.all()
+        if options["images"]:
+            analyses = analyses.filter(image_id__in=options["images"])
+
+        try:
+            updated, missing = recompute_metrics(
+                analyses,
+                references,
+                chunk_size=options["chunk_size"],
+                model_version=options["model_version"],
+            )
+        except UnknownModelVersion as exc:
+            raise CommandError(f"Unknown model version: {exc}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Updated metrics for {updated} analysis(es); "
+                f"{missing} without a reference mask"
+            )
+        )
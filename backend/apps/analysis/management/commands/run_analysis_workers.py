@@ -0,0 +1,105 @@
+"""
+Run the background analysis worker pool
+"""
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...inference import model_setting
+from ...preprocessing import start_preprocess_pool, stop_preprocess_pool
+from ...registry import UnknownModelVersion, get_registry
+from ...worker import AnalysisWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Process queued image analysis jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, help="Number of worker threads (ANALYSIS_WORKERS)"
+        )
+        parser.add_argument(
+            "--preprocess-workers",
+            type=int,
+            help="Processes preprocessing images into shared memory "
+            "(ANALYSIS_PREPROCESS_WORKERS; 0 preprocesses in worker threads)",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            help="Seconds to sleep when the queue is empty",
+        )
+        parser.add_argument(
+            "--visibility-timeout",
+            type=int,
+            help="Seconds a leased job stays hidden from other workers",
+        )
+        parser.add_argument(
+            "--no-preload",
+            action="store_true",
+            help="Load models on first use instead of at start",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the queue in the foreground and exit",
+        )
+
+    def preload(self):
+        """Load the default and ANALYSIS_PRELOAD_MODELS models"""
+        registry = get_registry()
+        versions = list(
+            dict.fromkeys([registry.default_version, *model_setting("PRELOAD")])
+        )
+        try:
+            registry.preload(versions)
+        except UnknownModelVersion as exc:
+            raise CommandError(f"Unknown model version: {exc}")
+        for version in versions:
+            stats = registry.stats[version]
+            self.stdout.write(
+                f"Loaded model {version} in {stats.load_time:.2f}s "
+                f"(warm-up {stats.warmup_time:.2f}s)"
+            )
+
+    def handle(self, *args, **options):
+        if not options["no_preload"]:
+            self.preload()
+
+        preprocess_pool = start_preprocess_pool(options["preprocess_workers"])
+        if preprocess_pool is not None:
+            preprocess_pool.warm_up()
+            self.stdout.write(
+                f"Started {preprocess_pool.processes} preprocess process(es) "
+                f"with {preprocess_pool.slots} shared slot(s)"
+            )
+        try:
+            self.run(options)
+        finally:
+            stop_preprocess_pool()
+
+    def run(self, options):
+        pool = AnalysisWorkerPool(
+            workers=options["workers"],
+            poll_interval=options["poll_interval"],
+            visibility_timeout=options["visibility_timeout"],
+        )
+
+        if options["once"]:
+            processed = pool.run_once()
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)"))
+            return
+
+        def shutdown(signum, frame):
+            self.stdout.write("Stopping analysis workers...")
+            pool.stop()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        pool.start()
+        self.stdout.write(
+            self.style.SUCCESS(f"Started {pool.workers} analysis worker(s)")
+        )
+        while pool.running:
+            pool.join(timeout=1)
@@ -0,0 +1,113 @@
+"""
+Compare a quantized model export with its float32 model and gate its use
+"""
+from apps.images.models import MedicalImage
+from django.core.management.base import BaseCommand, CommandError
+
+from ...inference import KerasModel, TFLiteModel, model_setting
+from ...pipeline import index_reference_masks
+from ...quantization import (
+    compare_models,
+    export_int8,
+    record_validation,
+    reference_samples,
+)
+from ...registry import registered_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Score a model version's int8 TFLite export and its float32 model "
+        "against reference masks; activate the export only if mean dice and "
+        "IoU drop by at most --max-drop"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "references",
+            help="Directory of reference masks named <image id> or <sha256>",
+        )
+        parser.add_argument(
+            "--model-version",
+            help="Registered model version (default: the default model)",
+        )
+        parser.add_argument(
+            "--images", type=int, nargs="+", help="Only these image ids"
+        )
+        parser.add_argument(
+            "--max-drop",
+            type=float,
+            default=None,
+            help="Largest accepted drop in mean dice or IoU "
+            "(default: ANALYSIS_MAX_QUANTIZATION_DROP)",
+        )
+        parser.add_argument(
+            "--export",
+            action="store_true",
+            help="First (re)build the export from the float32 model, "
+            "calibrated on the reference images",
+        )
+
+    def handle(self, *args, **options):
+        models = registered_models()
+        version = (
+            options["model_version"]
+            or model_setting("DEFAULT_VERSION")
+            or next(reversed(models), None)
+        )
+        if version not in models:
+            raise CommandError(f"No float32 model is registered as {version!r}")
+        path = model_setting("QUANTIZED_MODELS").get(version)
+        if not path:
+            raise CommandError(
+                f"No quantized export is configured for {version}; "
+                "set ANALYSIS_QUANTIZED_MODELS"
+            )
+        max_drop = options["max_drop"]
+        if max_drop is None:
+            max_drop = model_setting("MAX_QUANTIZATION_DROP")
+
+        try:
+            references = index_reference_masks(options["references"])
+        except OSError as exc:
+            raise CommandError(f"Cannot read reference masks: {exc}")
+        images = MedicalImage.objects.all()
+        if options["images"]:
+            images = images.filter(pk__in=options["images"])
+        tensors, masks = reference_samples(
+            references, model_setting("INPUT_SIZE"), images
+        )
+        if not tensors:
+            raise CommandError("No images have a reference mask")
+
+        if options["export"]:
+            export_int8(models[version], path, tensors)
+            self.stdout.write(f"Exported {version} to {path}")
+        try:
+            candidate = TFLiteModel(path, version=version)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot load {path}: {exc}")
+        comparison = compare_models(
+            KerasModel(models[version], version), candidate, tensors, masks
+        )
+        validation = record_validation(version, path, comparison, max_drop)
+
+        self.stdout.write(
+            f"{comparison.images} image(s)\n"
+            f"  float32  dice {comparison.reference_dice:.4f}  "
+            f"IoU {comparison.reference_iou:.4f}\n"
+            f"  int8     dice {comparison.candidate_dice:.4f}  "
+            f"IoU {comparison.candidate_iou:.4f}"
+        )
+        if not validation.passed:
+            raise CommandError(
+                f"Refusing to activate the quantized {version}: dice dropped by "
+                f"{comparison.dice_drop:.4f} and IoU by {comparison.iou_drop:.4f} "
+                f"(limit {max_drop})"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Activated the quantized {version}; workers started with "
+                "ANALYSIS_MODEL_BACKEND=tflite serve it"
+            )
+        )
@@ -0,0 +1,156 @@
+"""
+Compact storage of segmentation masks
+
+Masks are stored as files beside the image blob rather than in
+``Analysis.results``, which only keeps a small reference. The MSK1 format is
+a 16 byte header (magic, height and width as little-endian uint32, codec)
+followed by the mask bit-packed row-major, eight pixels per byte, and
+zlib-compressed. A 512x512 mask is 32 KiB packed, and usually a few hundred
+bytes once compressed.
+"""
+import io
+import re
+import struct
+import zlib
+
+import numpy as np
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+MASK_MAGIC = b"MSK1"
+MASK_HEADER = struct.Struct("<4sIIB3x")
+MASK_CONTENT_TYPE = "application/vnd.medscan.mask"
+CODEC_PACKBITS_ZLIB = 1
+
+
+class MaskError(ValueError):
+    """Stored mask data is not a valid MSK1 payload"""
+
+
+class MaskWriter:
+    """
+    Write an MSK1 payload to a binary file one band of rows at a time.
+
+    Only the compressor state and fewer than eight carried-over pixels are
+    kept between bands, so full-resolution masks of any size can be
+    written without holding them in memory.
+    """
+
+    def __init__(self, fh, height, width):
+        self.fh = fh
+        self.height, self.width = height, width
+        self.rows = 0
+        self.size = fh.write(
+            MASK_HEADER.pack(MASK_MAGIC, height, width, CODEC_PACKBITS_ZLIB)
+        )
+        self._compressor = zlib.compressobj()
+        self._carry = np.empty(0, dtype=bool)
+
+    def write_rows(self, rows):
+        """Append a (rows, width) block; non-zero pixels are foreground"""
+        rows = np.asarray(rows)
+        if rows.ndim != 2 or rows.shape[1] != self.width:
+            raise MaskError(f"Expected rows of width {self.width}, got {rows.shape}")
+        bits = rows.astype(bool, copy=False).ravel()
+        if len(self._carry):
+            bits = np.concatenate([self._carry, bits])
+        whole = len(bits) - len(bits) % 8
+        self._write(np.packbits(bits[:whole]).tobytes())
+        self._carry = bits[whole:].copy()
+        self.rows += len(rows)
+
+    def close(self):
+        """Flush the compressor; every row must have been written"""
+        if self.rows != self.height:
+            raise MaskError(f"Wrote {self.rows} of {self.height} mask rows")
+        if len(self._carry):
+            self._write(np.packbits(self._carry).tobytes())
+        self.size += self.fh.write(self._compressor.flush())
+
+    def _write(self, packed):
+        self.size += self.fh.write(self._compressor.compress(packed))
+
+
+def encode_mask(mask):
+    """Serialize a 2D mask to MSK1 bytes; non-zero pixels are foreground"""
+    mask = np.asarray(mask)
+    if mask.ndim != 2:
+        raise MaskError(f"Expected a 2D mask, got shape {mask.shape}")
+    buffer = io.BytesIO()
+    writer = MaskWriter(buffer, *mask.shape)
+    writer.write_rows(mask)
+    writer.close()
+    return buffer.getvalue()
+
+
+def read_mask_header(data):
+    """Return ``(height, width)`` from the header of MSK1 bytes"""
+    if len(data) < MASK_HEADER.size:
+        raise MaskError("Mask data is truncated")
+    magic, height, width, codec = MASK_HEADER.unpack_from(data)
+    if magic != MASK_MAGIC or codec != CODEC_PACKBITS_ZLIB:
+        raise MaskError("Not an MSK1 mask")
+    return height, width
+
+
+def decode_mask(data):
+    """Decode MSK1 bytes to a boolean (height, width) array"""
+    height, width = read_mask_header(data)
+    try:
+        packed = zlib.decompress(data[MASK_HEADER.size :])
+    except zlib.error as exc:
+        raise MaskError(f"Corrupt mask data: {exc}")
+    if len(packed) != (height * width + 7) // 8:
+        raise MaskError("Mask data does not match its header")
+    bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=height * width)
+    return bits.reshape(height, width).view(bool)
+
+
+def mask_name(image, model_version):
+    """
+    Storage name of the mask of ``image`` by ``model_version``.
+
+    Masks sit beside the content-addressed blob, so images with identical
+    bytes analyzed by the same model share one mask file.
+    """
+    version = re.sub(r"[^A-Za-z0-9._-]+", "-", model_version) or "unversioned"
+    if image.blob_id is not None:
+        sha256 = image.blob.sha256
+        return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}.{version}.msk"
+    return f"masks/{image.pk}/{version}.msk"
+
+
+def store_mask_file(image, model_version, fh, shape):
+    """Store an MSK1 file for ``image`` and return its reference"""
+    name = mask_name(image, model_version)
+    content = File(fh, name=name)
+    size = content.size
+    if not default_storage.exists(name):
+        name = default_storage.save(name, content)
+    return {"name": name, "format": "msk1", "shape": list(shape), "size": size}
+
+
+def save_mask(image, model_version, mask):
+    """Store a mask array for ``image`` and return its reference for ``results``"""
+    return store_mask_file(
+        image, model_version, ContentFile(encode_mask(mask)), np.shape(mask)
+    )
+
+
+def read_mask_bytes(reference):
+    """Raw MSK1 bytes of a stored mask reference"""
+    with default_storage.open(reference["name"], "rb") as fh:
+        return fh.read()
+
+
+def _delete_unreferenced(name):
+    from .models import Analysis
+
+    if not Analysis.objects.filter(results__mask__name=name).exists():
+        default_storage.delete(name)
+
+
+def release_mask(reference):
+    """Delete a mask file once no analysis refers to it any more"""
+    transaction.on_commit(lambda: _delete_unreferenced(reference["name"]))
@@ -0,0 +1,118 @@
+"""
+Segmentation metrics over stacks of binary masks
+
+Masks are bit-packed to one bit per pixel, so a stack of N masks is reduced
+with a handful of bitwise ANDs and popcounts instead of per-pixel boolean
+arrays: true positives are ``popcount(predicted & reference)`` and every
+other count follows from the popcounts of each stack on its own.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+# Packed rows are padded to whole 64-bit words so they can be viewed as such
+WORD_BYTES = 8
+# Set bits of every 16-bit value, for numpy releases without bitwise_count
+POPCOUNT16 = (
+    np.unpackbits(np.arange(1 << 16, dtype=np.uint16).view(np.uint8).reshape(-1, 2))
+    .reshape(-1, 16)
+    .sum(axis=1, dtype=np.uint8)
+)
+
+
+@dataclass
+class SegmentationMetrics:
+    """Per-pair scores of two mask stacks, each an array of length N"""
+
+    dice: np.ndarray
+    iou: np.ndarray
+    precision: np.ndarray
+    recall: np.ndarray
+
+    def __len__(self):
+        return len(self.dice)
+
+    def fields(self, index):
+        """Scores of one pair as Analysis field values"""
+        return {
+            "dice_score": float(self.dice[index]),
+            "iou_score": float(self.iou[index]),
+            "precision": float(self.precision[index]),
+            "recall": float(self.recall[index]),
+        }
+
+
+def pack_masks(masks):
+    """
+    Bit-pack masks to (N, bytes) uint8 rows.
+
+    ``masks`` is an (N, H, W) array, or a sequence of 2D masks that may
+    differ in shape. Non-zero pixels are foreground. Rows are zero-padded to
+    a common multiple of ``WORD_BYTES``; the padding never counts as
+    foreground.
+    """
+    if isinstance(masks, np.ndarray):
+        flat = masks.reshape(len(masks), -1).astype(bool, copy=False)
+        packed = np.packbits(flat, axis=1)
+    else:
+        rows = [np.packbits(np.asarray(mask, dtype=bool).ravel()) for mask in masks]
+        packed = np.zeros((len(rows), max(map(len, rows), default=0)), np.uint8)
+        for index, row in enumerate(rows):
+            packed[index, : len(row)] = row
+    padding = -packed.shape[1] % WORD_BYTES
+    if padding:
+        packed = np.pad(packed, ((0, 0), (0, padding)))
+    return packed
+
+
+def popcount(packed):
+    """Number of set bits in each row of a packed uint8 array"""
+    packed = np.ascontiguousarray(packed)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(packed.view(np.uint64)).sum(axis=1, dtype=np.int64)
+    return POPCOUNT16[packed.view(np.uint16)].sum(axis=1, dtype=np.int64)
+
+
+def _ratio(numerator, denominator, empty):
+    """``numerator / denominator``, or 1.0 where both masks are empty"""
+    scores = np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(len(numerator), dtype=np.float64),
+        where=denominator > 0,
+    )
+    scores[empty] = 1.0
+    return scores
+
+
+def segmentation_metrics(predicted, reference, packed=False):
+    """
+    Dice, IoU, precision and recall for each pair of two mask stacks.
+
+    ``predicted`` and ``reference`` are (N, H, W) masks or sequences of
+    masks whose pairs match in shape, or rows from ``pack_masks`` when
+    ``packed`` is true. A pair where both masks are
+    empty scores 1.0 on every metric; a ratio with an empty denominator
+    otherwise scores 0.0.
+    """
+    if not packed:
+        if any(np.shape(p) != np.shape(r) for p, r in zip(predicted, reference)):
+            raise ValueError("Each predicted mask must match its reference in shape")
+        predicted, reference = pack_masks(predicted), pack_masks(reference)
+    if predicted.shape != reference.shape:
+        raise ValueError(
+            f"Mask stacks differ in shape: {predicted.shape} != {reference.shape}"
+        )
+
+    true_positive = popcount(predicted & reference)
+    predicted_count = popcount(predicted)
+    reference_count = popcount(reference)
+    empty = (predicted_count == 0) & (reference_count == 0)
+
+    union = predicted_count + reference_count - true_positive
+    return SegmentationMetrics(
+        dice=_ratio(2 * true_positive, predicted_count + reference_count, empty),
+        iou=_ratio(true_positive, union, empty),
+        precision=_ratio(true_positive, predicted_count, empty),
+        recall=_ratio(true_positive, reference_count, empty),
+    )
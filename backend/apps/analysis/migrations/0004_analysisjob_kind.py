@@ -0,0 +1,21 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analysis", "0003_analysisjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analysisjob",
+            name="kind",
+            field=models.CharField(
+                choices=[("analysis", "Analysis"), ("tiles", "Tile pyramid")],
+                default="analysis",
+                max_length=16,
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analysis", "0004_analysisjob_kind"),
+        ("images", "0006_medicalimage_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="analysis",
+            index=models.Index(
+                fields=["model_version"], name="analysis_model_version_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analysis", "0006_analysisbatch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analysisjob",
+            name="model_version",
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
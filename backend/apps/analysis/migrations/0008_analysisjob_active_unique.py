@@ -0,0 +1,60 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:49
+
+from django.db import migrations, models
+from django.db.models import Case, Count, Value, When
+from django.utils import timezone
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    """
+    Keep one pending or running job per image, kind and model version.
+
+    Duplicates queued by concurrent requests before the constraint existed
+    are marked failed. A running job is kept over pending ones, since a
+    worker may hold it; otherwise the oldest is kept.
+    """
+    AnalysisJob = apps.get_model("analysis", "AnalysisJob")
+    active = AnalysisJob.objects.filter(status__in=["pending", "running"])
+    duplicated = (
+        active.values("image_id", "kind", "model_version")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    now = timezone.now()
+    for key in duplicated:
+        jobs = active.filter(
+            image_id=key["image_id"],
+            kind=key["kind"],
+            model_version=key["model_version"],
+        )
+        keep = jobs.order_by(
+            Case(When(status="running", then=Value(0)), default=Value(1)),
+            "created_at",
+            "id",
+        ).first()
+        jobs.exclude(pk=keep.pk).update(
+            status="failed",
+            last_error=f"Duplicate of job {keep.pk}",
+            leased_until=None,
+            finished_at=now,
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analysis", "0007_analysisjob_model_version"),
+        ("images", "0006_medicalimage_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="analysisjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ["pending", "running"])),
+                fields=("image", "kind", "model_version"),
+                name="analysis_job_active_unique",
+            ),
+        ),
+    ]
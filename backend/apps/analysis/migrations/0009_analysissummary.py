@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analysis", "0008_analysisjob_active_unique"),
+        ("authentication", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AnalysisSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="analysis_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("uploaded", models.PositiveIntegerField(default=0)),
+                ("analyzed", models.PositiveIntegerField(default=0)),
+                ("processing_time_total", models.FloatField(default=0.0)),
+                ("processing_time_count", models.PositiveIntegerField(default=0)),
+                ("by_model", models.JSONField(blank=True, default=dict)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Analysis Summary",
+                "verbose_name_plural": "Analysis Summaries",
+                "db_table": "analysis_summaries",
+            },
+        ),
+    ]
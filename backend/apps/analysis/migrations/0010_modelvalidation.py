@@ -0,0 +1,49 @@
+# Generated by Django 5.0.1 on 2026-10-17 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analysis", "0009_analysissummary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ModelValidation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_version", models.CharField(max_length=50)),
+                ("backend", models.CharField(max_length=20)),
+                ("export_sha256", models.CharField(max_length=64)),
+                ("images", models.PositiveIntegerField()),
+                ("reference_dice", models.FloatField()),
+                ("reference_iou", models.FloatField()),
+                ("candidate_dice", models.FloatField()),
+                ("candidate_iou", models.FloatField()),
+                ("max_drop", models.FloatField()),
+                ("passed", models.BooleanField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Model Validation",
+                "verbose_name_plural": "Model Validations",
+                "db_table": "analysis_model_validations",
+                "ordering": ["-created_at", "-id"],
+                "indexes": [
+                    models.Index(
+                        fields=["model_version", "backend", "export_sha256"],
+                        name="model_validation_export_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.1 on 2026-10-17 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analysis", "0010_modelvalidation"),
+        ("images", "0006_medicalimage_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analysisjob",
+            name="first_leased_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="analysisjob",
+            name="priority",
+            field=models.CharField(
+                choices=[
+                    ("stat", "Stat"),
+                    ("urgent", "Urgent"),
+                    ("routine", "Routine"),
+                    ("backfill", "Backfill"),
+                ],
+                default="routine",
+                max_length=16,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="analysisjob",
+            index=models.Index(
+                fields=["status", "priority", "available_at"],
+                name="analysis_job_priority_idx",
+            ),
+        ),
+    ]
@@ -1,8 +1,13 @@
 """
 Analysis models
 """
+from functools import cached_property
+
 from apps.images.models import MedicalImage
+from django.conf import settings
 from django.db import models
+from django.db.models import Count, Q
+from django.utils import timezone
 
 
 class Analysis(models.Model):
@@ -32,8 +37,252 @@ class Analysis(models.Model):
     class Meta:
         db_table = "analysis_results"
         ordering = ["-created_at"]
+        indexes = [
+            # Result reuse and per-version recomputation look up by version
+            models.Index(fields=["model_version"], name="analysis_model_version_idx"),
+        ]
         verbose_name = "Analysis"
         verbose_name_plural = "Analyses"
 
     def __str__(self):
         return f"Analysis for {self.image.title or 'Image'} (ID: {self.image.id})"
+
+    @property
+    def mask_reference(self):
+        """Reference to the stored mask file in ``results``, if any"""
+        return (self.results or {}).get("mask")
+
+    @cached_property
+    def mask(self):
+        """Segmentation mask as a boolean array, decoded on first access"""
+        from .masks import decode_mask, read_mask_bytes
+
+        reference = self.mask_reference
+        if reference is None:
+            return None
+        return decode_mask(read_mask_bytes(reference))
+
+
+class AnalysisJob(models.Model):
+    """Queued analysis work item leased by background workers"""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        SUCCEEDED = "succeeded", "Succeeded"
+        FAILED = "failed", "Failed"
+
+    class Kind(models.TextChoices):
+        ANALYSIS = "analysis", "Analysis"
+        TILES = "tiles", "Tile pyramid"
+
+    class Priority(models.TextChoices):
+        # In the order workers serve them
+        STAT = "stat", "Stat"
+        URGENT = "urgent", "Urgent"
+        ROUTINE = "routine", "Routine"
+        BACKFILL = "backfill", "Backfill"
+
+    image = models.ForeignKey(
+        MedicalImage, on_delete=models.CASCADE, related_name="analysis_jobs"
+    )
+    batch = models.ForeignKey(
+        "AnalysisBatch",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="jobs",
+    )
+    kind = models.CharField(max_length=16, choices=Kind.choices, default=Kind.ANALYSIS)
+    # Registered model to analyze with; empty uses the default model
+    model_version = models.CharField(max_length=50, blank=True)
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.PENDING
+    )
+    priority = models.CharField(
+        max_length=16, choices=Priority.choices, default=Priority.ROUTINE
+    )
+
+    # Retry bookkeeping
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+
+    # Leasing
+    available_at = models.DateTimeField(default=timezone.now)
+    leased_by = models.CharField(max_length=255, blank=True)
+    leased_until = models.DateTimeField(null=True, blank=True)
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    # First lease; its distance from created_at is the job's queue wait
+    first_leased_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "analysis_jobs"
+        ordering = ["created_at"]
+        verbose_name = "Analysis Job"
+        verbose_name_plural = "Analysis Jobs"
+        indexes = [
+            models.Index(
+                fields=["status", "available_at"], name="analysis_job_lease_idx"
+            ),
+            models.Index(
+                fields=["status", "priority", "available_at"],
+                name="analysis_job_priority_idx",
+            ),
+        ]
+        constraints = [
+            # At most one queued or running job per image, kind and model,
+            # so concurrent start_analysis requests cannot double-queue
+            models.UniqueConstraint(
+                fields=["image", "kind", "model_version"],
+                condition=models.Q(status__in=["pending", "running"]),
+                name="analysis_job_active_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.get_kind_display()} job {self.id} "
+            f"for image {self.image_id} ({self.status})"
+        )
+
+    @property
+    def is_active(self):
+        """Whether the job is still waiting for or undergoing processing"""
+        return self.status in (self.Status.PENDING, self.Status.RUNNING)
+
+    @property
+    def queue_wait(self):
+        """Seconds from queueing to the first lease, or None"""
+        if self.first_leased_at is None:
+            return None
+        return (self.first_leased_at - self.created_at).total_seconds()
+
+
+class AnalysisBatch(models.Model):
+    """Analysis jobs queued together by one request"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="analysis_batches",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "analysis_batches"
+        ordering = ["-created_at"]
+        verbose_name = "Analysis Batch"
+        verbose_name_plural = "Analysis Batches"
+
+    def __str__(self):
+        return f"Analysis batch {self.id} for {self.user}"
+
+    def progress(self):
+        """Job counts by status, aggregated in a single query"""
+        counts = self.jobs.aggregate(
+            total=Count("id"),
+            **{
+                status: Count("id", filter=Q(status=status))
+                for status in AnalysisJob.Status.values
+            },
+        )
+        finished = counts["succeeded"] + counts["failed"]
+        counts["finished"] = finished
+        counts["complete"] = finished == counts["total"]
+        counts["percent"] = (
+            round(100 * finished / counts["total"], 1) if counts["total"] else 100.0
+        )
+        return counts
+
+
+class AnalysisSummary(models.Model):
+    """
+    Per-user dashboard counters, maintained incrementally.
+
+    Updated in the same transaction as the images and analyses they count;
+    ``rebuild_analysis_summaries`` recomputes them from scratch.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="analysis_summary",
+    )
+    uploaded = models.PositiveIntegerField(default=0)
+    analyzed = models.PositiveIntegerField(default=0)
+    processing_time_total = models.FloatField(default=0.0)
+    processing_time_count = models.PositiveIntegerField(default=0)
+    # Per model version: analysis count and dice/IoU sums and counts
+    by_model = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "analysis_summaries"
+        verbose_name = "Analysis Summary"
+        verbose_name_plural = "Analysis Summaries"
+
+    def __str__(self):
+        return f"Analysis summary for {self.user}"
+
+    @property
+    def pending(self):
+        """Uploaded images not analyzed yet"""
+        return max(self.uploaded - self.analyzed, 0)
+
+    @property
+    def average_processing_time(self):
+        if not self.processing_time_count:
+            return None
+        return self.processing_time_total / self.processing_time_count
+
+
+class ModelValidation(models.Model):
+    """
+    Accuracy check of an alternative backend export against the float32 model.
+
+    The registry only serves a quantized export whose exact file passed its
+    latest validation.
+    """
+
+    model_version = models.CharField(max_length=50)
+    backend = models.CharField(max_length=20)
+    # SHA-256 of the validated export file
+    export_sha256 = models.CharField(max_length=64)
+    images = models.PositiveIntegerField()
+    reference_dice = models.FloatField()
+    reference_iou = models.FloatField()
+    candidate_dice = models.FloatField()
+    candidate_iou = models.FloatField()
+    max_drop = models.FloatField()
+    passed = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "analysis_model_validations"
+        ordering = ["-created_at", "-id"]
+        verbose_name = "Model Validation"
+        verbose_name_plural = "Model Validations"
+        indexes = [
+            models.Index(
+                fields=["model_version", "backend", "export_sha256"],
+                name="model_validation_export_idx",
+            ),
+        ]
+
+    def __str__(self):
+        outcome = "passed" if self.passed else "failed"
+        return f"{self.model_version} {self.backend} validation ({outcome})"
+
+    @property
+    def dice_drop(self):
+        return self.reference_dice - self.candidate_dice
+
+    @property
+    def iou_drop(self):
+        return self.reference_iou - self.candidate_iou
@@ -0,0 +1,367 @@
+"""
+Analysis pipeline run by the background workers
+"""
+import copy
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from apps.images.models import MedicalImage
+from apps.images.render import render_grayscale
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .cache import (
+    METRIC_FIELDS,
+    SingleFlight,
+    cache_result,
+    content_key,
+    release,
+    result_entry,
+    wait_for_result,
+)
+from .events import publish_event
+from .inference import model_setting, preprocess
+from .masks import MaskWriter, release_mask, save_mask, store_mask_file
+from .metrics import segmentation_metrics
+from .models import Analysis
+from .preprocessing import get_preprocess_pool
+from .registry import get_registry
+from .summary import update_summary
+from .tiling import open_pixel_source, predict_tiled
+
+
+def load_grayscale(image):
+    """Decode a MedicalImage file into a 2D uint8 array"""
+    return render_grayscale(image)
+
+
+def save_analysis(image, results, processing_time, model_version, **metrics):
+    """Write the Analysis row for an image and mark the image analyzed"""
+    now = timezone.now()
+    with transaction.atomic():
+        previous = (
+            Analysis.objects.filter(image=image)
+            .only("results", "processing_time", "model_version", *METRIC_FIELDS)
+            .first()
+        )
+        analysis, _ = Analysis.objects.update_or_create(
+            image=image,
+            defaults={
+                "results": results,
+                "processing_time": processing_time,
+                "model_version": model_version,
+                **metrics,
+            },
+        )
+        newly_analyzed = MedicalImage.objects.filter(
+            pk=image.pk, analyzed=False
+        ).update(analyzed=True, analysis_completed_at=now)
+        if not newly_analyzed:
+            MedicalImage.objects.filter(pk=image.pk).update(analysis_completed_at=now)
+        update_summary(
+            image.user_id,
+            analyzed=newly_analyzed,
+            removed=[previous] if previous is not None else [],
+            added=[analysis],
+        )
+        replaced = previous.mask_reference if previous is not None else None
+        if replaced and replaced != analysis.mask_reference:
+            release_mask(replaced)
+    image.analyzed = True
+    image.analysis_completed_at = now
+    return analysis
+
+
+def find_reusable_analysis(image, model_version):
+    """Analysis of another image with identical bytes by the same model"""
+    if image.blob_id is None:
+        return None
+    return (
+        Analysis.objects.filter(
+            image__blob_id=image.blob_id, model_version=model_version
+        )
+        .exclude(image_id=image.pk)
+        .first()
+    )
+
+
+def reuse_result(image, entry):
+    """
+    Save a cached or shared result entry as the analysis of ``image``.
+
+    Results of another image are marked with ``reused_from`` and take no
+    processing time; an image's own result is saved as it was.
+    """
+    results = dict(entry["results"])
+    processing_time = entry["processing_time"]
+    if entry["image_id"] != image.pk:
+        results.pop("model_load_time", None)
+        results["reused_from"] = entry["image_id"]
+        processing_time = 0.0
+    return save_analysis(
+        image,
+        results,
+        processing_time=processing_time,
+        model_version=entry["model_version"],
+        **{field: entry[field] for field in METRIC_FIELDS},
+    )
+
+
+_in_flight = SingleFlight()
+
+
+def analyze_image(image, engine=None, model_version=None):
+    """
+    Run the analysis pipeline for one image and store the result.
+
+    Without an ``engine``, the model registered as ``model_version`` (or the
+    default model) is leased from the model registry; if the call had to
+    wait for that model to load, the wait is stored as ``model_load_time``.
+
+    Results are cached by image content and model version. Images whose
+    bytes were already analyzed by the same model reuse that result without
+    loading the model or running inference, and concurrent calls for the
+    same bytes share a single inference.
+    """
+    if engine is not None:
+        version = engine.model_version
+    else:
+        registry = get_registry()
+        model_version = registry.resolve(model_version)
+        # Results are keyed by the version they are recorded under, which
+        # names the backend serving it
+        version = registry.result_version(model_version)
+
+    key = content_key(image, version)
+
+    def analyze_once():
+        entry, claimed = wait_for_result(key)
+        if entry is not None:
+            return reuse_result(image, entry)
+        try:
+            reusable = find_reusable_analysis(image, version)
+            if reusable is not None:
+                analysis = reuse_result(image, result_entry(reusable))
+            elif engine is not None:
+                analysis = run_analysis(image, engine)
+            else:
+                with registry.acquire(model_version) as lease:
+                    analysis = run_analysis(image, lease.engine, lease.cold_start)
+            cache_result(key, analysis)
+            return analysis
+        finally:
+            if claimed:
+                release(key)
+
+    analysis, shared = _in_flight.do(key, analyze_once)
+    if shared:
+        return reuse_result(image, result_entry(analysis))
+    return analysis
+
+
+@contextmanager
+def prepared_input(image):
+    """
+    Yield ``(tensor, source_shape, seconds)``: the model input of an image.
+
+    With a preprocess pool running, ``tensor`` is a view of its shared
+    memory that is only valid inside the block.
+    """
+    pool = get_preprocess_pool()
+    if pool is not None:
+        with pool.preprocess(image) as prepared:
+            yield prepared
+        return
+    started = time.perf_counter()
+    pixels = load_grayscale(image)
+    tensor = preprocess(pixels, model_setting("INPUT_SIZE"))
+    yield tensor, pixels.shape, time.perf_counter() - started
+
+
+def run_analysis(image, engine, cold_start=0.0):
+    """
+    Segment one image with ``engine`` and store the result.
+
+    Decoding and preprocessing happen in the preprocess pool when one is
+    running and in the calling worker thread otherwise; the forward pass is
+    shared with other workers through the batching engine. ``processing_time``
+    is this image's own preprocessing time plus its share of the batched
+    forward pass.
+    """
+    if needs_tiling(image):
+        return analyze_tiled(image, engine, cold_start)
+
+    with prepared_input(image) as (tensor, source_shape, preprocess_time):
+        publish_event(image, "progress", stage="inference", done=0, total=1)
+        prediction = engine.predict(tensor)
+    publish_event(image, "progress", stage="inference", done=1, total=1)
+
+    results = {
+        "foreground_fraction": float(prediction.mask.mean()),
+        "confidence": prediction.confidence,
+        "mask_shape": list(prediction.mask.shape),
+        "source_shape": list(source_shape),
+        "batch_size": prediction.batch_size,
+        "mask": save_mask(image, prediction.model_version, prediction.mask),
+    }
+    if cold_start:
+        results["model_load_time"] = cold_start
+    return save_analysis(
+        image,
+        results,
+        processing_time=preprocess_time + prediction.inference_time,
+        model_version=prediction.model_version,
+    )
+
+
+def needs_tiling(image):
+    """Whether an image is too large for the model input to be resized"""
+    if not model_setting("TILING") or not image.width or not image.height:
+        return False
+    return max(image.width, image.height) > model_setting("INPUT_SIZE")
+
+
+def analyze_tiled(image, engine, cold_start=0.0):
+    """
+    Segment an image at full resolution with overlapping tiles.
+
+    The mask is streamed to a temporary MSK1 file and then to storage, so
+    neither the mask nor the probabilities are ever held at full size.
+    ``processing_time`` is the wall-clock time of the whole image. A
+    progress event is published after each row of tiles.
+    """
+    started = time.perf_counter()
+
+    def progress(done, total):
+        publish_event(image, "progress", stage="tiles", done=done, total=total)
+
+    with open_pixel_source(image) as source, tempfile.TemporaryFile() as tmp:
+        writer = MaskWriter(tmp, *source.shape)
+        prediction = predict_tiled(
+            source,
+            engine,
+            writer,
+            tile_size=model_setting("INPUT_SIZE"),
+            overlap=model_setting("TILE_OVERLAP"),
+            budget=model_setting("TILE_BUDGET"),
+            progress=progress,
+        )
+        writer.close()
+        tmp.seek(0)
+        reference = store_mask_file(
+            image, prediction.model_version, tmp, prediction.shape
+        )
+
+    results = {
+        "foreground_fraction": prediction.foreground_fraction,
+        "confidence": prediction.confidence,
+        "mask_shape": list(prediction.shape),
+        "source_shape": list(prediction.shape),
+        "tiles": prediction.tiles,
+        "tile_size": model_setting("INPUT_SIZE"),
+        "tile_overlap": model_setting("TILE_OVERLAP"),
+        "mask": reference,
+    }
+    if cold_start:
+        results["model_load_time"] = cold_start
+    return save_analysis(
+        image,
+        results,
+        processing_time=time.perf_counter() - started,
+        model_version=prediction.model_version,
+    )
+
+
+def index_reference_masks(directory):
+    """Map file stems in ``directory`` to reference mask paths"""
+    return {path.stem: path for path in Path(directory).iterdir() if path.is_file()}
+
+
+def load_reference_mask(path, shape):
+    """Read a reference mask as a boolean array resized to ``shape``"""
+    with Image.open(path) as mask:
+        mask = mask.convert("L")
+        if mask.size != (shape[1], shape[0]):
+            mask = mask.resize((shape[1], shape[0]), Image.NEAREST)
+        return np.asarray(mask) > 0
+
+
+def recompute_metrics(
+    analyses, references, engine=None, chunk_size=256, model_version=None
+):
+    """
+    Score stored analyses against reference masks and save the metrics.
+
+    ``references`` maps an image id or blob SHA-256 to a mask file, as
+    returned by ``index_reference_masks``. Only analyses made by the
+    engine's model version are scored. Stored masks are used as they are;
+    analyses without one are predicted again through the batching engine.
+    Each chunk is scored in one vectorized pass and written with one
+    ``bulk_update``. Returns ``(updated, missing)``; analyses without a
+    reference mask are counted as missing. Without an ``engine``, the model
+    registered as ``model_version`` (or the default model) is leased from the
+    model registry.
+    """
+    if engine is None:
+        with get_registry().acquire(model_version) as lease:
+            return recompute_metrics(analyses, references, lease.engine, chunk_size)
+    analyses = (
+        analyses.filter(model_version=engine.model_version)
+        .select_related("image__blob")
+        .order_by("pk")
+    )
+    updated = missing = 0
+    last_pk = 0
+    while True:
+        chunk = list(analyses.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return updated, missing
+        last_pk = chunk[-1].pk
+
+        scored = []
+        for analysis in chunk:
+            image = analysis.image
+            path = references.get(str(image.pk))
+            if path is None and image.blob_id is not None:
+                path = references.get(image.blob.sha256)
+            if path is None:
+                missing += 1
+                continue
+            if analysis.mask_reference is not None:
+                predicted = analysis.mask
+            else:
+                tensor = preprocess(load_grayscale(image), model_setting("INPUT_SIZE"))
+                predicted = engine.submit(tensor)
+            scored.append((analysis, path, predicted))
+        if not scored:
+            continue
+
+        # Tiled analyses store full-resolution masks, so shapes may differ
+        predicted = [
+            mask if isinstance(mask, np.ndarray) else mask.result().mask
+            for _, _, mask in scored
+        ]
+        reference = [
+            load_reference_mask(path, mask.shape)
+            for (_, path, _), mask in zip(scored, predicted)
+        ]
+        metrics = segmentation_metrics(predicted, reference)
+        before, after = defaultdict(list), defaultdict(list)
+        for index, (analysis, _, _) in enumerate(scored):
+            user_id = analysis.image.user_id
+            before[user_id].append(copy.copy(analysis))
+            for field, value in metrics.fields(index).items():
+                setattr(analysis, field, value)
+            after[user_id].append(analysis)
+        with transaction.atomic():
+            Analysis.objects.bulk_update(
+                [analysis for analysis, _, _ in scored], METRIC_FIELDS
+            )
+            for user_id in before:
+                update_summary(user_id, removed=before[user_id], added=after[user_id])
+        updated += len(scored)
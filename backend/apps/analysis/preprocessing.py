@@ -0,0 +1,184 @@
+"""
+Process pool that decodes and preprocesses images into shared memory
+
+Decoding, resizing and normalizing hold the GIL for much of their time, so
+worker threads cannot spread them across cores. With ``PREPROCESS_WORKERS``
+set, each image is instead decoded by one of a pool of processes, which
+writes the model input straight into a slot of a ``TensorRing``: a block of
+``multiprocessing.shared_memory`` holding a fixed number of input tensors.
+Only the file name and the slot number are pickled. The worker process reads
+the finished tensor through a zero-copy view of its slot and hands it to the
+batching engine.
+
+A worker thread holds its slot until its forward pass is done; when every
+slot is taken, further threads wait for one to be released.
+
+Pool processes are spawned, never forked, so they do not inherit database
+connections or TensorFlow state. They only read files through the storage
+backend and never touch the database.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .inference import model_setting
+
+
+class TensorRing:
+    """
+    Fixed slots of float32 model inputs in one shared memory block.
+
+    Created without ``name`` the ring allocates the block and owns it;
+    created with the name of an existing block it attaches to it.
+    """
+
+    def __init__(self, slots, shape, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        size = slots * int(np.prod(self.shape)) * np.dtype(np.float32).itemsize
+        self._owner = name is None
+        self.memory = shared_memory.SharedMemory(
+            name=name, create=self._owner, size=size if self._owner else 0
+        )
+        self._array = np.ndarray(
+            (slots, *self.shape), dtype=np.float32, buffer=self.memory.buf
+        )
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def view(self, slot):
+        """Zero-copy array over one slot"""
+        return self._array[slot]
+
+    def close(self):
+        """Detach, and free the block if this ring created it"""
+        # Views must be gone before the buffer can be released
+        self._array = None
+        self.memory.close()
+        if self._owner:
+            self.memory.unlink()
+
+
+# Ring attached by each pool process
+_ring = None
+
+
+def _attach(name, slots, shape):
+    """Pool process initializer: set up Django and attach to the ring"""
+    global _ring
+    import django
+
+    django.setup()
+    _ring = TensorRing(slots, shape, name=name)
+
+
+def _preprocess_into(file_name, slot, input_size):
+    """Decode and preprocess one image file into ``slot`` of the ring"""
+    from apps.images.models import MedicalImage
+
+    from .inference import preprocess
+    from .pipeline import load_grayscale
+
+    started = time.perf_counter()
+    pixels = load_grayscale(MedicalImage(image=file_name))
+    preprocess(pixels, input_size, out=_ring.view(slot))
+    return pixels.shape, time.perf_counter() - started
+
+
+class PreprocessPool:
+    """
+    Processes preprocessing images into a shared ``TensorRing``.
+
+    ``slots`` bounds the images preprocessed or waiting for inference at
+    once; it defaults to twice the number of processes.
+    """
+
+    def __init__(self, processes, input_size, slots=None):
+        self.processes = processes
+        self.input_size = input_size
+        self.slots = slots or 2 * processes
+        self.ring = TensorRing(self.slots, (input_size, input_size, 1))
+        self._free = queue.Queue()
+        for slot in range(self.slots):
+            self._free.put(slot)
+        self._executor = ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_attach,
+            initargs=(self.ring.name, self.slots, self.ring.shape),
+        )
+
+    @contextmanager
+    def preprocess(self, image):
+        """
+        Yield ``(tensor, source_shape, seconds)`` for a MedicalImage.
+
+        ``tensor`` is a view of shared memory that is reused once the block
+        exits, so the forward pass must finish inside it.
+        """
+        slot = self._free.get()
+        try:
+            future = self._executor.submit(
+                _preprocess_into, image.image.name, slot, self.input_size
+            )
+            source_shape, elapsed = future.result()
+            yield self.ring.view(slot), tuple(source_shape), elapsed
+        finally:
+            self._free.put(slot)
+
+    def warm_up(self):
+        """Start every process now rather than on the first images"""
+        for future in [self._executor.submit(int) for _ in range(self.processes)]:
+            future.result()
+
+    def close(self):
+        """Stop the processes and free the shared memory"""
+        self._executor.shutdown()
+        self.ring.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_preprocess_pool():
+    """The running preprocess pool of this process, if any"""
+    return _pool
+
+
+def start_preprocess_pool(processes=None, slots=None):
+    """
+    Start the process-wide preprocess pool and return it.
+
+    ``processes`` and ``slots`` default to ``PREPROCESS_WORKERS`` and
+    ``PREPROCESS_SLOTS``; with no processes, images are
+    preprocessed in the calling thread and None is returned.
+    """
+    global _pool
+    if processes is None:
+        processes = model_setting("PREPROCESS_WORKERS")
+    if slots is None:
+        slots = model_setting("PREPROCESS_SLOTS")
+    if processes <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = PreprocessPool(processes, model_setting("INPUT_SIZE"), slots)
+        return _pool
+
+
+def stop_preprocess_pool():
+    """Stop the process-wide preprocess pool"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
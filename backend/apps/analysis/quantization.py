@@ -0,0 +1,155 @@
+"""
+Quantized model exports and the accuracy gate that activates them
+
+A registered float32 model can be exported to an int8 TensorFlow Lite file,
+calibrated on real images, and served by the ``tflite`` backend on CPU-only
+nodes. Before the registry serves an export, ``validate_quantized_model``
+segments a reference set with both models and compares mean dice and IoU
+against reference masks. The outcome is recorded as a ``ModelValidation``
+of that exact file. An export that lost more than ``MAX_QUANTIZATION_DROP``
+is refused, and the registry keeps serving the float32 model.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from apps.images.blobs import hash_file
+from apps.images.models import MedicalImage
+
+from .inference import TFLiteModel, model_setting, preprocess
+from .metrics import segmentation_metrics
+from .models import ModelValidation
+from .pipeline import load_grayscale, load_reference_mask
+
+
+def export_sha256(path):
+    """SHA-256 of an export file"""
+    with open(path, "rb") as fh:
+        return hash_file(fh)[0]
+
+
+def is_validated(version, backend, path):
+    """Whether the latest validation of the export at ``path`` passed"""
+    latest = (
+        ModelValidation.objects.filter(
+            model_version=version, backend=backend, export_sha256=export_sha256(path)
+        )
+        .only("passed")
+        .first()
+    )
+    return latest is not None and latest.passed
+
+
+def reference_samples(references, input_size, images=None):
+    """
+    Model inputs of images with a reference mask, and the masks.
+
+    ``references`` maps an image id or blob SHA-256 to a mask file, as
+    returned by ``index_reference_masks``. Returns ``(tensors, masks)``
+    with masks resized to the model input.
+    """
+    if images is None:
+        images = MedicalImage.objects.all()
+    images = images.select_related("blob")
+    tensors, masks = [], []
+    for image in images.order_by("pk").iterator():
+        path = references.get(str(image.pk))
+        if path is None and image.blob_id is not None:
+            path = references.get(image.blob.sha256)
+        if path is None:
+            continue
+        tensors.append(preprocess(load_grayscale(image), input_size))
+        masks.append(load_reference_mask(path, (input_size, input_size)))
+    return tensors, masks
+
+
+def export_int8(model_path, output_path, calibration):
+    """
+    Convert a Keras model to a fully int8-quantized TFLite file.
+
+    ``calibration`` is a sequence of preprocessed ``(H, W, 1)`` tensors
+    used to choose the activation ranges.
+    """
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path, compile=False)
+
+    def representative_dataset():
+        for tensor in calibration:
+            yield [tensor[None].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    with open(output_path, "wb") as fh:
+        fh.write(converter.convert())
+    return output_path
+
+
+@dataclass
+class BackendComparison:
+    """Mean scores of a reference model and a candidate on the same images"""
+
+    images: int
+    reference_dice: float
+    reference_iou: float
+    candidate_dice: float
+    candidate_iou: float
+
+    @property
+    def dice_drop(self):
+        return self.reference_dice - self.candidate_dice
+
+    @property
+    def iou_drop(self):
+        return self.reference_iou - self.candidate_iou
+
+    def passes(self, max_drop):
+        """Whether neither mean dropped by more than ``max_drop``"""
+        return self.dice_drop <= max_drop and self.iou_drop <= max_drop
+
+
+def _masks(model, tensors, batch_size):
+    masks = []
+    for start in range(0, len(tensors), batch_size):
+        probabilities = model.predict(np.stack(tensors[start : start + batch_size]))
+        if probabilities.ndim == 4:
+            probabilities = probabilities[..., 0]
+        masks.extend(probabilities > 0.5)
+    return masks
+
+
+def compare_models(reference, candidate, tensors, masks, batch_size=None):
+    """Score both models against reference ``masks`` on the same inputs"""
+    if not tensors:
+        raise ValueError("No images with a reference mask to compare on")
+    batch_size = batch_size or model_setting("MAX_BATCH_SIZE")
+    scores = [
+        segmentation_metrics(_masks(model, tensors, batch_size), masks)
+        for model in (reference, candidate)
+    ]
+    return BackendComparison(
+        images=len(tensors),
+        reference_dice=float(scores[0].dice.mean()),
+        reference_iou=float(scores[0].iou.mean()),
+        candidate_dice=float(scores[1].dice.mean()),
+        candidate_iou=float(scores[1].iou.mean()),
+    )
+
+
+def record_validation(version, path, comparison, max_drop, backend=None):
+    """Store the outcome of a comparison as the gate of the export at ``path``"""
+    return ModelValidation.objects.create(
+        model_version=version,
+        backend=backend or TFLiteModel.backend,
+        export_sha256=export_sha256(path),
+        images=comparison.images,
+        reference_dice=comparison.reference_dice,
+        reference_iou=comparison.reference_iou,
+        candidate_dice=comparison.candidate_dice,
+        candidate_iou=comparison.candidate_iou,
+        max_drop=max_drop,
+        passed=comparison.passes(max_drop),
+    )
@@ -0,0 +1,310 @@
+"""
+Registry of segmentation models by version
+
+Models are registered by version and loaded lazily, once per process, the
+first time a job asks for them. Each loaded model gets its own
+micro-batching engine and is kept warm in a least-recently-used pool; when
+the estimated memory of the pool exceeds ``MEMORY_LIMIT_MB``, the least
+recently used models that no job is holding are closed.
+
+Loading includes one warm-up forward pass, so graph tracing is paid at load
+time rather than by the first batch. Load times are recorded per version and
+in the results of the analysis that waited for them. Workers preload their
+models at start so the first job after a deploy does not stall.
+
+With ``BACKEND`` set to ``tflite``, versions that have an int8 export in
+``QUANTIZED_MODELS`` are served by it once the export has passed
+``validate_quantized_model``; their results are recorded as
+``<version>+tflite``.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from .inference import (
+    BASELINE_MODEL_VERSION,
+    InferenceEngine,
+    KerasModel,
+    TFLiteModel,
+    ThresholdModel,
+    model_setting,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownModelVersion(LookupError):
+    """No model is registered under the requested version"""
+
+
+def registered_models():
+    """Paths of the float32 models in the ANALYSIS_MODEL settings by version"""
+    models = dict(model_setting("MODELS"))
+    if model_setting("PATH"):
+        path = model_setting("PATH")
+        models[model_setting("VERSION") or Path(path).stem] = path
+    return models
+
+
+@dataclass
+class ModelStats:
+    """Load and usage counters of one model version in this process"""
+
+    loads: int = 0
+    hits: int = 0
+    evictions: int = 0
+    load_time: float = 0.0
+    warmup_time: float = 0.0
+    memory_bytes: int = 0
+
+
+@dataclass
+class LoadedModel:
+    """A warm model, its engine and the number of jobs holding it"""
+
+    version: str
+    engine: InferenceEngine
+    memory_bytes: int
+    leases: int = 0
+
+
+@dataclass
+class ModelLease:
+    """Engine handed to a caller, and how long it waited for a cold load"""
+
+    engine: InferenceEngine
+    cold_start: float = 0.0
+
+
+class ModelRegistry:
+    """
+    Process-wide pool of models, loaded on first use.
+
+    ``loaders`` maps a version to a callable returning a model with a
+    ``version`` and a ``predict(batch)`` method. ``backends`` names the
+    backend of versions not served by their float32 model. ``memory_limit``
+    is in bytes; zero keeps every loaded model.
+    """
+
+    def __init__(
+        self,
+        loaders,
+        default_version,
+        memory_limit=0,
+        max_batch_size=16,
+        max_wait_ms=20,
+        warmup_size=0,
+        backends=None,
+    ):
+        if default_version not in loaders:
+            raise UnknownModelVersion(default_version)
+        self.loaders = dict(loaders)
+        self.backends = dict(backends or {})
+        self.default_version = default_version
+        self.memory_limit = memory_limit
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.warmup_size = warmup_size
+        self.stats = {}
+        self._loaded = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """Build the registry described by the ANALYSIS_MODEL settings"""
+        loaders = {BASELINE_MODEL_VERSION: ThresholdModel}
+        backends = {}
+        models = registered_models()
+        for version, path in models.items():
+            loaders[version] = lambda path=path, version=version: KerasModel(
+                path, version=version
+            )
+        if model_setting("BACKEND") == TFLiteModel.backend:
+            # Imported here: the validation helpers import the pipeline
+            from .quantization import is_validated
+
+            for version, path in model_setting("QUANTIZED_MODELS").items():
+                if version not in models:
+                    continue
+                if not is_validated(version, TFLiteModel.backend, path):
+                    logger.warning(
+                        "Quantized export of %s has not passed validation; "
+                        "serving the float32 model",
+                        version,
+                    )
+                    continue
+                loaders[version] = lambda path=path, version=version: TFLiteModel(
+                    path, version=version, num_threads=model_setting("TFLITE_THREADS")
+                )
+                backends[version] = TFLiteModel.backend
+        default = model_setting("DEFAULT_VERSION")
+        if not default:
+            default = list(models)[-1] if models else BASELINE_MODEL_VERSION
+        return cls(
+            loaders,
+            default,
+            memory_limit=model_setting("MEMORY_LIMIT_MB") * 1024**2,
+            max_batch_size=model_setting("MAX_BATCH_SIZE"),
+            max_wait_ms=model_setting("MAX_WAIT_MS"),
+            warmup_size=model_setting("INPUT_SIZE"),
+            backends=backends,
+        )
+
+    @property
+    def versions(self):
+        """Registered versions, loaded or not"""
+        return list(self.loaders)
+
+    @property
+    def loaded_versions(self):
+        """Loaded versions, least recently used first"""
+        with self._lock:
+            return list(self._loaded)
+
+    def resolve(self, version=None):
+        """Return ``version``, or the default when empty"""
+        version = version or self.default_version
+        if version not in self.loaders:
+            raise UnknownModelVersion(version)
+        return version
+
+    def result_version(self, version=None):
+        """Model version recorded on results of ``version``, with its backend"""
+        version = self.resolve(version)
+        backend = self.backends.get(version)
+        return f"{version}+{backend}" if backend else version
+
+    @contextmanager
+    def acquire(self, version=None):
+        """
+        Yield a ``ModelLease`` for ``version``, loading it if needed.
+
+        A leased model is never evicted; callers should hold the lease for
+        the whole image so an engine is not closed under them.
+        """
+        started = time.perf_counter()
+        entry, cold = self._checkout(self.resolve(version))
+        try:
+            yield ModelLease(
+                entry.engine, time.perf_counter() - started if cold else 0.0
+            )
+        finally:
+            self._release(entry)
+
+    def preload(self, versions=None):
+        """Load ``versions`` (default: the default version) ahead of use"""
+        for version in versions or [self.default_version]:
+            with self.acquire(version):
+                pass
+
+    def close(self):
+        """Close every loaded model's engine"""
+        with self._lock:
+            loaded = list(self._loaded.values())
+            self._loaded.clear()
+        for entry in loaded:
+            entry.engine.close()
+
+    def _checkout(self, version):
+        with self._lock:
+            entry = self._lease(version)
+            if entry is not None:
+                return entry, False
+            load_lock = self._load_locks.setdefault(version, threading.Lock())
+
+        # Only callers of the same version wait for the load
+        with load_lock:
+            with self._lock:
+                entry = self._lease(version)
+            if entry is not None:
+                return entry, True
+            entry = self._load(version)
+            with self._lock:
+                self._loaded[version] = entry
+                entry.leases += 1
+                evicted = self._evict()
+        self._close(evicted)
+        return entry, True
+
+    def _lease(self, version):
+        entry = self._loaded.get(version)
+        if entry is not None:
+            self._loaded.move_to_end(version)
+            entry.leases += 1
+            self.stats[version].hits += 1
+        return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            evicted = self._evict()
+        self._close(evicted)
+
+    def _load(self, version):
+        started = time.perf_counter()
+        model = self.loaders[version]()
+        loaded = time.perf_counter()
+        if self.warmup_size:
+            model.predict(
+                np.zeros((1, self.warmup_size, self.warmup_size, 1), dtype=np.float32)
+            )
+        warmed = time.perf_counter()
+
+        stats = self.stats.setdefault(version, ModelStats())
+        stats.loads += 1
+        stats.load_time = loaded - started
+        stats.warmup_time = warmed - loaded
+        stats.memory_bytes = getattr(model, "memory_bytes", 0)
+        logger.info(
+            "Loaded model %s in %.2fs (warm-up %.2fs, %.1f MiB)",
+            version,
+            stats.load_time,
+            stats.warmup_time,
+            stats.memory_bytes / 1024**2,
+        )
+        engine = InferenceEngine(
+            model, max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms
+        )
+        return LoadedModel(version, engine, stats.memory_bytes)
+
+    def _evict(self):
+        """Drop idle models, least recently used first, until under the limit"""
+        if not self.memory_limit:
+            return []
+        total = sum(entry.memory_bytes for entry in self._loaded.values())
+        evicted = []
+        for version, entry in list(self._loaded.items()):
+            if total <= self.memory_limit:
+                break
+            if entry.leases:
+                continue
+            del self._loaded[version]
+            total -= entry.memory_bytes
+            self.stats[version].evictions += 1
+            evicted.append(entry)
+        return evicted
+
+    def _close(self, evicted):
+        for entry in evicted:
+            logger.info("Evicted model %s", entry.version)
+            entry.engine.close()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the process-wide model registry, creating it on first use"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry.from_settings()
+        return _registry
@@ -0,0 +1,54 @@
+"""
+Analysis serializers
+"""
+from rest_framework import serializers
+
+from .models import AnalysisBatch, AnalysisSummary
+from .summary import METRICS
+
+
+class AnalysisBatchSerializer(serializers.ModelSerializer):
+    """Serializer for an analysis batch and its aggregated progress"""
+
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AnalysisBatch
+        fields = ["id", "created_at", "progress"]
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        """Job counts by status"""
+        return obj.progress()
+
+
+class AnalysisSummarySerializer(serializers.ModelSerializer):
+    """Serializer for a user's dashboard counters"""
+
+    pending = serializers.IntegerField(read_only=True)
+    average_processing_time = serializers.FloatField(read_only=True)
+    models = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AnalysisSummary
+        fields = [
+            "uploaded",
+            "pending",
+            "analyzed",
+            "average_processing_time",
+            "models",
+            "updated_at",
+        ]
+        read_only_fields = fields
+
+    def get_models(self, obj):
+        """Analysis count and mean dice/IoU per model version"""
+        models = {}
+        for version, stats in sorted(obj.by_model.items()):
+            models[version] = {"analyses": stats["analyses"]}
+            for metric in METRICS:
+                count = stats[f"{metric}_count"]
+                models[version][f"mean_{metric}"] = (
+                    stats[f"{metric}_sum"] / count if count else None
+                )
+        return models
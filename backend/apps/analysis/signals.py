@@ -0,0 +1,42 @@
+"""
+Analysis signal handlers
+"""
+from apps.images.models import MedicalImage
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .masks import release_mask
+from .models import Analysis
+from .summary import update_summary
+
+
+@receiver(post_delete, sender=Analysis)
+def release_analysis_mask(sender, instance, **kwargs):
+    """Delete the stored mask once no analysis refers to it"""
+    if instance.mask_reference is not None:
+        release_mask(instance.mask_reference)
+
+
+@receiver(post_delete, sender=Analysis)
+def remove_analysis_from_summary(sender, instance, **kwargs):
+    """Take a deleted analysis out of its owner's summary"""
+    user_id = (
+        MedicalImage.objects.filter(pk=instance.image_id)
+        .values_list("user_id", flat=True)
+        .first()
+    )
+    if user_id is not None:
+        update_summary(user_id, removed=[instance])
+
+
+@receiver(post_save, sender=MedicalImage)
+def count_uploaded_image(sender, instance, created, **kwargs):
+    """Count a new image in its owner's summary"""
+    if created:
+        update_summary(instance.user_id, uploaded=1, analyzed=int(instance.analyzed))
+
+
+@receiver(post_delete, sender=MedicalImage)
+def uncount_deleted_image(sender, instance, **kwargs):
+    """Take a deleted image out of its owner's summary"""
+    update_summary(instance.user_id, uploaded=-1, analyzed=-int(instance.analyzed))
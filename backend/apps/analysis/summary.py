@@ -0,0 +1,160 @@
+"""
+Incrementally maintained per-user analysis summaries
+
+Every write that changes what the dashboard shows applies a delta to the
+user's ``AnalysisSummary`` row in the same transaction: image uploads and
+deletions, analyses saved, replaced or deleted, and recomputed metrics. The
+summary endpoint then reads one row instead of aggregating over
+``medical_images`` and ``analysis_results``.
+
+A user's row is built from full aggregates the first time it is needed, so
+deltas are only ever applied to a row that was correct before the change.
+"""
+from apps.images.models import MedicalImage
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+
+from .models import Analysis, AnalysisSummary
+
+METRICS = ["dice", "iou"]
+
+
+def empty_model_stats():
+    """Counters of a model version with no analyses"""
+    stats = {"analyses": 0}
+    for metric in METRICS:
+        stats[f"{metric}_sum"] = 0.0
+        stats[f"{metric}_count"] = 0
+    return stats
+
+
+def _apply(summary, analysis, sign):
+    """Add (``sign=1``) or remove (``sign=-1``) one analysis"""
+    if analysis.processing_time is not None:
+        summary.processing_time_total += sign * analysis.processing_time
+        summary.processing_time_count += sign
+    version = analysis.model_version
+    stats = summary.by_model.setdefault(version, empty_model_stats())
+    stats["analyses"] += sign
+    for metric in METRICS:
+        value = getattr(analysis, f"{metric}_score")
+        if value is not None:
+            stats[f"{metric}_sum"] += sign * value
+            stats[f"{metric}_count"] += sign
+    if stats["analyses"] <= 0:
+        del summary.by_model[version]
+
+
+def update_summary(user_id, uploaded=0, analyzed=0, removed=(), added=()):
+    """
+    Apply a change to the summary of ``user_id``.
+
+    ``uploaded`` and ``analyzed`` are image count deltas; ``removed`` and
+    ``added`` are analyses (saved or unsaved ``Analysis`` instances) whose
+    previous and new values leave or enter the summary. Call it after the
+    change itself, inside the same transaction. A missing row is built from
+    the tables, which already include the change; for pure removals it is
+    left missing, since the user may be being deleted.
+    """
+    locked = AnalysisSummary.objects.select_for_update().filter(user_id=user_id)
+    with transaction.atomic():
+        summary = locked.first()
+        if summary is None:
+            if not (uploaded > 0 or analyzed > 0 or added):
+                return
+            try:
+                rebuild_summaries([user_id])
+                return
+            except IntegrityError:
+                # Built concurrently by another transaction, whose aggregates
+                # could not see this change yet
+                summary = locked.get()
+        summary.uploaded += uploaded
+        summary.analyzed += analyzed
+        for analysis in removed:
+            _apply(summary, analysis, -1)
+        for analysis in added:
+            _apply(summary, analysis, 1)
+        # Clamped so drift can never violate the column constraints;
+        # rebuild_analysis_summaries corrects it
+        for field in ("uploaded", "analyzed", "processing_time_count"):
+            setattr(summary, field, max(getattr(summary, field), 0))
+        summary.save()
+
+
+def rebuild_summaries(user_ids=None):
+    """
+    Recompute summaries from the tables with two grouped aggregates.
+
+    Rebuilds every user's row, or only ``user_ids``. Returns the rows.
+    """
+    users = get_user_model().objects.all()
+    images = MedicalImage.objects.all()
+    analyses = Analysis.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+        images = images.filter(user_id__in=user_ids)
+        analyses = analyses.filter(image__user_id__in=user_ids)
+
+    with transaction.atomic():
+        summaries = {
+            pk: AnalysisSummary(user_id=pk) for pk in users.values_list("pk", flat=True)
+        }
+        counts = (
+            images.order_by()
+            .values("user_id")
+            .annotate(
+                uploaded=Count("id"), analyzed=Count("id", filter=Q(analyzed=True))
+            )
+        )
+        for row in counts:
+            summary = summaries.get(row["user_id"])
+            if summary is not None:
+                summary.uploaded = row["uploaded"]
+                summary.analyzed = row["analyzed"]
+
+        per_model = (
+            analyses.order_by()
+            .values("image__user_id", "model_version")
+            .annotate(
+                analyses=Count("id"),
+                processing_time_total=Sum("processing_time"),
+                processing_time_count=Count("processing_time"),
+                **{
+                    aggregate: function(f"{metric}_score")
+                    for metric in METRICS
+                    for aggregate, function in (
+                        (f"{metric}_sum", Sum),
+                        (f"{metric}_count", Count),
+                    )
+                },
+            )
+        )
+        for row in per_model:
+            summary = summaries.get(row["image__user_id"])
+            if summary is None:
+                continue
+            summary.processing_time_total += row["processing_time_total"] or 0.0
+            summary.processing_time_count += row["processing_time_count"]
+            stats = {"analyses": row["analyses"]}
+            for metric in METRICS:
+                stats[f"{metric}_sum"] = row[f"{metric}_sum"] or 0.0
+                stats[f"{metric}_count"] = row[f"{metric}_count"]
+            summary.by_model[row["model_version"]] = stats
+
+        AnalysisSummary.objects.filter(user_id__in=list(summaries)).delete()
+        return AnalysisSummary.objects.bulk_create(summaries.values())
+
+
+def get_summary(user):
+    """The summary row of ``user``, built on first use"""
+    summary = AnalysisSummary.objects.filter(user=user).first()
+    if summary is not None:
+        return summary
+    try:
+        (summary,) = rebuild_summaries([user.pk])
+    except IntegrityError:
+        # Built concurrently by another request
+        summary = AnalysisSummary.objects.get(user=user)
+    return summary
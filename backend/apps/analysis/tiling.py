@@ -0,0 +1,222 @@
+"""
+Tiled sliding-window inference for images larger than the model input
+
+The image is covered by a grid of overlapping ``tile_size`` tiles. Tiles are
+cut one band (one row of tiles) at a time, sent through the batching engine
+with at most ``budget`` of them in flight, and their probabilities are
+blended into a band accumulator with a window that fades out across the
+overlap. The blend weights form a separable grid, so they are normalized by
+two 1D coverage arrays rather than a full-size weight image. Rows no later
+tile can reach are thresholded and streamed to a ``MaskWriter``.
+
+Peak memory is the tiles in flight plus a tile-high float32 band and its
+scratch copy. It does not depend on the image height, and grows with the
+width only through those bands (64 MiB for a 32768 pixel wide image with
+256 pixel tiles). That bound holds for DICOM, whose rows are read from a
+memory map. PNG and JPEG files are decoded whole into a uint8 array first,
+which ``IMAGE_MAX_PIXELS`` caps at ingest.
+"""
+import math
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+from apps.images.dicom import default_window, open_dicom, window_level
+from apps.images.render import is_dicom_file, render_grayscale
+
+from .inference import preprocess
+
+
+@dataclass
+class TiledPrediction:
+    """Summary of a tiled prediction; the mask itself went to the writer"""
+
+    shape: tuple
+    tiles: int
+    foreground_fraction: float
+    confidence: float
+    inference_time: float
+    model_version: str
+
+
+class ArraySource:
+    """Rows of a 2D uint8 array that is already in memory"""
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.shape = pixels.shape
+
+    def read_rows(self, start, stop):
+        return self.pixels[start:stop]
+
+
+class DicomSource:
+    """
+    Windowed rows of the first frame of memory-mapped DICOM pixel data.
+
+    Only the rows of the current band are paged in and windowed.
+    """
+
+    # Longest side of the strided view sampled for a default window
+    WINDOW_SAMPLE = 512
+
+    def __init__(self, header, pixels):
+        self.header = header
+        data = pixels[0]
+        if header.samples_per_pixel > 1:
+            data = data[..., 0]
+        self.data = data
+        self.shape = data.shape
+        step = max(1, math.ceil(max(self.shape) / self.WINDOW_SAMPLE))
+        self.center, self.width = default_window(header, data[::step, ::step])
+        self.invert = header.photometric_interpretation == "MONOCHROME1"
+
+    def read_rows(self, start, stop):
+        return window_level(
+            self.data[start:stop],
+            self.center,
+            self.width,
+            self.header.rescale_slope,
+            self.header.rescale_intercept,
+            self.invert,
+        )
+
+
+@contextmanager
+def open_pixel_source(image):
+    """
+    Yield a row source for a MedicalImage.
+
+    DICOM pixel data is read band by band from the memory map. PNG and JPEG
+    files cannot be decoded by region and are decoded whole, up to
+    ``IMAGE_MAX_PIXELS``.
+    """
+    if is_dicom_file(image.image):
+        with open_dicom(image.image) as (header, pixels):
+            yield DicomSource(header, pixels)
+        return
+    yield ArraySource(render_grayscale(image))
+
+
+def tile_positions(length, tile_size, stride):
+    """Start offsets covering ``length``; the last tile is flush with the end"""
+    if length <= tile_size:
+        return [0]
+    positions = list(range(0, length - tile_size, stride))
+    positions.append(length - tile_size)
+    return positions
+
+
+def blend_window(tile_size, overlap):
+    """1D tile weights ramping up across the overlap, positive everywhere"""
+    ramp = np.arange(1, tile_size + 1, dtype=np.float32) / (overlap + 1)
+    return np.minimum(1.0, np.minimum(ramp, ramp[::-1]))
+
+
+def coverage(positions, length, window):
+    """Sum of the window weights of every tile over each pixel"""
+    total = np.zeros(length, dtype=np.float32)
+    for start in positions:
+        stop = min(start + len(window), length)
+        total[start:stop] += window[: stop - start]
+    return total
+
+
+def _cut(rows, x, tile_size):
+    """One tile from a band of rows, edge-padded when the image is smaller"""
+    tile = rows[:, x : x + tile_size]
+    if tile.shape != (tile_size, tile_size):
+        tile = np.pad(
+            tile,
+            ((0, tile_size - tile.shape[0]), (0, tile_size - tile.shape[1])),
+            mode="edge",
+        )
+    return tile
+
+
+def predict_tiled(source, engine, writer, tile_size, overlap, budget, progress=None):
+    """
+    Predict a full-resolution mask for ``source`` and stream it to ``writer``.
+
+    ``source`` has a ``shape`` of ``(height, width)`` and
+    ``read_rows(start, stop)`` returning uint8 rows. At most ``budget``
+    tiles are submitted to the engine and not yet blended at any time.
+    ``progress(done, total)`` is called after each row of tiles.
+    """
+    if not 0 <= overlap < tile_size:
+        raise ValueError("Tile overlap must be smaller than the tile size")
+    height, width = source.shape
+    stride = tile_size - overlap
+    ys = tile_positions(height, tile_size, stride)
+    xs = tile_positions(width, tile_size, stride)
+    window = blend_window(tile_size, overlap)
+    weights = np.outer(window, window)
+    inverse_y = 1 / coverage(ys, height, window)
+    inverse_x = 1 / coverage(xs, width, window)
+
+    band = np.zeros((tile_size, width), dtype=np.float32)
+    scratch = np.empty_like(band)
+    foreground = 0
+    confident = 0.0
+    inference_time = 0.0
+    model_version = engine.model_version
+
+    for index, y in enumerate(ys):
+        rows = source.read_rows(y, min(y + tile_size, height))
+        band_height = len(rows)
+        in_flight = deque()
+
+        def blend():
+            nonlocal inference_time, model_version
+            x, future = in_flight.popleft()
+            prediction = future.result()
+            inference_time += prediction.inference_time
+            model_version = prediction.model_version
+            span = min(tile_size, width - x)
+            weighted = scratch[:band_height, :span]
+            np.multiply(
+                prediction.probabilities[:band_height, :span],
+                weights[:band_height, :span],
+                out=weighted,
+            )
+            band[:band_height, x : x + span] += weighted
+
+        for x in xs:
+            tile = _cut(rows, x, tile_size)
+            in_flight.append((x, engine.submit(preprocess(tile, tile_size))))
+            if len(in_flight) >= budget:
+                blend()
+        while in_flight:
+            blend()
+        del rows
+
+        # Rows above the next band's first row are final
+        final = (ys[index + 1] if index + 1 < len(ys) else height) - y
+        margin = scratch[:final]
+        np.multiply(band[:final], inverse_y[y : y + final, None], out=margin)
+        margin *= inverse_x
+        # Distance from the 0.5 threshold: the sign is the mask, and
+        # confidence is max(p, 1 - p) = 0.5 + |p - 0.5|
+        margin -= 0.5
+        mask = margin > 0
+        foreground += int(np.count_nonzero(mask))
+        confident += 0.5 * margin.size + float(
+            np.abs(margin, out=margin).sum(dtype=np.float64)
+        )
+        writer.write_rows(mask)
+        if progress is not None:
+            progress(index + 1, len(ys))
+
+        band[: tile_size - final] = band[final:]
+        band[tile_size - final :] = 0
+
+    pixels = height * width
+    return TiledPrediction(
+        shape=(height, width),
+        tiles=len(ys) * len(xs),
+        foreground_fraction=foreground / pixels,
+        confidence=confident / pixels,
+        inference_time=inference_time,
+        model_version=model_version,
+    )
@@ -1,9 +1,22 @@
 """
 Analysis URL Configuration
 """
-from django.urls import path
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from .views import (
+    AnalysisBatchViewSet,
+    AnalysisQueueView,
+    AnalysisSummaryView,
+    analysis_events,
+)
+
+router = DefaultRouter()
+router.register(r"batches", AnalysisBatchViewSet, basename="analysis-batches")
 
 urlpatterns = [
-    # Analysis endpoints will be added here
-    # path('', AnalysisView.as_view(), name='analysis'),
+    path("events/", analysis_events, name="analysis-events"),
+    path("summary/", AnalysisSummaryView.as_view(), name="analysis-summary"),
+    path("queue/", AnalysisQueueView.as_view(), name="analysis-queue"),
+    path("", include(router.urls)),
 ]
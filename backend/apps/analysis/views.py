@@ -0,0 +1,111 @@
+"""
+Analysis views
+"""
+from datetime import timedelta
+
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from rest_framework import generics, mixins, status, viewsets
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .events import events_setting, format_event, get_broker
+from .jobs import queue_wait_report
+from .models import AnalysisBatch
+from .serializers import AnalysisBatchSerializer, AnalysisSummarySerializer
+from .summary import get_summary
+
+
+class AnalysisBatchViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Progress of analysis batches started from the image list"""
+
+    permission_classes = (IsAuthenticated,)
+    serializer_class = AnalysisBatchSerializer
+
+    def get_queryset(self):
+        """Return batches for current user only"""
+        return AnalysisBatch.objects.filter(user=self.request.user)
+
+
+class AnalysisSummaryView(generics.RetrieveAPIView):
+    """Dashboard counters of the current user, read from a single row"""
+
+    permission_classes = (IsAuthenticated,)
+    serializer_class = AnalysisSummarySerializer
+
+    def get_object(self):
+        return get_summary(self.request.user)
+
+
+class AnalysisQueueView(APIView):
+    """Queue wait by priority class, for staff"""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        """Report jobs started in the last ``minutes`` (60 by default)"""
+        try:
+            minutes = float(request.query_params.get("minutes", 60))
+        except ValueError:
+            minutes = 0
+        if minutes <= 0:
+            return Response(
+                {"error": "minutes must be a positive number"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        since = timezone.now() - timedelta(minutes=minutes)
+        return Response({"since": since, "priorities": queue_wait_report(since)})
+
+
+def token_user_id(request):
+    """
+    User id of the access token sent with ``request``, or None.
+
+    The token comes from a ``Bearer`` Authorization header, or the ``token``
+    query parameter since browsers' EventSource cannot set headers. Only its
+    signature and expiry are checked; the user is not loaded.
+    """
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        raw = header.removeprefix("Bearer ")
+    else:
+        raw = request.GET.get("token")
+    if not raw:
+        return None
+    try:
+        return AccessToken(raw).get(jwt_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+async def event_stream(user_id):
+    """Server-sent events of ``user_id`` with keep-alive comments when idle"""
+    heartbeat = events_setting("HEARTBEAT")
+    with get_broker().subscribe(user_id) as subscription:
+        yield ": connected\n\n"
+        while True:
+            event = await subscription.get(timeout=heartbeat)
+            yield ": keep-alive\n\n" if event is None else format_event(event)
+
+
+@require_GET
+async def analysis_events(request):
+    """
+    Stream the current user's analysis events as server-sent events.
+
+    Requires an ASGI server; the connection stays open until the client
+    leaves and never touches the database.
+    """
+    user_id = token_user_id(request)
+    if user_id is None:
+        return JsonResponse({"detail": "A valid access token is required"}, status=401)
+    return StreamingHttpResponse(
+        event_stream(user_id),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,188 @@
+"""
+Background worker pool that drains the analysis job queue
+"""
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+
+from apps.images.tiles import build_pyramid
+from django.db import close_old_connections, connection
+
+from .events import publish_event
+from .jobs import complete_job, extend_lease, fail_job, lease_jobs, queue_setting
+from .models import Analysis, AnalysisJob
+from .pipeline import analyze_image
+
+logger = logging.getLogger(__name__)
+
+
+def analysis_event(analysis):
+    """Fields of a finished analysis sent with its ``completed`` event"""
+    return {
+        "id": analysis.pk,
+        "model_version": analysis.model_version,
+        "processing_time": analysis.processing_time,
+        "foreground_fraction": analysis.results.get("foreground_fraction"),
+        "confidence": analysis.results.get("confidence"),
+        "reused": "reused_from" in analysis.results,
+    }
+
+
+class AnalysisWorkerPool:
+    """
+    Pool of threads that lease and process analysis jobs.
+
+    ``handler`` overrides the function run for analysis jobs; other job
+    kinds use the handlers in ``HANDLERS``.
+    """
+
+    HANDLERS = {
+        AnalysisJob.Kind.ANALYSIS: analyze_image,
+        AnalysisJob.Kind.TILES: build_pyramid,
+    }
+
+    def __init__(
+        self, workers=None, poll_interval=None, visibility_timeout=None, handler=None
+    ):
+        self.workers = workers or queue_setting("WORKERS")
+        self.poll_interval = (
+            poll_interval
+            if poll_interval is not None
+            else queue_setting("POLL_INTERVAL")
+        )
+        self.visibility_timeout = visibility_timeout or queue_setting(
+            "VISIBILITY_TIMEOUT"
+        )
+        self.handlers = dict(self.HANDLERS)
+        if handler is not None:
+            self.handlers[AnalysisJob.Kind.ANALYSIS] = handler
+        self._stop = threading.Event()
+        self._threads = []
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def worker_id(self, index):
+        """Return the lease owner name for worker thread ``index``"""
+        return f"{self._prefix}:{index}"
+
+    @contextmanager
+    def renewing_lease(self, job):
+        """
+        Extend the lease of ``job`` every third of the visibility timeout
+        while the block runs.
+
+        Renewal stops before the block exits, so the outcome is recorded
+        against the last ``leased_until`` written.
+        """
+        done = threading.Event()
+
+        def renew():
+            try:
+                while not done.wait(self.visibility_timeout / 3):
+                    try:
+                        if not extend_lease(job, self.visibility_timeout):
+                            logger.warning("Lost the lease on job %s", job.id)
+                            return
+                    except Exception:
+                        logger.exception("Could not extend the lease on job %s", job.id)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=renew, name=f"analysis-lease-{job.pk}")
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def process(self, job):
+        """
+        Run the handler for a leased job and record the outcome.
+
+        The lease is renewed while the handler runs, so jobs may take longer
+        than the visibility timeout. ``started``, ``completed`` and ``failed``
+        events are published to the image owner.
+        """
+        handler = self.handlers[job.kind]
+        event = {"job_id": job.pk, "kind": job.kind}
+        publish_event(job.image, "started", attempt=job.attempts, **event)
+        try:
+            with self.renewing_lease(job):
+                if job.model_version:
+                    result = handler(job.image, model_version=job.model_version)
+                else:
+                    result = handler(job.image)
+        except Exception as exc:
+            logger.exception("%s job %s failed", job.get_kind_display(), job.id)
+            fail_job(job, exc)
+            publish_event(
+                job.image,
+                "failed",
+                error=str(exc)[:200],
+                retrying=job.status == AnalysisJob.Status.PENDING,
+                **event,
+            )
+            return False
+
+        if not complete_job(job):
+            logger.warning("Job %s finished after its lease expired", job.id)
+        if isinstance(result, Analysis):
+            event["analysis"] = analysis_event(result)
+        publish_event(job.image, "completed", **event)
+        return True
+
+    def run_once(self, worker_id=None):
+        """Process queued jobs in the current thread until none are available"""
+        worker_id = worker_id or self.worker_id(0)
+        processed = 0
+        while not self._stop.is_set():
+            jobs = lease_jobs(worker_id, visibility_timeout=self.visibility_timeout)
+            if not jobs:
+                break
+            self.process(jobs[0])
+            processed += 1
+        return processed
+
+    def _loop(self, index):
+        worker_id = self.worker_id(index)
+        logger.info("Analysis worker %s started", worker_id)
+        try:
+            while not self._stop.is_set():
+                close_old_connections()
+                try:
+                    processed = self.run_once(worker_id)
+                except Exception:
+                    logger.exception("Analysis worker %s hit an error", worker_id)
+                    processed = 0
+                if not processed:
+                    self._stop.wait(self.poll_interval)
+        finally:
+            connection.close()
+            logger.info("Analysis worker %s stopped", worker_id)
+
+    def start(self):
+        """Start the worker threads"""
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._loop, args=(index,), name=f"analysis-worker-{index}"
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Ask workers to exit after their current job"""
+        self._stop.set()
+
+    def join(self, timeout=None):
+        """Wait for worker threads to exit"""
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = [t for t in self._threads if t.is_alive()]
+
+    @property
+    def running(self):
+        """Whether any worker thread is still alive"""
+        return any(thread.is_alive() for thread in self._threads)
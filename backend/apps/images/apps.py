@@ -1,7 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from PIL import Image
 
 
 class ImagesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.images"
     label = "images"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # render_image refuses larger PNG and JPEG files itself; Pillow's
+        # default limit would refuse images well below it
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
@@ -0,0 +1,164 @@
+"""
+Content-addressed image storage
+
+Every distinct file is stored once under ``blobs/<ab>/<cd>/<sha256>.<ext>``
+and shared by all MedicalImage rows with the same bytes, so re-uploading a
+study costs no extra storage. Multipart uploads are hashed by the upload
+handlers below while the request body streams in; other files are hashed
+in one chunked pass when they are stored.
+"""
+import hashlib
+from pathlib import Path
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ImageBlob
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def blob_path(sha256, filename):
+    """Storage name of the blob holding ``sha256``"""
+    extension = Path(filename).suffix.lower()
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def hash_file(fh):
+    """Return the SHA-256 hex digest and size of a binary file"""
+    hasher = hashlib.sha256()
+    size = 0
+    fh.seek(0)
+    for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+        hasher.update(chunk)
+        size += len(chunk)
+    fh.seek(0)
+    return hasher.hexdigest(), size
+
+
+def _acquire(sha256):
+    """
+    Take a reference to an existing blob, or return None.
+
+    A blob released to zero but not yet deleted is taken back, which stops
+    its deletion.
+    """
+    if ImageBlob.objects.filter(sha256=sha256).update(ref_count=F("ref_count") + 1):
+        return ImageBlob.objects.get(sha256=sha256)
+    return None
+
+
+def register_blob(sha256, size, filename, place):
+    """
+    Return the blob for content with digest ``sha256`` and take a reference.
+
+    ``place(name)`` is only called for new content; it must write the bytes
+    to storage at ``name`` and return the name actually used.
+    """
+    with transaction.atomic():
+        blob = _acquire(sha256)
+        if blob is not None:
+            return blob
+
+        name = blob_path(sha256, filename)
+        if not default_storage.exists(name):
+            name = place(name)
+        try:
+            with transaction.atomic():
+                return ImageBlob.objects.create(
+                    sha256=sha256, file=name, size=size, ref_count=1
+                )
+        except IntegrityError:
+            # The same bytes were stored concurrently by another upload
+            if name != blob_path(sha256, filename):
+                default_storage.delete(name)
+            return _acquire(sha256)
+
+
+def store_blob(fh, filename):
+    """
+    Return the blob for the contents of ``fh`` and take a reference to it.
+
+    The file is only written to storage if no blob has the same digest.
+    Uses the ``sha256`` attribute set by the hashing upload handlers when
+    present instead of reading the file again.
+    """
+    sha256 = getattr(fh, "sha256", None)
+    if sha256 is None:
+        sha256, size = hash_file(fh)
+    else:
+        size = fh.size
+
+    def place(name):
+        fh.seek(0)
+        return default_storage.save(name, File(fh))
+
+    return register_blob(sha256, size, filename, place)
+
+
+def _delete_unreferenced(blob_id):
+    """Delete a blob that is still without references, and then its file"""
+    with transaction.atomic():
+        # Until this commits, the row lock holds back register_blob from
+        # taking the blob again or from finding the file it is deleting
+        blob = (
+            ImageBlob.objects.select_for_update()
+            .filter(pk=blob_id, ref_count=0)
+            .first()
+        )
+        if blob is None:
+            return
+        blob.delete()
+        default_storage.delete(blob.file.name)
+
+
+def release_blob(blob_id):
+    """
+    Drop one reference; delete the blob and its file at zero.
+
+    The unreferenced row is kept until the release commits, so an upload of
+    the same bytes in the meantime takes it back instead of storing a blob
+    whose file is about to be deleted.
+    """
+    with transaction.atomic():
+        ImageBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(
+            ref_count=F("ref_count") - 1
+        )
+        if not ImageBlob.objects.filter(pk=blob_id, ref_count=0).exists():
+            return False
+        transaction.on_commit(lambda: _delete_unreferenced(blob_id))
+    return True
+
+
+class _HashingMixin:
+    """Hash the chunks this handler keeps and tag the finished upload"""
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed_on = super().receive_data_chunk(raw_data, start)
+        if passed_on is None:
+            self.hasher.update(raw_data)
+        return passed_on
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        if upload is not None:
+            upload.sha256 = self.hasher.hexdigest()
+        return upload
+
+
+class HashingMemoryFileUploadHandler(_HashingMixin, MemoryFileUploadHandler):
+    """MemoryFileUploadHandler that records the SHA-256 of small uploads"""
+
+
+class HashingTemporaryFileUploadHandler(_HashingMixin, TemporaryFileUploadHandler):
+    """TemporaryFileUploadHandler that records the SHA-256 of large uploads"""
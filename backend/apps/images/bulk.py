@@ -0,0 +1,232 @@
+"""
+Bulk ingest of many images in one request
+
+Accepts the files of a multipart form and/or the entries of a zip archive.
+Entries are opened one at a time and handed to a thread pool that spools,
+hashes and header-probes them in parallel (zlib and hashlib release the
+GIL). Results are consumed in input order on the request thread, which
+registers the content-addressed blobs and creates every MedicalImage with a
+single ``bulk_create``.
+"""
+import hashlib
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+
+from apps.analysis.summary import update_summary
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .blobs import HASH_CHUNK_SIZE, register_blob
+from .models import MedicalImage
+from .probe import ImageHeader, probe_image
+from .render import pixel_limit_error
+from .serializers import ALLOWED_EXTENSIONS
+from .tiles import schedule_pyramids
+
+
+class BulkError(Exception):
+    """The request as a whole cannot be processed"""
+
+
+@dataclass
+class Entry:
+    """One file of a bulk request, prepared for ingest"""
+
+    filename: str
+    file: object = None
+    sha256: str = None
+    size: int = 0
+    header: ImageHeader = None
+    error: str = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def bulk_setting(name):
+    """Return a value from the BULK_UPLOADS settings dict"""
+    return settings.BULK_UPLOADS[name]
+
+
+def _skipped(name):
+    """Directory entries and archive metadata such as __MACOSX/ and ._ files"""
+    parts = PurePosixPath(name).parts
+    return name.endswith("/") or any(part.startswith((".", "__")) for part in parts)
+
+
+def iter_sources(files, archive):
+    """
+    Yield ``(filename, opener)`` for each uploaded file and archive entry.
+
+    ``opener()`` returns a binary stream, or is None for archive entries
+    whose declared size is already over the limit. Archive entries are
+    decompressed lazily by whichever thread opens them.
+    """
+    for upload in files:
+        yield upload.name, lambda upload=upload: upload
+    if archive is None:
+        return
+    for info in archive.infolist():
+        if _skipped(info.filename):
+            continue
+        if info.file_size > bulk_setting("MAX_FILE_SIZE"):
+            yield info.filename, None
+        else:
+            yield info.filename, lambda info=info: archive.open(info)
+
+
+def _spool(stream, limit):
+    """Copy ``stream`` to a temporary file, hashing it; None if over ``limit``"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=HASH_CHUNK_SIZE)
+    hasher = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        size += len(chunk)
+        if size > limit:
+            spooled.close()
+            return None, None, size
+        hasher.update(chunk)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled, hasher.hexdigest(), size
+
+
+def prepare(filename, opener):
+    """Validate one file: extension, size, SHA-256 and image header"""
+    entry = Entry(filename=PurePosixPath(filename).name)
+    limit = bulk_setting("MAX_FILE_SIZE")
+    if entry.filename.rsplit(".", 1)[-1].lower() not in ALLOWED_EXTENSIONS:
+        entry.error = "File extension is not allowed"
+        return entry
+    if opener is None:
+        entry.error = f"File size cannot exceed {limit // (1024 * 1024)}MB"
+        return entry
+
+    stream = opener()
+    try:
+        if getattr(stream, "sha256", None) and stream.size <= limit:
+            # Multipart uploads were hashed as they streamed in
+            stream.seek(0)
+            entry.file, entry.sha256, entry.size = stream, stream.sha256, stream.size
+        else:
+            entry.file, entry.sha256, entry.size = _spool(stream, limit)
+    finally:
+        if entry.file is not stream:
+            stream.close()
+    if entry.file is None:
+        entry.error = f"File size cannot exceed {limit // (1024 * 1024)}MB"
+        return entry
+
+    entry.header = probe_image(entry.file)
+    if entry.header is None:
+        entry.error = "Not a valid PNG, JPEG or DICOM image"
+    else:
+        entry.error = pixel_limit_error(entry.header)
+    if entry.error:
+        entry.close()
+    return entry
+
+
+def _prepared(sources, workers):
+    """Prepare sources on a pool, yielding entries in input order"""
+    window = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for filename, opener in sources:
+            window.append(pool.submit(prepare, filename, opener))
+            # Bound the number of spooled files held at once
+            if len(window) >= 2 * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def _open_archive(archive):
+    try:
+        return zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise BulkError("Archive is not a valid zip file")
+
+
+def bulk_ingest(user, files=(), archive=None, title="", description=""):
+    """
+    Ingest many files for ``user``.
+
+    Returns one result dict per file in input order: ``{"filename",
+    "status": "created", "id"}`` or ``{"filename", "status": "error",
+    "error"}``.
+    """
+    archive = _open_archive(archive) if archive is not None else None
+    try:
+        count = len(files)
+        if archive is not None:
+            count += sum(not _skipped(name) for name in archive.namelist())
+        if count == 0:
+            raise BulkError("No files to upload")
+        if count > bulk_setting("MAX_FILES"):
+            raise BulkError(
+                f"A bulk upload cannot contain more than "
+                f"{bulk_setting('MAX_FILES')} files"
+            )
+        results, images = _ingest(user, files, archive, title, description)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    created = iter(images)
+    for result in results:
+        if result["status"] == "created":
+            result["id"] = next(created).pk
+    return results
+
+
+def _ingest(user, files, archive, title, description):
+    results = []
+    images = []
+    with transaction.atomic():
+        entries = _prepared(iter_sources(files, archive), bulk_setting("WORKERS"))
+        for entry in entries:
+            if entry.error:
+                results.append(
+                    {
+                        "filename": entry.filename,
+                        "status": "error",
+                        "error": entry.error,
+                    }
+                )
+                continue
+
+            def place(name, entry=entry):
+                entry.file.seek(0)
+                return default_storage.save(name, File(entry.file))
+
+            try:
+                blob = register_blob(entry.sha256, entry.size, entry.filename, place)
+            finally:
+                entry.close()
+            images.append(
+                MedicalImage(
+                    user=user,
+                    title=title or PurePosixPath(entry.filename).stem,
+                    description=description,
+                    blob=blob,
+                    image=blob.file.name,
+                    file_size=entry.size,
+                    width=entry.header.width,
+                    height=entry.header.height,
+                )
+            )
+            results.append({"filename": entry.filename, "status": "created"})
+
+        MedicalImage.objects.bulk_create(images)
+        if images:
+            # bulk_create sends no post_save signals
+            update_summary(user.pk, uploaded=len(images))
+        schedule_pyramids([image.pk for image in images])
+    return results, images
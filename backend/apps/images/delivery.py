@@ -0,0 +1,141 @@
+"""
+Authenticated delivery of original image files
+
+The API checks ownership and conditional headers, then hands the transfer
+off: to nginx through ``X-Accel-Redirect`` in production, or to object
+storage through a short-lived presigned redirect when media lives on S3.
+Only the development server streams bytes from a Python worker.
+"""
+import hashlib
+import mimetypes
+import re
+from pathlib import PurePosixPath
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def delivery_setting(name):
+    """Return a value from the MEDIA_DELIVERY settings dict"""
+    return settings.MEDIA_DELIVERY[name]
+
+
+def file_etag(image):
+    """Strong validator for the stored bytes of an image"""
+    if image.blob_id is not None:
+        return f'"{image.blob.sha256}"'
+    digest = hashlib.sha1(f"{image.image.name}:{image.file_size}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(header, etag):
+    """Whether an If-None-Match header value matches ``etag``"""
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` inclusive for a single ``bytes=`` range.
+
+    Returns None when the header should be ignored (absent, malformed or
+    multi-range) and raises ValueError when it is unsatisfiable.
+    """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def _read_range(fh, start, length):
+    try:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+def _stream(request, field_file, size, content_type):
+    """Serve the file from this process, honoring a single byte range"""
+    try:
+        byte_range = parse_range(request.headers.get("Range"), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        response = FileResponse(field_file.open("rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(field_file.open("rb"), start, end - start + 1),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def serve_image_file(request, image):
+    """Response delivering the original file of an owned MedicalImage"""
+    field_file = image.image
+    etag = file_etag(image)
+    if etag_matches(request.headers.get("If-None-Match", ""), etag):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    try:
+        field_file.path
+    except NotImplementedError:
+        # Remote storage: the storage URL is presigned and expires quickly
+        return HttpResponseRedirect(field_file.url)
+
+    filename = PurePosixPath(field_file.name).name
+    content_type = mimetypes.guess_type(filename.replace(".dicom", ".dcm"))[0]
+    content_type = content_type or "application/octet-stream"
+    if delivery_setting("BACKEND") == "nginx":
+        # nginx serves the internal location with sendfile and handles Range
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = delivery_setting("ACCEL_PREFIX") + quote(
+            field_file.name
+        )
+    else:
+        size = image.file_size or field_file.size
+        response = _stream(request, field_file, size, content_type)
+
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    response["Content-Disposition"] = f'inline; filename="{filename}"'
+    return response
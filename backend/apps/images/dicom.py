@@ -0,0 +1,367 @@
+"""
+Minimal DICOM Part 10 reader
+
+Walks the data elements of a DICOM file and collects the tags needed for
+image handling. Values that are not needed are skipped with ``seek`` and the
+pixel data element is never read, only located, so parsing cost does not
+depend on image size. Uncompressed pixel data is then memory-mapped, so
+large CT/MR files are paged in on demand instead of copied into memory.
+"""
+import math
+import shutil
+import struct
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import numpy as np
+
+PREAMBLE_LENGTH = 128
+MAGIC = b"DICM"
+COPY_BUFFER_SIZE = 1024 * 1024
+
+IMPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2"
+EXPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2.1"
+DEFLATED_EXPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2.1.99"
+EXPLICIT_VR_BIG_ENDIAN = "1.2.840.10008.1.2.2"
+UNCOMPRESSED_TRANSFER_SYNTAXES = {
+    IMPLICIT_VR_LITTLE_ENDIAN,
+    EXPLICIT_VR_LITTLE_ENDIAN,
+    EXPLICIT_VR_BIG_ENDIAN,
+}
+
+UNDEFINED_LENGTH = 0xFFFFFFFF
+ITEM = (0xFFFE, 0xE000)
+ITEM_DELIMITER = (0xFFFE, 0xE00D)
+SEQUENCE_DELIMITER = (0xFFFE, 0xE0DD)
+PIXEL_DATA = (0x7FE0, 0x0010)
+
+# VRs whose explicit encoding uses 2 reserved bytes and a 4-byte length
+LONG_VRS = {b"OB", b"OD", b"OF", b"OL", b"OV", b"OW", b"SQ", b"SV", b"UC", b"UN"}
+LONG_VRS |= {b"UR", b"UT", b"UV"}
+
+# Tags collected into DicomHeader: tag -> (attribute, VR)
+TAGS = {
+    (0x0002, 0x0010): ("transfer_syntax", "UI"),
+    (0x0008, 0x0060): ("modality", "CS"),
+    (0x0028, 0x0002): ("samples_per_pixel", "US"),
+    (0x0028, 0x0004): ("photometric_interpretation", "CS"),
+    (0x0028, 0x0008): ("number_of_frames", "IS"),
+    (0x0028, 0x0010): ("rows", "US"),
+    (0x0028, 0x0011): ("columns", "US"),
+    (0x0028, 0x0100): ("bits_allocated", "US"),
+    (0x0028, 0x0101): ("bits_stored", "US"),
+    (0x0028, 0x0103): ("pixel_representation", "US"),
+    (0x0028, 0x1050): ("window_center", "DS"),
+    (0x0028, 0x1051): ("window_width", "DS"),
+    (0x0028, 0x1052): ("rescale_intercept", "DS"),
+    (0x0028, 0x1053): ("rescale_slope", "DS"),
+}
+
+
+class DicomError(ValueError):
+    """The file is not a DICOM file this reader can handle"""
+
+
+@dataclass
+class DicomHeader:
+    """Tags of interest and the location of the pixel data"""
+
+    transfer_syntax: str = IMPLICIT_VR_LITTLE_ENDIAN
+    modality: str = ""
+    samples_per_pixel: int = 1
+    photometric_interpretation: str = "MONOCHROME2"
+    number_of_frames: int = 1
+    rows: int = None
+    columns: int = None
+    bits_allocated: int = None
+    bits_stored: int = None
+    pixel_representation: int = 0
+    window_center: list = field(default_factory=list)
+    window_width: list = field(default_factory=list)
+    rescale_intercept: float = 0.0
+    rescale_slope: float = 1.0
+    pixel_data_offset: int = None
+    pixel_data_length: int = None
+
+    @property
+    def little_endian(self):
+        return self.transfer_syntax != EXPLICIT_VR_BIG_ENDIAN
+
+    @property
+    def is_uncompressed(self):
+        return self.transfer_syntax in UNCOMPRESSED_TRANSFER_SYNTAXES
+
+
+def is_dicom(head):
+    """Return True if ``head`` starts with a DICOM Part 10 preamble"""
+    return head[PREAMBLE_LENGTH : PREAMBLE_LENGTH + 4] == MAGIC
+
+
+def _read_exact(fh, size):
+    data = fh.read(size)
+    if len(data) != size:
+        raise DicomError("Unexpected end of DICOM file")
+    return data
+
+
+def _decode(raw, vr, little_endian):
+    if vr == "US":
+        fmt = "<H" if little_endian else ">H"
+        return struct.unpack(fmt, raw[:2])[0]
+    text = raw.decode("ascii", errors="ignore").strip(" \x00")
+    if vr == "IS":
+        return int(text.split("\\")[0] or 0)
+    if vr == "DS":
+        values = [float(v) for v in text.split("\\") if v.strip()]
+        return values
+    return text
+
+
+class _Reader:
+    """Sequential element reader over a seekable binary file"""
+
+    def __init__(self, fh, explicit, little_endian):
+        self.fh = fh
+        self.explicit = explicit
+        self.little_endian = little_endian
+
+    def _unpack(self, fmt, data):
+        return struct.unpack(("<" if self.little_endian else ">") + fmt, data)
+
+    def read_tag(self):
+        data = self.fh.read(4)
+        if len(data) < 4:
+            return None
+        return self._unpack("HH", data)
+
+    def read_element_header(self, tag):
+        """Return ``(vr, length)`` for the element following ``tag``"""
+        if tag[0] == 0xFFFE:
+            # Item and delimiter tags never carry a VR
+            return None, self._unpack("I", _read_exact(self.fh, 4))[0]
+        if not self.explicit:
+            vr = TAGS.get(tag, (None, None))[1]
+            return vr, self._unpack("I", _read_exact(self.fh, 4))[0]
+        vr = _read_exact(self.fh, 2)
+        if vr in LONG_VRS:
+            _read_exact(self.fh, 2)
+            length = self._unpack("I", _read_exact(self.fh, 4))[0]
+        else:
+            length = self._unpack("H", _read_exact(self.fh, 2))[0]
+        return vr.decode("ascii", errors="ignore"), length
+
+    def skip_undefined(self):
+        """Skip a sequence or encapsulated value of undefined length"""
+        while True:
+            tag = self.read_tag()
+            if tag is None:
+                raise DicomError("Unterminated sequence")
+            _, length = self.read_element_header(tag)
+            if tag == SEQUENCE_DELIMITER:
+                return
+            if tag == ITEM and length == UNDEFINED_LENGTH:
+                self.skip_item()
+            elif length:
+                self.fh.seek(length, 1)
+
+    def skip_item(self):
+        """Skip the elements of an item of undefined length"""
+        while True:
+            tag = self.read_tag()
+            if tag is None:
+                raise DicomError("Unterminated item")
+            _, length = self.read_element_header(tag)
+            if tag == ITEM_DELIMITER:
+                return
+            if length == UNDEFINED_LENGTH:
+                self.skip_undefined()
+            elif length:
+                self.fh.seek(length, 1)
+
+
+def _walk(reader, header, stop_group=None):
+    """Read elements into ``header`` until pixel data, EOF or ``stop_group``"""
+    while True:
+        start = reader.fh.tell()
+        tag = reader.read_tag()
+        if tag is None:
+            return
+        if stop_group is not None and tag[0] != stop_group:
+            reader.fh.seek(start)
+            return
+        vr, length = reader.read_element_header(tag)
+
+        if tag == PIXEL_DATA:
+            header.pixel_data_offset = reader.fh.tell()
+            header.pixel_data_length = None if length == UNDEFINED_LENGTH else length
+            return
+        if length == UNDEFINED_LENGTH:
+            reader.skip_undefined()
+            continue
+        if tag in TAGS:
+            name, default_vr = TAGS[tag]
+            value = _decode(
+                _read_exact(reader.fh, length), vr or default_vr, reader.little_endian
+            )
+            if name in ("rescale_intercept", "rescale_slope"):
+                value = value[0] if value else getattr(DicomHeader, name)
+            setattr(header, name, value)
+        elif length:
+            reader.fh.seek(length, 1)
+
+
+def read_dicom_header(fh):
+    """
+    Parse the DICOM header of a seekable binary file.
+
+    Stops at the pixel data element without reading it. The file position
+    afterwards is unspecified.
+    """
+    fh.seek(0)
+    if not is_dicom(fh.read(PREAMBLE_LENGTH + 4)):
+        raise DicomError("Missing DICM preamble")
+
+    header = DicomHeader()
+    # File meta information is always explicit VR little endian
+    _walk(_Reader(fh, explicit=True, little_endian=True), header, stop_group=0x0002)
+
+    syntax = header.transfer_syntax
+    if syntax == DEFLATED_EXPLICIT_VR_LITTLE_ENDIAN:
+        raise DicomError("Deflated DICOM datasets are not supported")
+    explicit = syntax != IMPLICIT_VR_LITTLE_ENDIAN
+    _walk(_Reader(fh, explicit, syntax != EXPLICIT_VR_BIG_ENDIAN), header)
+
+    if header.rows is None or header.columns is None:
+        raise DicomError("DICOM file has no image dimensions")
+    return header
+
+
+def pixel_dtype(header):
+    """NumPy dtype of the stored pixel values"""
+    if header.bits_allocated not in (8, 16, 32):
+        raise DicomError(f"Unsupported BitsAllocated {header.bits_allocated}")
+    kind = "i" if header.pixel_representation else "u"
+    order = "<" if header.little_endian else ">"
+    return np.dtype(f"{order}{kind}{header.bits_allocated // 8}")
+
+
+def map_pixels(path, header):
+    """
+    Memory-map uncompressed pixel data without reading it.
+
+    Returns a read-only array shaped ``(frames, rows, columns)`` or
+    ``(frames, rows, columns, samples)`` backed by the file on disk.
+    """
+    if not header.is_uncompressed:
+        raise DicomError(
+            f"Compressed transfer syntax {header.transfer_syntax} is not supported"
+        )
+    if header.pixel_data_offset is None:
+        raise DicomError("DICOM file has no pixel data")
+
+    shape = (header.number_of_frames, header.rows, header.columns)
+    if header.samples_per_pixel > 1:
+        shape += (header.samples_per_pixel,)
+    dtype = pixel_dtype(header)
+    expected = int(np.prod(shape)) * dtype.itemsize
+    if header.pixel_data_length is not None and header.pixel_data_length < expected:
+        raise DicomError("Pixel data is shorter than Rows x Columns x Frames")
+    return np.memmap(
+        path, dtype=dtype, mode="r", offset=header.pixel_data_offset, shape=shape
+    )
+
+
+def default_window(header, pixels):
+    """
+    Window center/width from the header, else from the modality value range.
+
+    ``pixels`` is only sampled when the header has no window, and callers
+    pass an already strided view so this does not scan the full image.
+    """
+    if header.window_center and header.window_width:
+        return header.window_center[0], max(header.window_width[0], 1.0)
+    low = float(pixels.min()) * header.rescale_slope + header.rescale_intercept
+    high = float(pixels.max()) * header.rescale_slope + header.rescale_intercept
+    return (low + high) / 2, max(high - low, 1.0)
+
+
+def window_level(pixels, center, width, slope=1.0, intercept=0.0, invert=False):
+    """
+    Map stored values to uint8 display values (DICOM PS3.3 C.11.2.1.2).
+
+    Applies the modality rescale and linear VOI window in one vectorized
+    pass using float32 temporaries the size of ``pixels``.
+    """
+    scale = np.float32(slope / (width - 1) if width > 1 else slope)
+    offset = np.float32((intercept - (center - 0.5)) / max(width - 1, 1) + 0.5)
+    values = pixels.astype(np.float32)
+    values *= scale
+    values += offset
+    np.clip(values, 0.0, 1.0, out=values)
+    if invert:
+        np.subtract(1.0, values, out=values)
+    values *= 255.0
+    return values.astype(np.uint8)
+
+
+def render(header, pixels, max_size=None, frame=0, block_rows=512):
+    """
+    Render one frame as a windowed uint8 image.
+
+    With ``max_size`` the frame is decimated by striding the memory map, so
+    only the rows that contribute to the output are paged in. Windowing is
+    done in blocks of ``block_rows`` to bound temporary memory.
+    """
+    data = pixels[frame]
+    if header.samples_per_pixel > 1:
+        # Color DICOM is stored unwindowed; use the first sample as luminance
+        data = data[..., 0]
+
+    step = 1
+    if max_size:
+        step = max(1, math.ceil(max(header.rows, header.columns) / max_size))
+    view = data[::step, ::step]
+
+    center, width = default_window(header, view)
+    invert = header.photometric_interpretation == "MONOCHROME1"
+    out = np.empty(view.shape, dtype=np.uint8)
+    for start in range(0, view.shape[0], block_rows):
+        block = view[start : start + block_rows]
+        out[start : start + block_rows] = window_level(
+            block,
+            center,
+            width,
+            header.rescale_slope,
+            header.rescale_intercept,
+            invert,
+        )
+    return out
+
+
+@contextmanager
+def open_dicom(field_file):
+    """
+    Yield ``(header, pixels)`` for a stored DICOM file.
+
+    Files on local storage are mapped in place. Remote files are first
+    streamed to a temporary file in fixed-size chunks, then mapped.
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+
+    if path is not None:
+        with open(path, "rb") as fh:
+            header = read_dicom_header(fh)
+        yield header, map_pixels(path, header)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".dcm") as tmp:
+        with field_file.open("rb") as src:
+            shutil.copyfileobj(src, tmp, COPY_BUFFER_SIZE)
+        tmp.flush()
+        tmp.seek(0)
+        header = read_dicom_header(tmp)
+        yield header, map_pixels(tmp.name, header)
@@ -0,0 +1,184 @@
+"""
+Direct-to-object-storage uploads
+
+The API presigns a POST policy so the client sends the file straight to the
+bucket, then a commit call verifies the object and creates the MedicalImage.
+Upload bytes never pass through a web worker. Pending uploads are carried
+by a signed token rather than a database row; objects left under
+``DIRECT_UPLOADS["PREFIX"]`` by clients that never commit should be expired
+with a bucket lifecycle rule.
+"""
+import base64
+import hashlib
+import io
+import uuid
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+
+from .blobs import HASH_CHUNK_SIZE, register_blob
+from .models import MedicalImage
+from .probe import probe_image
+from .render import pixel_limit_error
+from .tiles import schedule_pyramid
+from .uploads import UploadError
+
+SIGNING_SALT = "apps.images.direct"
+
+
+def direct_setting(name):
+    """Return a value from the DIRECT_UPLOADS settings dict"""
+    return settings.DIRECT_UPLOADS[name]
+
+
+def s3_client():
+    """boto3 S3 client for the media bucket"""
+    import boto3
+
+    return boto3.client(
+        "s3",
+        region_name=settings.AWS_S3_REGION_NAME,
+        endpoint_url=getattr(settings, "AWS_S3_ENDPOINT_URL", None),
+    )
+
+
+def object_key(name):
+    """S3 key of a storage name, below AWS_LOCATION"""
+    location = getattr(settings, "AWS_LOCATION", "")
+    return f"{location}/{name}" if location else name
+
+
+def presign_upload(user, filename, size, title="", description="", sha256=None):
+    """
+    Return the presigned POST for one upload and the token to commit it.
+
+    The policy pins the object key and exact size. When the client declares
+    the SHA-256 of the file, S3 is also asked to verify it, which lets the
+    commit skip re-reading the object.
+    """
+    if not settings.USE_S3:
+        raise UploadError("Direct uploads require S3 storage", status=409)
+
+    extension = PurePosixPath(filename).suffix.lower()
+    name = f"{direct_setting('PREFIX')}{user.pk}/{uuid.uuid4().hex}{extension}"
+    fields = {}
+    conditions = [["content-length-range", size, size]]
+    if sha256:
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        fields = {
+            "x-amz-checksum-algorithm": "SHA256",
+            "x-amz-checksum-sha256": checksum,
+        }
+        conditions += [{field: value} for field, value in fields.items()]
+
+    expiry = direct_setting("EXPIRY")
+    post = s3_client().generate_presigned_post(
+        settings.AWS_STORAGE_BUCKET_NAME,
+        object_key(name),
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=expiry,
+    )
+    token = signing.dumps(
+        {
+            "user": user.pk,
+            "name": name,
+            "filename": filename,
+            "size": size,
+            "title": title,
+            "description": description,
+            "sha256": sha256,
+        },
+        salt=SIGNING_SALT,
+        compress=True,
+    )
+    return {
+        "url": post["url"],
+        "fields": post["fields"],
+        "token": token,
+        "expires_in": expiry,
+    }
+
+
+def _verified_digest(client, key, head, declared):
+    """SHA-256 of the object, from S3's own checksum when it has one"""
+    reported = head.get("ChecksumSHA256")
+    if declared and reported and base64.b64decode(reported).hex() == declared:
+        return declared
+    body = client.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+    hasher = hashlib.sha256()
+    for chunk in body["Body"].iter_chunks(HASH_CHUNK_SIZE):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def commit_upload(user, token):
+    """
+    Verify an uploaded object and create its MedicalImage.
+
+    Only the leading ``PROBE_BYTES`` are fetched to read the image header.
+    New content is copied server-side to its content-addressed key; a
+    duplicate just takes a reference to the existing blob. The uploaded
+    object is deleted either way.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        claims = signing.loads(
+            token, salt=SIGNING_SALT, max_age=2 * direct_setting("EXPIRY")
+        )
+    except signing.SignatureExpired:
+        raise UploadError("Upload token has expired", status=410)
+    except signing.BadSignature:
+        raise UploadError("Invalid upload token")
+    if claims["user"] != user.pk:
+        raise UploadError("Invalid upload token")
+
+    client = s3_client()
+    bucket = settings.AWS_STORAGE_BUCKET_NAME
+    key = object_key(claims["name"])
+    try:
+        head = client.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    except ClientError:
+        raise UploadError("Uploaded object not found", status=404)
+
+    size = head["ContentLength"]
+    leading = client.get_object(
+        Bucket=bucket, Key=key, Range=f"bytes=0-{direct_setting('PROBE_BYTES') - 1}"
+    )["Body"].read()
+    header = probe_image(io.BytesIO(leading))
+    if size != claims["size"] or header is None:
+        client.delete_object(Bucket=bucket, Key=key)
+        raise UploadError("Upload a valid PNG, JPEG or DICOM image")
+    error = pixel_limit_error(header)
+    if error:
+        client.delete_object(Bucket=bucket, Key=key)
+        raise UploadError(error)
+
+    sha256 = _verified_digest(client, key, head, claims["sha256"])
+
+    def place(name):
+        client.copy({"Bucket": bucket, "Key": key}, bucket, object_key(name))
+        return name
+
+    with transaction.atomic():
+        blob = register_blob(sha256, size, claims["filename"], place)
+        image = MedicalImage(
+            user=user,
+            title=claims["title"],
+            description=claims["description"],
+            blob=blob,
+            image=blob.file.name,
+            file_size=size,
+            width=header.width,
+            height=header.height,
+        )
+        # Metadata was read from the ranged GET; skip probing through storage
+        image._probed_name = image.image.name
+        image.save()
+        schedule_pyramid(image)
+
+    client.delete_object(Bucket=bucket, Key=key)
+    return image
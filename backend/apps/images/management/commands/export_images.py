@@ -0,0 +1,45 @@
+"""
+Stream images and their analyses to a file as NDJSON or CSV
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from ...export import EXPORT_FORMATS, stream_export
+from ...models import MedicalImage
+
+
+class Command(BaseCommand):
+    help = "Export images joined with their analyses without loading them in memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output", choices=sorted(EXPORT_FORMATS), default="ndjson"
+        )
+        parser.add_argument("--file", help="Write here instead of standard output")
+        parser.add_argument("--user", help="Only images of this user email")
+        parser.add_argument(
+            "--analyzed",
+            choices=["true", "false"],
+            help="Only analyzed or only pending images",
+        )
+
+    def handle(self, *args, **options):
+        queryset = MedicalImage.objects.all()
+        if options["user"]:
+            try:
+                user = get_user_model().objects.get(email=options["user"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user with email {options['user']}")
+            queryset = queryset.filter(user=user)
+        if options["analyzed"]:
+            queryset = queryset.filter(analyzed=options["analyzed"] == "true")
+
+        chunks = stream_export(queryset, options["output"])
+        if not options["file"]:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+        with open(options["file"], "w", newline="") as file:
+            for chunk in chunks:
+                file.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported to {options['file']}"))
@@ -0,0 +1,14 @@
+"""
+Remove expired chunked upload sessions and their staging files
+"""
+from django.core.management.base import BaseCommand
+
+from ...uploads import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired, unfinished chunked uploads"
+
+    def handle(self, *args, **options):
+        count = purge_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} upload session(s)"))
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("images", "0002_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="medicalimage",
+            name="pyramid_levels",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("images", "0004_imageblob"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="medicalimage",
+            options={
+                "ordering": ["-uploaded_at", "-id"],
+                "verbose_name": "Medical Image",
+                "verbose_name_plural": "Medical Images",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="medicalimage",
+            index=models.Index(
+                fields=["user", "-uploaded_at", "-id"],
+                name="medical_image_user_recent_idx",
+            ),
+        ),
+    ]
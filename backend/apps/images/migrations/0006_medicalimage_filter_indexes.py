@@ -0,0 +1,36 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("images", "0005_medicalimage_user_recent_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="medicalimage",
+            index=models.Index(
+                condition=models.Q(("analyzed", False)),
+                fields=["user", "-uploaded_at", "-id"],
+                name="medical_image_pending_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="medicalimage",
+            index=models.Index(
+                condition=models.Q(("analyzed", True)),
+                fields=["user", "-uploaded_at", "-id"],
+                name="medical_image_analyzed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="medicalimage",
+            index=models.Index(
+                fields=["user", "width", "height"], name="medical_image_dimensions_idx"
+            ),
+        ),
+    ]
@@ -1,8 +1,34 @@
 """
 Images models
 """
+import uuid
+from pathlib import Path
+
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+
+
+class ImageBlob(models.Model):
+    """
+    Content-addressed image file shared by every MedicalImage with the same
+    bytes. ``ref_count`` tracks how many images point at it; the file is
+    deleted when it drops to zero.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField()
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "image_blobs"
+        verbose_name = "Image Blob"
+        verbose_name_plural = "Image Blobs"
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
 
 
 class MedicalImage(models.Model):
@@ -12,6 +38,14 @@ class MedicalImage(models.Model):
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="images"
     )
     image = models.ImageField(upload_to="medical_images/%Y/%m/%d/")
+    # Set on ingest; ``image`` then names the shared blob file
+    blob = models.ForeignKey(
+        ImageBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="images",
+    )
     title = models.CharField(max_length=255, blank=True)
     description = models.TextField(blank=True)
 
@@ -27,28 +61,155 @@ class MedicalImage(models.Model):
     # Image metadata
     width = models.IntegerField(null=True, blank=True)
     height = models.IntegerField(null=True, blank=True)
-    file_size = models.IntegerField(null=True, blank=True)  # in bytes
+    file_size = models.BigIntegerField(null=True, blank=True)  # in bytes
+
+    # Deep Zoom tile pyramid, set once tiles are generated
+    pyramid_levels = models.PositiveSmallIntegerField(null=True, blank=True)
 
     class Meta:
         db_table = "medical_images"
-        ordering = ["-uploaded_at"]
+        ordering = ["-uploaded_at", "-id"]
+        indexes = [
+            # Per-user newest-first listing and its keyset pagination
+            models.Index(
+                fields=["user", "-uploaded_at", "-id"],
+                name="medical_image_user_recent_idx",
+            ),
+            # ?analyzed= listings; partial where the database supports it,
+            # so each index only holds rows of one state
+            models.Index(
+                fields=["user", "-uploaded_at", "-id"],
+                condition=models.Q(analyzed=False),
+                name="medical_image_pending_idx",
+            ),
+            models.Index(
+                fields=["user", "-uploaded_at", "-id"],
+                condition=models.Q(analyzed=True),
+                name="medical_image_analyzed_idx",
+            ),
+            # ?min_width=/?max_width= and height ranges
+            models.Index(
+                fields=["user", "width", "height"],
+                name="medical_image_dimensions_idx",
+            ),
+        ]
         verbose_name = "Medical Image"
         verbose_name_plural = "Medical Images"
 
     def __str__(self):
         return f"{self.title or 'Image'} - {self.user.email}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Metadata for a file loaded from the database was probed at ingest
+        instance._probed_name = instance.__dict__.get("image")
+        instance._stored_blob_id = instance.__dict__.get("blob_id")
+        return instance
+
+    def image_changed(self):
+        """Whether the image file differs from the one last probed"""
+        if "image" in self.get_deferred_fields() or not self.image:
+            return False
+        if not self.image._committed:
+            return True
+        return self.image.name != getattr(self, "_probed_name", None)
+
+    def extract_metadata(self):
+        """Read size and dimensions from the file header without decoding"""
+        from .probe import probe_image
+
+        self.file_size = self.image.size
+        if self.image._committed:
+            with self.image.open("rb") as fh:
+                header = probe_image(fh)
+        else:
+            header = probe_image(self.image.file)
+        if header is not None:
+            self.width, self.height = header.width, header.height
+
     def save(self, *args, **kwargs):
-        """Override save to extract image metadata"""
-        if self.image:
-            self.file_size = self.image.size
-            # Extract dimensions if available
-            try:
-                from PIL import Image
-
-                img = Image.open(self.image)
-                self.width, self.height = img.size
-            except Exception:
-                pass
-
-        super().save(*args, **kwargs)
+        """
+        Override save to store new files content-addressed and to extract
+        image metadata when the file changes.
+        """
+        from .blobs import release_blob, store_blob
+
+        with transaction.atomic():
+            if self.image_changed():
+                self.extract_metadata()
+                if not self.image._committed:
+                    self.blob = store_blob(self.image.file, self.image.name)
+                    # Like FieldFile.save, rebind the field to the stored name
+                    self.image = self.blob.file.name
+                self.pyramid_levels = None
+                update_fields = kwargs.get("update_fields")
+                if update_fields is not None:
+                    kwargs["update_fields"] = {
+                        *update_fields,
+                        "blob",
+                        "file_size",
+                        "width",
+                        "height",
+                        "pyramid_levels",
+                    }
+
+            super().save(*args, **kwargs)
+
+            previous = getattr(self, "_stored_blob_id", None)
+            if previous is not None and previous != self.blob_id:
+                release_blob(previous)
+        self._probed_name = self.image.name if self.image else None
+        self._stored_blob_id = self.blob_id
+
+
+class UploadSession(models.Model):
+    """Resumable chunked upload that becomes a MedicalImage when finalized"""
+
+    class Status(models.TextChoices):
+        ACTIVE = "active", "Active"
+        COMPLETE = "complete", "Complete"
+        ABORTED = "aborted", "Aborted"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="upload_sessions",
+    )
+    filename = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, blank=True)
+    description = models.TextField(blank=True)
+
+    # Progress
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)  # bytes committed so far
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.ACTIVE
+    )
+    image = models.ForeignKey(
+        MedicalImage, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = "upload_sessions"
+        ordering = ["-created_at"]
+        verbose_name = "Upload Session"
+        verbose_name_plural = "Upload Sessions"
+
+    def __str__(self):
+        return f"Upload {self.filename} ({self.offset}/{self.total_size})"
+
+    @property
+    def part_path(self):
+        """Local staging file that chunks are appended to"""
+        return Path(settings.CHUNKED_UPLOADS["DIR"]) / f"{self.id}.part"
+
+    @property
+    def is_expired(self):
+        return timezone.now() >= self.expires_at
@@ -0,0 +1,20 @@
+"""
+Images pagination
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class ImageCursorPagination(CursorPagination):
+    """
+    Keyset pagination on ``uploaded_at``, newest first.
+
+    Each page is a range scan of the ``medical_image_user_recent_idx`` index
+    seeking from the cursor position, so it costs the same at any depth and
+    needs no ``COUNT(*)``. Only ``uploaded_at`` is encoded in the cursor;
+    images sharing the cursor's timestamp are skipped by an offset, and
+    ``-id`` only fixes their order within a page.
+    """
+
+    ordering = ("-uploaded_at", "-id")
+    page_size_query_param = "page_size"
+    max_page_size = 100
@@ -0,0 +1,85 @@
+"""
+Header-only image metadata probing
+
+Reads just enough of a file to find its dimensions (PNG IHDR, JPEG SOF
+segment, DICOM Rows/Columns) without decoding any pixels.
+"""
+import struct
+from dataclasses import dataclass
+
+from .dicom import DicomError, is_dicom, read_dicom_header
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Start-of-frame markers; C4 (DHT), C8 (JPG) and CC (DAC) share the range
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+@dataclass
+class ImageHeader:
+    """Format and dimensions read from a file header"""
+
+    format: str
+    width: int
+    height: int
+
+
+def _probe_png(fh):
+    fh.seek(8)
+    length, chunk_type = struct.unpack(">I4s", fh.read(8))
+    if chunk_type != b"IHDR" or length < 8:
+        return None
+    width, height = struct.unpack(">II", fh.read(8))
+    return ImageHeader("png", width, height)
+
+
+def _probe_jpeg(fh):
+    fh.seek(2)
+    while True:
+        byte = fh.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = fh.read(1)
+        while marker == b"\xff":  # fill bytes
+            marker = fh.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code == 0xD9 or code == 0xDA:  # EOI / SOS: no frame header found
+            return None
+        if 0xD0 <= code <= 0xD8 or code == 0x01:  # standalone markers
+            continue
+        (length,) = struct.unpack(">H", fh.read(2))
+        if code in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack(">BHH", fh.read(5))
+            return ImageHeader("jpeg", width, height)
+        fh.seek(length - 2, 1)
+
+
+def _probe_dicom(fh):
+    header = read_dicom_header(fh)
+    return ImageHeader("dicom", header.columns, header.rows)
+
+
+def probe_image(fh):
+    """
+    Return the ImageHeader of a seekable binary file, or None.
+
+    Only the header bytes are read. The file position is restored afterwards.
+    """
+    position = fh.tell()
+    try:
+        fh.seek(0)
+        head = fh.read(132)
+        if head.startswith(PNG_SIGNATURE):
+            return _probe_png(fh)
+        if head.startswith(b"\xff\xd8"):
+            return _probe_jpeg(fh)
+        if is_dicom(head):
+            return _probe_dicom(fh)
+        return None
+    except (struct.error, DicomError):
+        return None
+    finally:
+        fh.seek(position)
@@ -0,0 +1,89 @@
+"""
+Decode stored images for display and analysis
+
+Raster formats are decoded with PIL. DICOM pixel data is memory-mapped and
+windowed with NumPy, so only the rows that end up in the output are read.
+PNG and JPEG files cannot be decoded by region: they are always decoded
+whole, and are refused above ``IMAGE_MAX_PIXELS`` to bound that memory.
+"""
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .dicom import PREAMBLE_LENGTH, is_dicom, open_dicom, render
+from .probe import ImageHeader
+
+
+class ImageTooLarge(ValueError):
+    """PNG or JPEG image with more pixels than ``IMAGE_MAX_PIXELS``"""
+
+
+def pixel_limit_error(header):
+    """
+    Return why the image of a probed header is too large to decode, or None.
+
+    Only PNG and JPEG files are limited; DICOM is never decoded whole.
+    """
+    limit = settings.IMAGE_MAX_PIXELS
+    if header.format == "dicom" or header.width * header.height <= limit:
+        return None
+    return f"PNG and JPEG images cannot exceed {limit:,} pixels"
+
+
+def is_dicom_file(field_file):
+    """Sniff the DICOM preamble of a stored file"""
+    with field_file.open("rb") as fh:
+        return is_dicom(fh.read(PREAMBLE_LENGTH + 4))
+
+
+def render_dicom(field_file, max_size=None, window=None):
+    """
+    Render the first frame of a DICOM file as an 8-bit grayscale image.
+
+    ``window`` is an optional ``(center, width)`` overriding the header's
+    VOI window.
+    """
+    with open_dicom(field_file) as (header, pixels):
+        if window is not None:
+            header.window_center, header.window_width = [window[0]], [window[1]]
+        return Image.fromarray(render(header, pixels, max_size=max_size), mode="L")
+
+
+def render_image(image, max_size=None, window=None):
+    """
+    Decode a MedicalImage into an "L" or "RGB" PIL image.
+
+    With ``max_size`` the longest side is reduced to at most that many
+    pixels. ``window`` only applies to DICOM files. Raises ImageTooLarge
+    for PNG and JPEG files above ``IMAGE_MAX_PIXELS``.
+    """
+    if is_dicom_file(image.image):
+        return render_dicom(image.image, max_size=max_size, window=window)
+
+    with image.image.open("rb") as fh:
+        source = Image.open(fh)
+        error = pixel_limit_error(ImageHeader(source.format.lower(), *source.size))
+        if error:
+            raise ImageTooLarge(error)
+        if max_size:
+            # Lets the JPEG decoder scale by 1/2..1/8 while decoding
+            source.draft(source.mode, (max_size, max_size))
+        source.load()
+    if source.mode not in ("L", "RGB"):
+        source = source.convert("RGB" if "A" in source.mode else "L")
+    if max_size:
+        source.thumbnail((max_size, max_size))
+    return source
+
+
+def render_grayscale(image):
+    """
+    Decode a MedicalImage at full resolution into a 2D uint8 array.
+
+    Only the decoded image and the array exist at once, one byte per pixel
+    each for grayscale files.
+    """
+    source = render_image(image)
+    if source.mode != "L":
+        source = source.convert("L")
+    return np.asarray(source)
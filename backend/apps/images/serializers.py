@@ -1,9 +1,28 @@
 """
 Images serializers
 """
+from apps.analysis.models import AnalysisJob
+from apps.analysis.registry import get_registry
+from django.conf import settings
+from django.db.models import F
+from django.urls import reverse
 from rest_framework import serializers
 
-from .models import MedicalImage
+from .models import MedicalImage, UploadSession
+from .probe import probe_image
+from .render import pixel_limit_error
+
+ALLOWED_EXTENSIONS = ["jpg", "jpeg", "png", "dicom", "dcm"]
+
+
+def validate_extension(name):
+    """Reject file names whose extension is not an accepted image format"""
+    extension = name.split(".")[-1].lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        raise serializers.ValidationError(
+            f'File extension "{extension}" is not allowed. '
+            f'Allowed extensions are: {", ".join(ALLOWED_EXTENSIONS)}'
+        )
 
 
 class ImageSerializer(serializers.ModelSerializer):
@@ -30,6 +49,7 @@ class ImageSerializer(serializers.ModelSerializer):
             "width",
             "height",
             "file_size",
+            "pyramid_levels",
         ]
         read_only_fields = [
             "id",
@@ -42,19 +62,79 @@ class ImageSerializer(serializers.ModelSerializer):
             "width",
             "height",
             "file_size",
+            "pyramid_levels",
         ]
 
     def get_image_url(self, obj):
-        """Get full URL for image"""
+        """Get the full URL of the authenticated file endpoint"""
         request = self.context.get("request")
         if obj.image and request:
-            return request.build_absolute_uri(obj.image.url)
+            return request.build_absolute_uri(
+                reverse("images-file", kwargs={"pk": obj.pk})
+            )
         return None
 
 
+def image_rows(queryset):
+    """
+    Plain ``.values()`` rows with every column ImageSerializer outputs,
+    including the owner's email through a join.
+    """
+    return queryset.values(
+        *(name for name in ImageSerializer.Meta.fields if name in ROW_COLUMNS),
+        user_email=F("user__email"),
+    )
+
+
+ROW_COLUMNS = {field.attname for field in MedicalImage._meta.concrete_fields} | {
+    "user",
+    "image",
+}
+_datetime = serializers.DateTimeField()
+
+
+def serialize_image_rows(rows, request=None):
+    """
+    Build ImageSerializer output from ``image_rows`` dicts.
+
+    Skips model instances and per-field serializer dispatch, which dominate
+    the cost of large read-only list responses. Must produce exactly what
+    ``ImageSerializer(many=True)`` would.
+    """
+    storage = MedicalImage._meta.get_field("image").storage
+    host = request.build_absolute_uri("/")[:-1] if request else ""
+    # reverse() once; file URLs only differ by primary key
+    file_url = host + reverse("images-file", kwargs={"pk": 0}).replace("/0/", "/{}/")
+    timestamps = (
+        "analysis_started_at",
+        "analysis_completed_at",
+        "uploaded_at",
+        "updated_at",
+    )
+    data = []
+    for row in rows:
+        item = dict(row)
+        url = None
+        if item["image"]:
+            url = storage.url(item["image"])
+            if url.startswith("/"):
+                url = host + url
+        item["image"] = url
+        item["image_url"] = file_url.format(item["id"]) if url and request else None
+        for name in timestamps:
+            if item[name] is not None:
+                item[name] = _datetime.to_representation(item[name])
+        data.append({name: item[name] for name in ImageSerializer.Meta.fields})
+    return data
+
+
 class ImageUploadSerializer(serializers.ModelSerializer):
     """Serializer for uploading images"""
 
+    # FileField rather than ImageField: PIL cannot open DICOM, so the format
+    # is checked by sniffing the header instead
+    image = serializers.FileField()
+
     class Meta:
         model = MedicalImage
         fields = ["image", "title", "description"]
@@ -65,13 +145,196 @@ class ImageUploadSerializer(serializers.ModelSerializer):
         if value.size > 10 * 1024 * 1024:
             raise serializers.ValidationError("Image file size cannot exceed 10MB")
 
-        # Check file extension
-        allowed_extensions = ["jpg", "jpeg", "png", "dicom", "dcm"]
-        extension = value.name.split(".")[-1].lower()
-        if extension not in allowed_extensions:
+        validate_extension(value.name)
+        header = probe_image(value.file)
+        if header is None:
+            raise serializers.ValidationError("Upload a valid PNG, JPEG or DICOM image")
+        error = pixel_limit_error(header)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable chunked upload sessions"""
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "id",
+            "filename",
+            "title",
+            "description",
+            "total_size",
+            "offset",
+            "status",
+            "image",
+            "created_at",
+            "expires_at",
+        ]
+        read_only_fields = [
+            "id",
+            "offset",
+            "status",
+            "image",
+            "created_at",
+            "expires_at",
+        ]
+
+    def validate_filename(self, value):
+        """Validate the extension of the file being uploaded"""
+        validate_extension(value)
+        return value
+
+    def validate_total_size(self, value):
+        """Validate declared upload size"""
+        max_size = settings.CHUNKED_UPLOADS["MAX_SIZE"]
+        if value <= 0:
+            raise serializers.ValidationError("Upload size must be positive")
+        if value > max_size:
+            raise serializers.ValidationError(
+                f"Upload size cannot exceed {max_size // (1024 * 1024)}MB"
+            )
+        return value
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    """Request for a presigned direct-to-storage upload"""
+
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    title = serializers.CharField(max_length=255, required=False, default="")
+    description = serializers.CharField(required=False, default="", allow_blank=True)
+    sha256 = serializers.RegexField(r"^[0-9a-f]{64}$", required=False, default=None)
+
+    def validate_filename(self, value):
+        """Validate the extension of the file being uploaded"""
+        validate_extension(value)
+        return value
+
+    def validate_size(self, value):
+        """Validate declared upload size"""
+        max_size = settings.DIRECT_UPLOADS["MAX_SIZE"]
+        if value > max_size:
+            raise serializers.ValidationError(
+                f"Upload size cannot exceed {max_size // (1024 * 1024)}MB"
+            )
+        return value
+
+
+class DirectUploadCommitSerializer(serializers.Serializer):
+    """Token returned by the presign step"""
+
+    token = serializers.CharField()
+
+
+class ImageFilterSerializer(serializers.Serializer):
+    """Query parameters accepted by the image list"""
+
+    analyzed = serializers.BooleanField(required=False, allow_null=True, default=None)
+    uploaded_after = serializers.DateTimeField(required=False)
+    uploaded_before = serializers.DateTimeField(required=False)
+    min_width = serializers.IntegerField(required=False, min_value=0)
+    max_width = serializers.IntegerField(required=False, min_value=0)
+    min_height = serializers.IntegerField(required=False, min_value=0)
+    max_height = serializers.IntegerField(required=False, min_value=0)
+
+    LOOKUPS = {
+        "analyzed": "analyzed",
+        "uploaded_after": "uploaded_at__gte",
+        "uploaded_before": "uploaded_at__lt",
+        "min_width": "width__gte",
+        "max_width": "width__lte",
+        "min_height": "height__gte",
+        "max_height": "height__lte",
+    }
+
+    def validate(self, attrs):
+        """Reject empty ranges"""
+        for low, high in (
+            ("uploaded_after", "uploaded_before"),
+            ("min_width", "max_width"),
+            ("min_height", "max_height"),
+        ):
+            if attrs.get(low) is not None and attrs.get(high) is not None:
+                if attrs[low] > attrs[high]:
+                    raise serializers.ValidationError(
+                        f"{low} must not be greater than {high}"
+                    )
+        return attrs
+
+    def filter_queryset(self, queryset):
+        """Apply the validated parameters to a MedicalImage queryset"""
+        lookups = {
+            self.LOOKUPS[name]: value
+            for name, value in self.validated_data.items()
+            if value is not None
+        }
+        return queryset.filter(**lookups)
+
+
+class StartAnalysisSerializer(serializers.Serializer):
+    """Options for queueing analysis; an empty version uses the default model"""
+
+    model_version = serializers.CharField(
+        max_length=50, required=False, allow_blank=True, default=""
+    )
+    priority = serializers.ChoiceField(
+        choices=AnalysisJob.Priority.choices,
+        required=False,
+        default=AnalysisJob.Priority.ROUTINE,
+    )
+
+    def validate_model_version(self, value):
+        """Only registered model versions can be requested"""
+        versions = get_registry().versions
+        if value and value not in versions:
             raise serializers.ValidationError(
-                f'File extension "{extension}" is not allowed. '
-                f'Allowed extensions are: {", ".join(allowed_extensions)}'
+                f'Unknown model version "{value}". '
+                f'Registered versions are: {", ".join(versions)}'
             )
+        return value
 
+
+class BatchAnalysisSerializer(StartAnalysisSerializer):
+    """Images to queue for analysis, by ``ids`` or by list ``filter``"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, allow_empty=False
+    )
+    filter = serializers.DictField(required=False)
+
+    def validate_ids(self, value):
+        """Bound the number of ids in one request"""
+        max_ids = settings.ANALYSIS_QUEUE["MAX_BATCH_IDS"]
+        if len(value) > max_ids:
+            raise serializers.ValidationError(
+                f"Ensure this field has no more than {max_ids} elements."
+            )
+        return value
+
+    def validate_priority(self, value):
+        """Stat is reserved for single images, which skip per-user caps"""
+        if value == AnalysisJob.Priority.STAT:
+            raise serializers.ValidationError(
+                "Stat priority can only be requested for a single image."
+            )
         return value
+
+    def validate_filter(self, value):
+        """Validate the filter with the image list's query parameters"""
+        filters = ImageFilterSerializer(data=value)
+        filters.is_valid(raise_exception=True)
+        return filters
+
+    def validate(self, attrs):
+        """Require exactly one way of selecting images"""
+        if ("ids" in attrs) == ("filter" in attrs):
+            raise serializers.ValidationError("Provide either ids or filter")
+        return attrs
+
+    def select(self, queryset):
+        """Narrow a MedicalImage queryset to the selected images"""
+        if "ids" in self.validated_data:
+            return queryset.filter(pk__in=self.validated_data["ids"])
+        return self.validated_data["filter"].filter_queryset(queryset)
@@ -0,0 +1,24 @@
+"""
+Images signal handlers
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .blobs import release_blob
+from .models import MedicalImage
+from .tiles import delete_pyramid
+
+
+@receiver(post_delete, sender=MedicalImage)
+def release_image_blob(sender, instance, **kwargs):
+    """Drop the deleted image's reference to its stored file"""
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id)
+
+
+@receiver(post_delete, sender=MedicalImage)
+def delete_image_tiles(sender, instance, **kwargs):
+    """Remove the deleted image's tile pyramid once the delete commits"""
+    image_id = instance.pk
+    transaction.on_commit(lambda: delete_pyramid(image_id))
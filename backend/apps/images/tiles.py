@@ -0,0 +1,180 @@
+"""
+Deep Zoom tile pyramids
+
+Level ``max_level`` is the full-resolution image and every level below it
+halves both dimensions (rounding up) down to a single pixel at level 0, as
+in the Deep Zoom (DZI) format. Each level is cut into square tiles stored
+under ``tiles/<image id>/<level>/<column>_<row>.<format>``.
+"""
+import hashlib
+import io
+import math
+
+from apps.analysis.jobs import enqueue_job, enqueue_jobs
+from apps.analysis.models import AnalysisJob
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .models import MedicalImage
+from .render import render_image
+
+CONTENT_TYPES = {"png": "image/png", "jpeg": "image/jpeg"}
+
+
+def tile_setting(name):
+    """Return a value from the IMAGE_TILES settings dict"""
+    return settings.IMAGE_TILES[name]
+
+
+def max_level(width, height):
+    """Index of the full-resolution level"""
+    return math.ceil(math.log2(max(width, height, 1)))
+
+
+def level_size(width, height, level):
+    """Pixel dimensions of ``level``"""
+    scale = 2 ** (max_level(width, height) - level)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def tile_grid(width, height, level, tile_size=None):
+    """Number of tile columns and rows at ``level``"""
+    tile_size = tile_size or tile_setting("TILE_SIZE")
+    level_width, level_height = level_size(width, height, level)
+    return math.ceil(level_width / tile_size), math.ceil(level_height / tile_size)
+
+
+def tile_path(image_id, level, column, row):
+    return f"tiles/{image_id}/{level}/{column}_{row}.{tile_setting('FORMAT')}"
+
+
+def pyramid_token(image):
+    """Short digest identifying the file a pyramid was built from"""
+    return hashlib.sha1(image.image.name.encode()).hexdigest()[:12]
+
+
+def tile_cache_key(image, level, column, row):
+    return f"tile:{image.pk}:{pyramid_token(image)}:{level}:{column}:{row}"
+
+
+def open_source(image):
+    """
+    Decode the full-resolution image for tiling.
+
+    The whole image is decoded, so PNG and JPEG files are limited to
+    ``IMAGE_MAX_PIXELS`` by ``render_image``.
+    """
+    return render_image(image)
+
+
+def _encode(tile):
+    buffer = io.BytesIO()
+    fmt = tile_setting("FORMAT")
+    if fmt == "jpeg":
+        tile.save(buffer, format="JPEG", quality=tile_setting("JPEG_QUALITY"))
+    else:
+        tile.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def delete_pyramid(image_id):
+    """Remove stored tiles of an image"""
+    root = f"tiles/{image_id}"
+    try:
+        levels, _ = default_storage.listdir(root)
+    except (FileNotFoundError, NotImplementedError):
+        return
+    for level in levels:
+        _, files = default_storage.listdir(f"{root}/{level}")
+        for name in files:
+            default_storage.delete(f"{root}/{level}/{name}")
+
+
+def build_pyramid(image, source=None):
+    """
+    Generate and store every tile of every level for ``image``.
+
+    Starts from the full-resolution image and halves it with a box filter
+    for each lower level, so each level is computed from the previous one
+    rather than from the original. Returns the number of tiles written.
+    """
+    source = source if source is not None else open_source(image)
+    tile_size = tile_setting("TILE_SIZE")
+    width, height = source.size
+    top = max_level(width, height)
+
+    delete_pyramid(image.pk)
+    written = 0
+    current = source
+    for level in range(top, -1, -1):
+        level_width, level_height = current.size
+        for row in range(math.ceil(level_height / tile_size)):
+            for column in range(math.ceil(level_width / tile_size)):
+                left, upper = column * tile_size, row * tile_size
+                tile = current.crop(
+                    (
+                        left,
+                        upper,
+                        min(left + tile_size, level_width),
+                        min(upper + tile_size, level_height),
+                    )
+                )
+                default_storage.save(
+                    tile_path(image.pk, level, column, row),
+                    ContentFile(_encode(tile)),
+                )
+                written += 1
+        if level:
+            current = current.reduce(2)
+
+    MedicalImage.objects.filter(pk=image.pk).update(pyramid_levels=top + 1)
+    image.pyramid_levels = top + 1
+    return written
+
+
+def read_tile(image, level, column, row):
+    """
+    Return encoded tile bytes, or None if the tile does not exist.
+
+    Tiles are served from the cache and loaded from storage on a miss.
+    """
+    key = tile_cache_key(image, level, column, row)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    name = tile_path(image.pk, level, column, row)
+    if not default_storage.exists(name):
+        return None
+    with default_storage.open(name, "rb") as fh:
+        data = fh.read()
+    cache.set(key, data, tile_setting("CACHE_TIMEOUT"))
+    return data
+
+
+def schedule_pyramid(image):
+    """Queue background generation of the pyramid for a new image"""
+    return enqueue_job(image, AnalysisJob.Kind.TILES)
+
+
+def schedule_pyramids(image_ids):
+    """Queue pyramid generation for many new images at once"""
+    return enqueue_jobs(image_ids, AnalysisJob.Kind.TILES)
+
+
+def replace_pyramid(image):
+    """
+    Drop the tiles of an image whose file was replaced and queue new ones.
+
+    Both happen once the current transaction commits, in that order, so a
+    worker cannot build the new pyramid before the stale tiles are removed.
+    """
+
+    def replace():
+        delete_pyramid(image.pk)
+        schedule_pyramid(image)
+
+    transaction.on_commit(replace)
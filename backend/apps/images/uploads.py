@@ -0,0 +1,213 @@
+"""
+Resumable chunked uploads
+
+Chunks are streamed from the request body straight into a staging file, one
+buffer at a time, so memory use does not depend on chunk or file size. The
+committed ``offset`` on the session is only advanced after the bytes are on
+disk, so an interrupted upload resumes from the last committed offset.
+"""
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MedicalImage, UploadSession
+from .probe import probe_image
+from .render import pixel_limit_error
+from .tiles import schedule_pyramid
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+class UploadError(Exception):
+    """Chunk rejected; ``status`` is the HTTP status to report"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_setting(name):
+    """Return a value from the CHUNKED_UPLOADS settings dict"""
+    return settings.CHUNKED_UPLOADS[name]
+
+
+def parse_content_range(header, content_length):
+    """
+    Parse a ``Content-Range: bytes start-end/total`` header.
+
+    A missing header means the body is a single chunk starting at 0.
+    Returns ``(start, length, total)`` where total may be None.
+    """
+    if not header:
+        return 0, content_length, None
+    match = CONTENT_RANGE_RE.match(header.strip())
+    if not match:
+        raise UploadError("Malformed Content-Range header")
+    start, end = int(match.group(1)), int(match.group(2))
+    total = None if match.group(3) == "*" else int(match.group(3))
+    if end < start:
+        raise UploadError("Malformed Content-Range header")
+    return start, end - start + 1, total
+
+
+def create_session(user, filename, total_size, title="", description=""):
+    """Open a new upload session with an empty staging file"""
+    session = UploadSession.objects.create(
+        user=user,
+        filename=filename,
+        title=title,
+        description=description,
+        total_size=total_size,
+        expires_at=timezone.now() + timedelta(hours=upload_setting("EXPIRY_HOURS")),
+    )
+    session.part_path.parent.mkdir(parents=True, exist_ok=True)
+    session.part_path.touch()
+    return session
+
+
+def _resync_offset(session):
+    """
+    Pull the committed offset back to the bytes left in the staging file.
+
+    Committed bytes go missing if the staging directory is lost, e.g. a
+    container restarted without a volume for it. The client then resumes
+    from what is on disk instead of the gap being filled with zeros.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        try:
+            staged = session.part_path.stat().st_size
+        except FileNotFoundError:
+            staged = 0
+        if staged < session.offset:
+            session.offset = staged
+            session.save(update_fields=["offset", "updated_at"])
+
+
+def append_chunk(session, stream, start, length):
+    """
+    Append ``length`` bytes read from ``stream`` at byte ``start``.
+
+    ``start`` must equal the committed offset; otherwise a 409 is raised so
+    the client can re-sync from the offset reported by the session. The
+    offset is first moved back if the staging file has lost bytes.
+    """
+    if length > upload_setting("MAX_CHUNK_SIZE"):
+        raise UploadError("Chunk exceeds the maximum chunk size", status=413)
+
+    _resync_offset(session)
+    buffer_size = upload_setting("BUFFER_SIZE")
+    with transaction.atomic():
+        # Row lock serialises concurrent PUTs for the same session
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status != UploadSession.Status.ACTIVE or session.is_expired:
+            raise UploadError("Upload session is no longer active", status=410)
+        if start != session.offset:
+            raise UploadError(
+                f"Chunk starts at {start} but upload is at offset {session.offset}",
+                status=409,
+            )
+        if start + length > session.total_size:
+            raise UploadError("Chunk extends past the declared upload size")
+
+        received = 0
+        session.part_path.touch(exist_ok=True)
+        with open(session.part_path, "r+b") as part:
+            # Drop bytes from an earlier chunk that was never committed
+            part.truncate(session.offset)
+            part.seek(session.offset)
+            while received < length:
+                data = stream.read(min(buffer_size, length - received))
+                if not data:
+                    break
+                part.write(data)
+                received += len(data)
+            if received != length:
+                part.truncate(session.offset)
+                raise UploadError(f"Expected {length} bytes but received {received}")
+            part.flush()
+            os.fsync(part.fileno())
+
+        session.offset += received
+        session.save(update_fields=["offset", "updated_at"])
+    return session
+
+
+def finalize_session(session):
+    """
+    Move a completed upload into storage and create its MedicalImage.
+
+    A completed upload that is not a PNG, JPEG or DICOM image, or is larger
+    than ``IMAGE_MAX_PIXELS`` allows, is discarded and the session aborted.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == UploadSession.Status.COMPLETE:
+            return session.image
+        if session.status != UploadSession.Status.ACTIVE:
+            raise UploadError("Upload session is no longer active", status=410)
+        if session.offset != session.total_size:
+            raise UploadError(
+                f"Upload incomplete: {session.offset} of {session.total_size} bytes"
+            )
+
+        image = None
+        with open(session.part_path, "rb") as part:
+            # The extension was checked when the session was created; the
+            # bytes can only be checked once they are all there
+            header = probe_image(part)
+            if header is None:
+                error = "Upload a valid PNG, JPEG or DICOM image"
+            else:
+                error = pixel_limit_error(header)
+            if error is None:
+                image = MedicalImage(
+                    user=session.user,
+                    title=session.title,
+                    description=session.description,
+                )
+                # Hashed and, unless the bytes are already stored, copied into
+                # blob storage in chunks by MedicalImage.save
+                image.image = File(part, name=session.filename)
+                image.save()
+
+        if image is None:
+            session.status = UploadSession.Status.ABORTED
+            session.save(update_fields=["status", "updated_at"])
+        else:
+            session.status = UploadSession.Status.COMPLETE
+            session.image = image
+            session.save(update_fields=["status", "image", "updated_at"])
+            schedule_pyramid(image)
+
+    session.part_path.unlink(missing_ok=True)
+    if image is None:
+        raise UploadError(error, status=422)
+    return image
+
+
+def abort_session(session):
+    """Discard an upload and its staging file"""
+    UploadSession.objects.filter(pk=session.pk).update(
+        status=UploadSession.Status.ABORTED, updated_at=timezone.now()
+    )
+    session.part_path.unlink(missing_ok=True)
+
+
+def purge_expired_sessions(now=None):
+    """Delete staging files and rows for expired, unfinished uploads"""
+    now = now or timezone.now()
+    expired = UploadSession.objects.filter(expires_at__lte=now).exclude(
+        status=UploadSession.Status.COMPLETE
+    )
+    count = 0
+    for session in expired.iterator():
+        session.part_path.unlink(missing_ok=True)
+        count += 1
+    expired.delete()
+    return count
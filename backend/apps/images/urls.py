@@ -4,9 +4,12 @@ Images URL Configuration
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import ImageViewSet
+from .views import DirectUploadViewSet, ImageViewSet, UploadSessionViewSet
 
 router = DefaultRouter()
+# Registered before the image routes so these are not taken as an image pk
+router.register(r"uploads", UploadSessionViewSet, basename="uploads")
+router.register(r"direct-uploads", DirectUploadViewSet, basename="direct-uploads")
 router.register(r"", ImageViewSet, basename="images")
 
 urlpatterns = [
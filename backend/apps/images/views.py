@@ -1,14 +1,62 @@
 """
 Images views
 """
+import hashlib
+import io
+
+from apps.analysis.jobs import enqueue_analysis, enqueue_batch
+from apps.analysis.masks import (
+    MASK_CONTENT_TYPE,
+    MaskError,
+    decode_mask,
+    read_mask_bytes,
+)
+from apps.analysis.models import Analysis
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import status, viewsets
+from django.urls import reverse
+from PIL import Image
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from .models import MedicalImage
-from .serializers import ImageSerializer, ImageUploadSerializer
+from .bulk import BulkError, bulk_ingest
+from .delivery import etag_matches, serve_image_file
+from .dicom import DicomError
+from .direct import commit_upload, presign_upload
+from .export import EXPORT_FORMATS, stream_export
+from .models import MedicalImage, UploadSession
+from .pagination import ImageCursorPagination
+from .render import ImageTooLarge, render_image
+from .serializers import (
+    BatchAnalysisSerializer,
+    DirectUploadCommitSerializer,
+    DirectUploadSerializer,
+    ImageFilterSerializer,
+    ImageSerializer,
+    ImageUploadSerializer,
+    StartAnalysisSerializer,
+    UploadSessionSerializer,
+    image_rows,
+    serialize_image_rows,
+)
+from .tiles import (
+    CONTENT_TYPES,
+    pyramid_token,
+    read_tile,
+    replace_pyramid,
+    schedule_pyramid,
+    tile_setting,
+)
+from .uploads import (
+    UploadError,
+    abort_session,
+    append_chunk,
+    create_session,
+    finalize_session,
+    parse_content_range,
+)
 
 
 class ImageViewSet(viewsets.ModelViewSet):
@@ -16,10 +64,35 @@ class ImageViewSet(viewsets.ModelViewSet):
 
     permission_classes = (IsAuthenticated,)
     serializer_class = ImageSerializer
+    pagination_class = ImageCursorPagination
 
     def get_queryset(self):
         """Return images for current user only"""
-        return MedicalImage.objects.filter(user=self.request.user)
+        # The owner is read by ImageSerializer.user_email and __str__
+        return MedicalImage.objects.filter(user=self.request.user).select_related(
+            "user", "blob"
+        )
+
+    def list(self, request, *args, **kwargs):
+        """List images from ``.values()`` rows without model instances"""
+        queryset = image_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(serialize_image_rows(queryset, request))
+        return self.get_paginated_response(serialize_image_rows(page, request))
+
+    def filter_queryset(self, queryset):
+        """
+        Filter the list and export by ``analyzed``,
+        ``uploaded_after``/``uploaded_before`` and
+        ``min_width``/``max_width``/``min_height``/``max_height``.
+        """
+        queryset = super().filter_queryset(queryset)
+        if self.action not in ("list", "export"):
+            return queryset
+        filters = ImageFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        return filters.filter_queryset(queryset)
 
     def get_serializer_class(self):
         """Use different serializer for upload"""
@@ -28,12 +101,81 @@ class ImageViewSet(viewsets.ModelViewSet):
         return ImageSerializer
 
     def perform_create(self, serializer):
-        """Save image with current user"""
-        serializer.save(user=self.request.user)
+        """Save image with current user and queue its tile pyramid"""
+        image = serializer.save(user=self.request.user)
+        schedule_pyramid(image)
+
+    def perform_update(self, serializer):
+        """Save changes and rebuild the tile pyramid of a replaced file"""
+        previous = serializer.instance.image.name
+        image = serializer.save()
+        if image.image.name != previous:
+            replace_pyramid(image)
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request):
+        """
+        Ingest many images in one request.
+
+        Accepts any number of ``files`` form parts and/or one zip
+        ``archive``, plus an optional shared ``title`` and ``description``
+        (the title defaults to each file's name). Responds 201 when every
+        file was created and 207 with per-file errors otherwise.
+        """
+        try:
+            results = bulk_ingest(
+                request.user,
+                files=request.FILES.getlist("files"),
+                archive=request.FILES.get("archive"),
+                title=request.data.get("title", ""),
+                description=request.data.get("description", ""),
+            )
+        except BulkError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        created = sum(result["status"] == "created" for result in results)
+        return Response(
+            {
+                "created": created,
+                "failed": len(results) - created,
+                "results": results,
+            },
+            status=(
+                status.HTTP_201_CREATED
+                if created == len(results)
+                else status.HTTP_207_MULTI_STATUS
+            ),
+        )
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """
+        Stream every matching image with its analysis.
+
+        Writes NDJSON, or CSV with ``?output=csv``, without paging; takes the
+        same filters as the list.
+        """
+        output = request.query_params.get("output", "ndjson")
+        if output not in EXPORT_FORMATS:
+            return Response(
+                {"error": "output must be ndjson or csv"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        queryset = self.filter_queryset(MedicalImage.objects.filter(user=request.user))
+        response = StreamingHttpResponse(
+            stream_export(queryset, output), content_type=EXPORT_FORMATS[output]
+        )
+        response["Content-Disposition"] = f'attachment; filename="images.{output}"'
+        return response
 
     @action(detail=True, methods=["post"])
     def start_analysis(self, request, pk=None):
-        """Start analysis for an image"""
+        """
+        Queue analysis for an image.
+
+        Optionally names a ``model_version`` and a ``priority`` (stat,
+        urgent, routine or backfill; routine by default).
+        """
         image = self.get_object()
 
         if image.analyzed:
@@ -42,14 +184,302 @@ class ImageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # TODO: Trigger ML analysis task here
-        # For now, just mark as started
-        from django.utils import timezone
+        serializer = StartAnalysisSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = enqueue_analysis(
+            image,
+            model_version=serializer.validated_data["model_version"],
+            priority=serializer.validated_data["priority"],
+        )
+
+        return Response(
+            {
+                "message": "Analysis queued",
+                "image_id": image.id,
+                "job_id": job.id,
+                "status": job.status,
+                "priority": job.priority,
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=False, methods=["post"], url_path="start_analysis")
+    def start_batch_analysis(self, request):
+        """
+        Queue analysis for many images as one batch.
+
+        Select images with ``ids`` or with a ``filter`` object taking the
+        list's query parameters, and optionally a ``model_version`` and a
+        ``priority`` other than stat.
+        Analyzed and already queued images are skipped. Returns the batch
+        whose progress is polled at ``status_url``.
+        """
+        serializer = BatchAnalysisSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        batch, queued = enqueue_batch(
+            request.user,
+            serializer.select(self.get_queryset()),
+            model_version=serializer.validated_data["model_version"],
+            priority=serializer.validated_data["priority"],
+        )
+
+        return Response(
+            {
+                "message": "Analysis queued",
+                "batch_id": batch.id,
+                "queued": len(queued),
+                "image_ids": queued,
+                "status_url": request.build_absolute_uri(
+                    reverse("analysis-batches-detail", kwargs={"pk": batch.id})
+                ),
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=True, methods=["get"], url_path="file")
+    def file(self, request, pk=None):
+        """
+        Deliver the original file to its owner.
+
+        Supports ``If-None-Match`` and byte ranges; the transfer itself is
+        offloaded to nginx or object storage where configured.
+        """
+        return serve_image_file(request, self.get_object())
+
+    @action(detail=True, methods=["get"])
+    def preview(self, request, pk=None):
+        """
+        Render a downscaled PNG preview.
+
+        ``size`` bounds the longest side; ``center`` and ``width`` override
+        the DICOM window.
+        """
+        image = self.get_object()
+        try:
+            size = min(int(request.query_params.get("size", 512)), 2048)
+            window = None
+            if "center" in request.query_params or "width" in request.query_params:
+                window = (
+                    float(request.query_params["center"]),
+                    float(request.query_params["width"]),
+                )
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "size, center and width must be numbers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if size <= 0:
+            return Response(
+                {"error": "size must be positive"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            rendered = render_image(image, max_size=size, window=window)
+        except (DicomError, ImageTooLarge) as exc:
+            return Response(
+                {"error": str(exc)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        buffer = io.BytesIO()
+        rendered.save(buffer, format="PNG")
+        response = HttpResponse(buffer.getvalue(), content_type="image/png")
+        response["Cache-Control"] = "private, max-age=3600"
+        return response
+
+    @action(detail=True, methods=["get"])
+    def mask(self, request, pk=None):
+        """
+        Segmentation mask of the image's analysis.
+
+        Returns the stored MSK1 payload (see ``apps.analysis.masks``) as is,
+        or a 1-bit PNG with ``?output=png``.
+        """
+        image = self.get_object()
+        output = request.query_params.get("output", "msk1")
+        if output not in ("msk1", "png"):
+            return Response(
+                {"error": "output must be msk1 or png"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        analysis = Analysis.objects.filter(image=image).first()
+        reference = analysis.mask_reference if analysis else None
+        if reference is None:
+            return Response(
+                {"error": "No mask has been stored for this image"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        # Mask names are derived from the image content and model version
+        digest = hashlib.sha1(f"{reference['name']}:{output}".encode()).hexdigest()
+        etag = f'"{digest}"'
+        if etag_matches(request.headers.get("If-None-Match", ""), etag):
+            response = HttpResponseNotModified()
+        else:
+            data = read_mask_bytes(reference)
+            if output == "png":
+                try:
+                    mask = decode_mask(data)
+                except MaskError as exc:
+                    return Response(
+                        {"error": str(exc)},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                buffer = io.BytesIO()
+                Image.fromarray(mask).save(buffer, format="PNG", optimize=True)
+                response = HttpResponse(buffer.getvalue(), content_type="image/png")
+            else:
+                response = HttpResponse(data, content_type=MASK_CONTENT_TYPE)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    @action(detail=True, methods=["get"], url_path="tiles")
+    def tile_info(self, request, pk=None):
+        """Describe the Deep Zoom pyramid of an image"""
+        image = self.get_object()
+        return Response(
+            {
+                "ready": image.pyramid_levels is not None,
+                "width": image.width,
+                "height": image.height,
+                "tile_size": tile_setting("TILE_SIZE"),
+                "overlap": 0,
+                "format": tile_setting("FORMAT"),
+                "levels": image.pyramid_levels,
+            }
+        )
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"tiles/(?P<level>\d+)/(?P<column>\d+)/(?P<row>\d+)",
+    )
+    def tile(self, request, pk=None, level=None, column=None, row=None):
+        """Serve one pyramid tile with long-lived cache headers"""
+        image = self.get_object()
+        if image.pyramid_levels is None:
+            return Response(
+                {"error": "Tile pyramid is not ready"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        level, column, row = int(level), int(column), int(row)
+        etag = f'"{pyramid_token(image)}-{level}-{column}-{row}"'
+        if etag_matches(request.headers.get("If-None-Match", ""), etag):
+            response = HttpResponseNotModified()
+        else:
+            data = read_tile(image, level, column, row)
+            if data is None:
+                return Response(
+                    {"error": "Tile not found"}, status=status.HTTP_404_NOT_FOUND
+                )
+            response = HttpResponse(
+                data, content_type=CONTENT_TYPES[tile_setting("FORMAT")]
+            )
+        # Tiles never change for a given file; private because they hold PHI
+        response["Cache-Control"] = "private, max-age=31536000, immutable"
+        response["ETag"] = etag
+        return response
+
+
+class UploadSessionViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Resumable chunked uploads.
+
+    POST creates a session, PUT appends the byte range given in
+    ``Content-Range``, GET reports the committed offset to resume from, and
+    ``finalize`` turns the completed upload into a MedicalImage.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        """Return upload sessions for current user only"""
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        """Open the session and its staging file"""
+        serializer.instance = create_session(
+            user=self.request.user, **serializer.validated_data
+        )
+
+    def update(self, request, pk=None):
+        """Append one chunk read directly from the request body"""
+        session = self.get_object()
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+            start, length, total = parse_content_range(
+                request.META.get("HTTP_CONTENT_RANGE"), content_length
+            )
+            if total is not None and total != session.total_size:
+                raise UploadError("Content-Range total does not match upload size")
+            if content_length != length:
+                raise UploadError("Content-Length does not match Content-Range")
+            session = append_chunk(session, request.stream, start, length)
+        except UploadError as exc:
+            session.refresh_from_db()
+            return Response(
+                {"error": str(exc), "offset": session.offset},
+                status=exc.status,
+            )
+        return Response(self.get_serializer(session).data)
+
+    def perform_destroy(self, instance):
+        """Abort the upload instead of deleting the audit row"""
+        abort_session(instance)
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        """Create the MedicalImage for a fully uploaded session"""
+        session = self.get_object()
+        try:
+            image = finalize_session(session)
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=exc.status)
+        return Response(
+            ImageSerializer(image, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class DirectUploadViewSet(viewsets.GenericViewSet):
+    """
+    Direct-to-S3 uploads.
+
+    POST returns a presigned POST (``url`` and form ``fields``) and a
+    ``token``; the client uploads the file to the bucket itself and then
+    posts the token to ``commit`` to create the MedicalImage.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    serializer_class = DirectUploadSerializer
 
-        image.analysis_started_at = timezone.now()
-        image.save()
+    def create(self, request):
+        """Presign an upload"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            upload = presign_upload(request.user, **serializer.validated_data)
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=exc.status)
+        return Response(upload, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=["post"])
+    def commit(self, request):
+        """Verify the uploaded object and create its image"""
+        serializer = DirectUploadCommitSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            image = commit_upload(request.user, serializer.validated_data["token"])
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=exc.status)
         return Response(
-            {"message": "Analysis started", "image_id": image.id},
-            status=status.HTTP_200_OK,
+            ImageSerializer(image, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED,
         )
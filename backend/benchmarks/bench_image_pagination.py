@@ -0,0 +1,126 @@
+"""
+Benchmark: /api/images/ page latency against page depth
+
+Compares OFFSET-based page numbers with keyset cursors on a throwaway
+SQLite database filled with one heavy user's images.
+
+    python benchmarks/bench_image_pagination.py
+    python benchmarks/bench_image_pagination.py --images 200000 --repeat 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medscan.settings")
+
+TMP = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{TMP.name}/bench.sqlite3"
+
+import django  # noqa: E402
+
+django.setup()
+
+from apps.images.models import MedicalImage  # noqa: E402
+from apps.images.views import ImageViewSet  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.pagination import Cursor, PageNumberPagination  # noqa: E402
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+
+
+class OffsetImageViewSet(ImageViewSet):
+    """The image list as it was paginated before, for comparison"""
+
+    pagination_class = PageNumberPagination
+
+
+def populate(count):
+    """Create a user with ``count`` images, one second apart"""
+    user = get_user_model().objects.create_user(email="bench@example.com")
+    uploaded_at = MedicalImage._meta.get_field("uploaded_at")
+    uploaded_at.auto_now_add = False
+    start = timezone.now() - timedelta(seconds=count)
+    batch = []
+    for n in range(count):
+        batch.append(
+            MedicalImage(
+                user=user,
+                image=f"medical_images/bench/{n}.png",
+                title=f"Image {n}",
+                uploaded_at=start + timedelta(seconds=n),
+                width=512,
+                height=512,
+            )
+        )
+        if len(batch) == 5000:
+            MedicalImage.objects.bulk_create(batch)
+            batch = []
+    MedicalImage.objects.bulk_create(batch)
+    uploaded_at.auto_now_add = True
+    return user
+
+
+def timed(view, user, params, repeat):
+    """Median latency in ms of a list request"""
+    factory = APIRequestFactory(SERVER_NAME="localhost")
+    samples = []
+    for _ in range(repeat):
+        request = factory.get("/api/images/", params)
+        force_authenticate(request, user=user)
+        started = time.perf_counter()
+        response = view(request)
+        response.render()
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.data
+    return sorted(samples)[len(samples) // 2]
+
+
+def cursor_at(user, offset):
+    """Encoded cursor that resumes after the first ``offset`` images"""
+    if offset == 0:
+        return None
+    last = (
+        MedicalImage.objects.filter(user=user)
+        .order_by("-uploaded_at", "-id")
+        .values_list("uploaded_at", flat=True)[offset - 1]
+    )
+    paginator = ImageViewSet.pagination_class()
+    paginator.base_url = "/api/images/"
+    url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=last))
+    return url.split("cursor=")[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    call_command("migrate", verbosity=0)
+    user = populate(args.images)
+    offset_view = OffsetImageViewSet.as_view({"get": "list"})
+    cursor_view = ImageViewSet.as_view({"get": "list"})
+
+    pages = args.images // args.page_size
+    depths = sorted({1, 10, 100, pages // 10, pages // 2, pages} - {0})
+    print(f"{args.images} images, {args.page_size} per page")
+    print(f"{'page':>7}  {'offset ms':>10}  {'cursor ms':>10}")
+    for page in depths:
+        offset_ms = timed(offset_view, user, {"page": page}, args.repeat)
+        params = {"page_size": args.page_size}
+        cursor = cursor_at(user, (page - 1) * args.page_size)
+        if cursor:
+            params["cursor"] = cursor
+        cursor_ms = timed(cursor_view, user, params, args.repeat)
+        print(f"{page:>7}  {offset_ms:>10.2f}  {cursor_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
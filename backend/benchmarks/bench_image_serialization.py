@@ -0,0 +1,111 @@
+"""
+Benchmark: image list serialization throughput (rows/sec)
+
+Compares ImageSerializer over plain model instances (one owner query per
+row), over instances with the owner joined in, and the ``.values()`` rows
+used by the list endpoint, on a throwaway SQLite database.
+
+    python benchmarks/bench_image_serialization.py
+    python benchmarks/bench_image_serialization.py --rows 5000 --repeat 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medscan.settings")
+
+TMP = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{TMP.name}/bench.sqlite3"
+
+import django  # noqa: E402
+
+django.setup()
+
+from apps.images.models import MedicalImage  # noqa: E402
+from apps.images.serializers import (  # noqa: E402
+    ImageSerializer,
+    image_rows,
+    serialize_image_rows,
+)
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+
+def populate(count):
+    """Create ``count`` images spread over a few owners"""
+    users = [
+        get_user_model().objects.create_user(email=f"bench{n}@example.com")
+        for n in range(4)
+    ]
+    MedicalImage.objects.bulk_create(
+        MedicalImage(
+            user=users[n % len(users)],
+            image=f"medical_images/bench/{n}.png",
+            title=f"Image {n}",
+            width=512,
+            height=512,
+            file_size=262144,
+        )
+        for n in range(count)
+    )
+
+
+def instances(request):
+    return ImageSerializer(
+        MedicalImage.objects.all(), many=True, context={"request": request}
+    ).data
+
+
+def joined_instances(request):
+    return ImageSerializer(
+        MedicalImage.objects.select_related("user"),
+        many=True,
+        context={"request": request},
+    ).data
+
+
+def value_rows(request):
+    return serialize_image_rows(image_rows(MedicalImage.objects.all()), request)
+
+
+def bench(serialize, request, rows, repeat):
+    """Best-of-``repeat`` rows/sec and the query count of one run"""
+    with CaptureQueriesContext(connection) as queries:
+        serialize(request)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        serialize(request)
+        best = min(best, time.perf_counter() - started)
+    return rows / best, len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    call_command("migrate", verbosity=0)
+    populate(args.rows)
+    request = APIRequestFactory(SERVER_NAME="localhost").get("/api/images/")
+
+    print(f"{'mode':<22}  {'rows/s':>10}  {'queries':>7}")
+    for name, serialize in (
+        ("ImageSerializer", instances),
+        ("+ select_related", joined_instances),
+        (".values() rows", value_rows),
+    ):
+        rate, queries = bench(serialize, request, args.rows, args.repeat)
+        print(f"{name:<22}  {rate:>10.0f}  {queries:>7}")
+
+
+if __name__ == "__main__":
+    main()
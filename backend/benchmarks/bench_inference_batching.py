@@ -0,0 +1,93 @@
+"""
+Benchmark: segmentation throughput (images/sec) against batch size
+
+Measures the raw forward pass for each batch size, then the end-to-end
+InferenceEngine with concurrent submitters, as the analysis workers use it.
+
+    python benchmarks/bench_inference_batching.py
+    python benchmarks/bench_inference_batching.py --model-path model.keras
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+from apps.analysis.inference import InferenceEngine, KerasModel  # noqa: E402
+
+
+def build_reference_model(path, input_size):
+    """Save a small U-Net-style model so the benchmark runs without weights"""
+    import tensorflow as tf
+
+    inputs = tf.keras.Input((input_size, input_size, 1))
+    x = tf.keras.layers.Conv2D(16, 3, padding="same", activation="relu")(inputs)
+    x = tf.keras.layers.Conv2D(16, 3, padding="same", activation="relu")(x)
+    skip = x
+    x = tf.keras.layers.MaxPooling2D()(x)
+    x = tf.keras.layers.Conv2D(32, 3, padding="same", activation="relu")(x)
+    x = tf.keras.layers.UpSampling2D()(x)
+    x = tf.keras.layers.Concatenate()([x, skip])
+    x = tf.keras.layers.Conv2D(16, 3, padding="same", activation="relu")(x)
+    outputs = tf.keras.layers.Conv2D(1, 1, activation="sigmoid")(x)
+    tf.keras.Model(inputs, outputs).save(path)
+
+
+def bench_forward(model, images, batch_size):
+    """Images/sec for back-to-back forward passes of ``batch_size``"""
+    model.predict(images[:batch_size])  # warm up graph for this shape
+    started = time.perf_counter()
+    for start in range(0, len(images), batch_size):
+        model.predict(images[start : start + batch_size])
+    return len(images) / (time.perf_counter() - started)
+
+
+def bench_engine(model, images, batch_size, max_wait_ms):
+    """Images/sec through the engine with ``2 * batch_size`` submitters"""
+    engine = InferenceEngine(model, max_batch_size=batch_size, max_wait_ms=max_wait_ms)
+    engine.predict(images[0])
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=batch_size * 2) as pool:
+        list(pool.map(engine.predict, images))
+    elapsed = time.perf_counter() - started
+    engine.close()
+    return len(images) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model-path", help="Keras model to benchmark")
+    parser.add_argument("--images", type=int, default=256)
+    parser.add_argument("--input-size", type=int, default=256)
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16,32")
+    parser.add_argument("--max-wait-ms", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.model_path
+        if not path:
+            path = os.path.join(tmp, "reference.keras")
+            build_reference_model(path, args.input_size)
+        model = KerasModel(path)
+
+        rng = np.random.default_rng(0)
+        images = rng.random(
+            (args.images, args.input_size, args.input_size, 1), dtype=np.float32
+        )
+
+        print(f"{'batch':>5}  {'forward img/s':>14}  {'engine img/s':>13}")
+        for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+            forward = bench_forward(model, images, batch_size)
+            engine = bench_engine(model, images, batch_size, args.max_wait_ms)
+            print(f"{batch_size:>5}  {forward:>14.1f}  {engine:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark: image preprocessing throughput (images/sec) against core count
+
+Decodes and preprocesses large synthetic scans the way the analysis workers
+do: first in the worker threads themselves, then through the shared-memory
+preprocess pool with 1, 2, 4, ... processes up to the number of cores.
+The scans are written to a temporary directory under MEDIA_ROOT and removed
+afterwards.
+
+    python benchmarks/bench_preprocess_pool.py
+    python benchmarks/bench_preprocess_pool.py --images 400 --size 3072 --format jpeg
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medscan.settings")
+
+TMP = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{TMP.name}/bench.sqlite3"
+
+import django  # noqa: E402
+
+django.setup()
+
+from apps.analysis.pipeline import prepared_input  # noqa: E402
+from apps.analysis.preprocessing import PreprocessPool  # noqa: E402
+from apps.images.models import MedicalImage  # noqa: E402
+from django.conf import settings  # noqa: E402
+from PIL import Image  # noqa: E402
+
+
+def write_scans(directory, count, size, image_format):
+    """Write ``count`` distinct noisy gradient scans and return their names"""
+    rng = np.random.default_rng(0)
+    ramp = np.linspace(0, 200, size, dtype=np.float32)
+    base = ramp[None, :] + ramp[:, None] / 4
+    names = []
+    for index in range(count):
+        noise = rng.normal(0, 12, (size, size)).astype(np.float32)
+        pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format=image_format)
+        name = f"scan-{index}.{image_format}"
+        (directory / name).write_bytes(buffer.getvalue())
+        names.append(f"{directory.name}/{name}")
+    return names
+
+
+def bench(images, threads, pool=None):
+    """Images/sec for ``threads`` worker threads preparing model inputs"""
+
+    def prepare(image):
+        if pool is None:
+            with prepared_input(image):
+                pass
+        else:
+            with pool.preprocess(image):
+                pass
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(prepare, images))
+    return len(images) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=96)
+    parser.add_argument("--size", type=int, default=2048, help="Scan side in pixels")
+    parser.add_argument("--format", choices=["png", "jpeg"], default="png")
+    parser.add_argument("--input-size", type=int, default=256)
+    parser.add_argument(
+        "--threads", type=int, default=8, help="Worker threads (ANALYSIS_WORKERS)"
+    )
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    counts = []
+    processes = 1
+    while processes < cores:
+        counts.append(processes)
+        processes *= 2
+    counts.append(cores)
+
+    Path(settings.MEDIA_ROOT).mkdir(parents=True, exist_ok=True)
+    directory = Path(
+        tempfile.mkdtemp(prefix="bench-preprocess-", dir=settings.MEDIA_ROOT)
+    )
+    try:
+        names = write_scans(directory, args.images, args.size, args.format)
+        images = [MedicalImage(image=name) for name in names]
+        settings.ANALYSIS_MODEL = {
+            **settings.ANALYSIS_MODEL,
+            "INPUT_SIZE": args.input_size,
+        }
+
+        print(
+            f"{len(images)} {args.size}x{args.size} {args.format} scans, {cores} core(s)"
+        )
+        print(f"{'preprocessing':>14}  {'img/s':>8}  {'speed-up':>8}")
+        baseline = bench(images, args.threads)
+        print(f"{'in-thread':>14}  {baseline:>8.1f}  {1.0:>7.2f}x")
+        for processes in counts:
+            pool = PreprocessPool(processes, args.input_size)
+            pool.warm_up()
+            rate = bench(images, args.threads, pool)
+            pool.close()
+            label = f"{processes} process(es)"
+            print(f"{label:>14}  {rate:>8.1f}  {rate / baseline:>7.2f}x")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+ASGI config for medscan project.
+
+Serves the whole API, including the long-lived analysis event streams at
+/api/analysis/events/, e.g. with ``uvicorn medscan.asgi:application``.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medscan.settings")
+
+application = get_asgi_application()
@@ -110,6 +110,12 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Hash uploads while they stream in, for content-addressed storage
+FILE_UPLOAD_HANDLERS = [
+    "apps.images.blobs.HashingMemoryFileUploadHandler",
+    "apps.images.blobs.HashingTemporaryFileUploadHandler",
+]
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -173,6 +179,184 @@ SPECTACULAR_SETTINGS = {
     "SERVE_INCLUDE_SCHEMA": False,
 }
 
+# Resumable Chunked Uploads
+CHUNKED_UPLOADS = {
+    # Staging directory for partial uploads; keep it outside MEDIA_ROOT
+    "DIR": config("CHUNKED_UPLOAD_DIR", default=str(BASE_DIR / "uploads")),
+    "MAX_SIZE": config("CHUNKED_UPLOAD_MAX_SIZE", default=2 * 1024**3, cast=int),
+    "MAX_CHUNK_SIZE": config(
+        "CHUNKED_UPLOAD_MAX_CHUNK_SIZE", default=32 * 1024**2, cast=int
+    ),
+    "BUFFER_SIZE": 1024 * 1024,
+    "EXPIRY_HOURS": config("CHUNKED_UPLOAD_EXPIRY_HOURS", default=24, cast=int),
+}
+
+# Direct-to-S3 Uploads (presigned POST; requires USE_S3)
+DIRECT_UPLOADS = {
+    # Key prefix under AWS_LOCATION; expire it with a bucket lifecycle rule
+    "PREFIX": "incoming/",
+    "EXPIRY": config("DIRECT_UPLOAD_EXPIRY", default=900, cast=int),
+    "MAX_SIZE": CHUNKED_UPLOADS["MAX_SIZE"],
+    # Leading bytes fetched at commit to read the image header
+    "PROBE_BYTES": 1024 * 1024,
+}
+
+# Bulk Ingest (/api/images/bulk/)
+BULK_UPLOADS = {
+    "MAX_FILES": config("BULK_UPLOAD_MAX_FILES", default=1000, cast=int),
+    "MAX_FILE_SIZE": config(
+        "BULK_UPLOAD_MAX_FILE_SIZE", default=10 * 1024 * 1024, cast=int
+    ),
+    # Threads spooling, hashing and probing entries in parallel
+    "WORKERS": config("BULK_UPLOAD_WORKERS", default=4, cast=int),
+}
+# Django refuses multipart forms with more files than this
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOADS["MAX_FILES"]
+
+# Original File Delivery (/api/images/{id}/file/)
+MEDIA_DELIVERY = {
+    # "django" streams from the worker (development); "nginx" hands the
+    # transfer to the internal location below with X-Accel-Redirect
+    "BACKEND": config("MEDIA_DELIVERY_BACKEND", default="django"),
+    "ACCEL_PREFIX": "/protected-media/",
+    # Lifetime of presigned S3 redirects in seconds
+    "URL_EXPIRY": config("MEDIA_URL_EXPIRY", default=300, cast=int),
+}
+
+# Largest PNG or JPEG accepted at ingest, in pixels. These are decoded whole
+# for tiling and analysis (DICOM is read band by band), so this bounds their
+# decode memory; it also replaces Pillow's decompression bomb limit.
+IMAGE_MAX_PIXELS = config("IMAGE_MAX_PIXELS", default=500_000_000, cast=int)
+
+# Deep Zoom Tile Pyramids
+IMAGE_TILES = {
+    "TILE_SIZE": config("IMAGE_TILE_SIZE", default=256, cast=int),
+    "FORMAT": config("IMAGE_TILE_FORMAT", default="png"),  # png or jpeg
+    "JPEG_QUALITY": config("IMAGE_TILE_JPEG_QUALITY", default=90, cast=int),
+    "CACHE_TIMEOUT": config("IMAGE_TILE_CACHE_TIMEOUT", default=3600, cast=int),
+}
+
+# Streaming Exports (/api/images/export/, manage.py export_images)
+IMAGE_EXPORT = {
+    # Rows fetched per cursor round trip and encoded per response chunk
+    "CHUNK_SIZE": config("IMAGE_EXPORT_CHUNK_SIZE", default=2000, cast=int),
+}
+
+# Analysis Job Queue
+ANALYSIS_QUEUE = {
+    "WORKERS": config("ANALYSIS_WORKERS", default=8, cast=int),
+    "POLL_INTERVAL": config("ANALYSIS_POLL_INTERVAL", default=1.0, cast=float),
+    "VISIBILITY_TIMEOUT": config("ANALYSIS_VISIBILITY_TIMEOUT", default=300, cast=int),
+    "MAX_ATTEMPTS": config("ANALYSIS_MAX_ATTEMPTS", default=3, cast=int),
+    "RETRY_BACKOFF": config("ANALYSIS_RETRY_BACKOFF", default=30, cast=int),
+    # Most image ids accepted by one batch start_analysis request
+    "MAX_BATCH_IDS": config("ANALYSIS_MAX_BATCH_IDS", default=1000, cast=int),
+    # Longest wait for another worker analyzing identical bytes
+    "COALESCE_TIMEOUT": config("ANALYSIS_COALESCE_TIMEOUT", default=300, cast=int),
+    # Most jobs of one user running at once, stat jobs aside (0: no cap)
+    "USER_CONCURRENCY": config("ANALYSIS_USER_CONCURRENCY", default=0, cast=int),
+    # Fair-share weights by user id, as "id=weight,id=weight"; a user of
+    # weight 2 may run twice as many jobs as one of the default weight 1
+    # when both have work queued in the same priority class
+    "USER_WEIGHTS": {
+        int(user_id): float(weight)
+        for user_id, weight in (
+            item.split("=", 1)
+            for item in config("ANALYSIS_USER_WEIGHTS", default="").split(",")
+            if item
+        )
+    },
+}
+
+# Analysis Progress Events (/api/analysis/events/, served over ASGI)
+ANALYSIS_EVENTS = {
+    # "local" delivers events within one process; "udp" relays them from
+    # worker processes to the one ASGI process listening on ADDRESS
+    "BACKEND": config("ANALYSIS_EVENTS_BACKEND", default="local"),
+    "ADDRESS": config("ANALYSIS_EVENTS_ADDRESS", default="127.0.0.1:8765"),
+    # Seconds between keep-alive comments on idle streams
+    "HEARTBEAT": config("ANALYSIS_EVENTS_HEARTBEAT", default=15, cast=int),
+    # Events buffered per connection; a slow client misses newer ones
+    "QUEUE_SIZE": config("ANALYSIS_EVENTS_QUEUE_SIZE", default=100, cast=int),
+}
+
+# Analysis results by image content and model version. The default
+# in-process cache coalesces within one worker process; point it at a shared
+# backend (e.g. DatabaseCache after createcachetable) to share results and
+# coalesce across processes.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "analysis": {
+        "BACKEND": config(
+            "ANALYSIS_CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": config("ANALYSIS_CACHE_LOCATION", default="analysis_cache"),
+        "TIMEOUT": config("ANALYSIS_CACHE_TIMEOUT", default=86400, cast=int),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("ANALYSIS_CACHE_MAX_ENTRIES", default=10000, cast=int)
+        },
+    },
+}
+
+# Segmentation Model Inference
+ANALYSIS_MODEL = {
+    # Keras/SavedModel path; when empty an Otsu threshold baseline is used
+    "PATH": config("ANALYSIS_MODEL_PATH", default=""),
+    "VERSION": config("ANALYSIS_MODEL_VERSION", default=""),
+    # Further models by version, as "version=path,version=path"
+    "MODELS": dict(
+        item.split("=", 1)
+        for item in config("ANALYSIS_MODELS", default="").split(",")
+        if item
+    ),
+    # Version used when a job names none; defaults to the last configured
+    # model, or the Otsu baseline
+    "DEFAULT_VERSION": config("ANALYSIS_DEFAULT_MODEL", default=""),
+    # Estimated weight memory of warm models per worker process; least
+    # recently used idle models are evicted above it (0 disables eviction)
+    "MEMORY_LIMIT_MB": config("ANALYSIS_MODEL_MEMORY_MB", default=2048, cast=int),
+    # Versions loaded when workers start, besides the default
+    "PRELOAD": [
+        version
+        for version in config("ANALYSIS_PRELOAD_MODELS", default="").split(",")
+        if version
+    ],
+    # "tensorflow" serves the float32 models; "tflite" serves the int8
+    # exports below instead, for versions whose export passed
+    # validate_quantized_model
+    "BACKEND": config("ANALYSIS_MODEL_BACKEND", default="tensorflow"),
+    # Quantized TFLite exports by version, as "version=path,version=path"
+    "QUANTIZED_MODELS": dict(
+        item.split("=", 1)
+        for item in config("ANALYSIS_QUANTIZED_MODELS", default="").split(",")
+        if item
+    ),
+    # TFLite interpreter threads per model (0 uses every core)
+    "TFLITE_THREADS": config("ANALYSIS_TFLITE_THREADS", default=0, cast=int),
+    # Largest drop in mean dice or IoU accepted from a quantized export
+    "MAX_QUANTIZATION_DROP": config(
+        "ANALYSIS_MAX_QUANTIZATION_DROP", default=0.01, cast=float
+    ),
+    "INPUT_SIZE": config("ANALYSIS_MODEL_INPUT_SIZE", default=256, cast=int),
+    "MAX_BATCH_SIZE": config("ANALYSIS_MAX_BATCH_SIZE", default=8, cast=int),
+    "MAX_WAIT_MS": config("ANALYSIS_MAX_WAIT_MS", default=20, cast=int),
+    # Processes decoding and preprocessing images into shared memory for the
+    # worker threads (0 preprocesses in each worker thread)
+    "PREPROCESS_WORKERS": config("ANALYSIS_PREPROCESS_WORKERS", default=0, cast=int),
+    # Preprocessed inputs held in shared memory at once (0: twice the
+    # preprocess workers)
+    "PREPROCESS_SLOTS": config("ANALYSIS_PREPROCESS_SLOTS", default=0, cast=int),
+    # Images larger than INPUT_SIZE are segmented at full resolution with
+    # overlapping INPUT_SIZE tiles instead of being resized down
+    "TILING": config("ANALYSIS_TILING", default=True, cast=bool),
+    "TILE_OVERLAP": config("ANALYSIS_TILE_OVERLAP", default=32, cast=int),
+    # Most tiles of one image submitted to the engine and not yet blended
+    "TILE_BUDGET": config("ANALYSIS_TILE_BUDGET", default=32, cast=int),
+}
+
 # Security Settings (Production)
 if not DEBUG:
     SECURE_SSL_REDIRECT = True
@@ -235,17 +419,20 @@ if USE_S3:
     AWS_SECRET_ACCESS_KEY = config("AWS_SECRET_ACCESS_KEY")
     AWS_STORAGE_BUCKET_NAME = config("AWS_STORAGE_BUCKET_NAME")
     AWS_S3_REGION_NAME = config("AWS_S3_REGION_NAME", default="us-east-1")
-    AWS_S3_CUSTOM_DOMAIN = f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com"
-    AWS_DEFAULT_ACL = "public-read"
+    # No custom domain: django-storages only presigns bucket-endpoint URLs
+    AWS_S3_CUSTOM_DOMAIN = None
+    # Private bucket; files are reached through short-lived presigned URLs
+    AWS_DEFAULT_ACL = None
     AWS_S3_OBJECT_PARAMETERS = {
-        "CacheControl": "max-age=86400",
+        "CacheControl": "private, max-age=86400",
     }
     AWS_LOCATION = "media"
-    AWS_QUERYSTRING_AUTH = False
+    AWS_QUERYSTRING_AUTH = True
+    AWS_QUERYSTRING_EXPIRE = MEDIA_DELIVERY["URL_EXPIRY"]
 
     # S3 Media Settings
     DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
-    MEDIA_URL = f"https://{AWS_S3_CUSTOM_DOMAIN}/{AWS_LOCATION}/"
+    MEDIA_URL = f"https://{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/{AWS_LOCATION}/"
 else:
     # Local media files
     MEDIA_URL = "/media/"
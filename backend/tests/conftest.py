@@ -2,7 +2,9 @@
 Pytest configuration and fixtures
 """
 import io
+import struct
 
+import numpy as np
 import pytest
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -92,6 +94,21 @@ def sample_image():
     )
 
 
+@pytest.fixture(scope="session")
+def large_png():
+    """
+    Encoded 13400 x 13400 grayscale PNG with a white rectangle.
+
+    At 179.6 megapixels it is past Pillow's default decompression bomb
+    limit, yet compresses to a few hundred kilobytes.
+    """
+    image = Image.new("L", (13400, 13400))
+    image.paste(255, (2000, 3000, 9000, 8000))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
 @pytest.fixture
 def sample_dicom_file():
     """Create a mock DICOM file for testing"""
@@ -102,6 +119,88 @@ def sample_dicom_file():
     )
 
 
+def _dicom_element(group, element, vr, value, explicit=True):
+    """Encode one little-endian DICOM data element"""
+    if len(value) % 2:
+        value += b"\x00" if vr in ("UI", "OB", "OW") else b" "
+    if not explicit:
+        return struct.pack("<HHI", group, element, len(value)) + value
+    if vr in ("OB", "OW", "SQ", "UN", "UT"):
+        return struct.pack("<HH2sHI", group, element, vr.encode(), 0, len(value)) + (
+            value
+        )
+    return struct.pack("<HH2sH", group, element, vr.encode(), len(value)) + value
+
+
+def build_dicom(
+    pixels,
+    explicit=True,
+    window=None,
+    rescale=(1.0, 0.0),
+    modality="CT",
+    include_sequence=True,
+):
+    """Build DICOM Part 10 bytes for a 2D uint8/int16/uint16 pixel array"""
+    pixels = np.ascontiguousarray(pixels)
+    rows, columns = pixels.shape
+    bits = pixels.dtype.itemsize * 8
+    signed = 1 if pixels.dtype.kind == "i" else 0
+    syntax = b"1.2.840.10008.1.2.1" if explicit else b"1.2.840.10008.1.2"
+
+    meta = _dicom_element(0x0002, 0x0010, "UI", syntax)
+    meta = _dicom_element(0x0002, 0x0000, "UL", struct.pack("<I", len(meta))) + meta
+
+    def el(group, element, vr, value):
+        return _dicom_element(group, element, vr, value, explicit)
+
+    def us(value):
+        return struct.pack("<H", value)
+
+    dataset = el(0x0008, 0x0060, "CS", modality.encode())
+    if include_sequence:
+        # Referenced Image Sequence with undefined length, to be skipped
+        item = el(0x0008, 0x1150, "UI", b"1.2.3") + el(0x0008, 0x1155, "UI", b"1.2.4")
+        sequence = (
+            struct.pack("<HHI", 0xFFFE, 0xE000, 0xFFFFFFFF)
+            + item
+            + struct.pack("<HHI", 0xFFFE, 0xE00D, 0)
+            + struct.pack("<HHI", 0xFFFE, 0xE0DD, 0)
+        )
+        if explicit:
+            dataset += struct.pack("<HH2sHI", 0x0008, 0x1140, b"SQ", 0, 0xFFFFFFFF)
+        else:
+            dataset += struct.pack("<HHI", 0x0008, 0x1140, 0xFFFFFFFF)
+        dataset += sequence
+    dataset += el(0x0028, 0x0002, "US", us(1))
+    dataset += el(0x0028, 0x0004, "CS", b"MONOCHROME2")
+    dataset += el(0x0028, 0x0010, "US", us(rows))
+    dataset += el(0x0028, 0x0011, "US", us(columns))
+    dataset += el(0x0028, 0x0100, "US", us(bits))
+    dataset += el(0x0028, 0x0101, "US", us(bits))
+    dataset += el(0x0028, 0x0103, "US", us(signed))
+    if window is not None:
+        dataset += el(0x0028, 0x1050, "DS", str(window[0]).encode())
+        dataset += el(0x0028, 0x1051, "DS", str(window[1]).encode())
+    slope, intercept = rescale
+    dataset += el(0x0028, 0x1052, "DS", str(intercept).encode())
+    dataset += el(0x0028, 0x1053, "DS", str(slope).encode())
+    pixel_vr = "OB" if bits == 8 else "OW"
+    dataset += el(
+        0x7FE0,
+        0x0010,
+        pixel_vr,
+        pixels.astype(pixels.dtype.newbyteorder("<")).tobytes(),
+    )
+
+    return b"\x00" * 128 + b"DICM" + meta + dataset
+
+
+@pytest.fixture
+def make_dicom():
+    """Factory fixture returning DICOM file bytes for a pixel array"""
+    return build_dicom
+
+
 @pytest.fixture
 def create_medical_image(db, user):
     """Factory fixture to create medical images"""
@@ -137,3 +236,11 @@ def disable_ssl_redirect(settings):
     """Disable SSL redirect for tests to prevent 301 redirects"""
     settings.SECURE_SSL_REDIRECT = False
     settings.SECURE_PROXY_SSL_HEADER = None
+
+
+@pytest.fixture(autouse=True)
+def clear_analysis_cache():
+    """Start every test with an empty analysis result cache"""
+    from django.core.cache import caches
+
+    caches["analysis"].clear()
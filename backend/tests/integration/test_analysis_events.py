@@ -0,0 +1,84 @@
+"""
+Integration tests for the analysis event stream
+"""
+import asyncio
+
+import pytest
+from apps.analysis.events import get_broker
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+@pytest.fixture
+def token(user):
+    return str(RefreshToken.for_user(user).access_token)
+
+
+async def read_stream(response, count):
+    """The first ``count`` messages of a streaming response, then disconnect"""
+    content = aiter(response.streaming_content)
+    try:
+        return [
+            (await asyncio.wait_for(anext(content), 2)).decode() for _ in range(count)
+        ]
+    finally:
+        await content.aclose()
+
+
+@pytest.mark.analysis
+@pytest.mark.integration
+class TestAnalysisEvents:
+    """Test server-sent analysis events"""
+
+    url = "/api/analysis/events/"
+
+    def test_url(self):
+        assert reverse("analysis-events") == self.url
+
+    def test_events_are_pushed(self, user, token):
+        """Test that a published event reaches the open stream"""
+
+        async def scenario():
+            response = await AsyncClient().get(
+                self.url, headers={"Authorization": f"Bearer {token}"}
+            )
+            assert response.status_code == 200
+            assert response["Content-Type"] == "text/event-stream"
+            content = aiter(response.streaming_content)
+            connected = await anext(content)
+            get_broker().publish(user.pk, {"type": "started", "image_id": 5})
+            message = await asyncio.wait_for(anext(content), 2)
+            await content.aclose()
+            return connected.decode(), message.decode()
+
+        connected, message = async_to_sync(scenario)()
+
+        assert connected.startswith(": connected")
+        assert message.startswith("event: started\n")
+        assert '"image_id":5' in message
+        assert get_broker().subscribers(user.pk) == 0
+
+    def test_token_query_parameter(self, token, settings):
+        """Test EventSource-style authentication and keep-alives"""
+        settings.ANALYSIS_EVENTS = {**settings.ANALYSIS_EVENTS, "HEARTBEAT": 0.05}
+
+        async def scenario():
+            response = await AsyncClient().get(self.url, {"token": token})
+            return await read_stream(response, 2)
+
+        assert async_to_sync(scenario)()[1] == ": keep-alive\n\n"
+
+    @pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer bad"}])
+    def test_unauthenticated(self, headers):
+        async def scenario():
+            return await AsyncClient().get(self.url, headers=headers)
+
+        assert async_to_sync(scenario)().status_code == 401
+
+    def test_asgi_application(self):
+        """Test that the ASGI entry point loads"""
+        from medscan.asgi import application
+
+        assert callable(application)
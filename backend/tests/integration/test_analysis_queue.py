@@ -0,0 +1,48 @@
+"""
+Integration tests for the analysis queue report endpoint
+"""
+import pytest
+from apps.analysis.jobs import enqueue_analysis, lease_jobs
+from apps.analysis.models import AnalysisJob
+from django.urls import reverse
+from rest_framework import status
+
+
+@pytest.mark.analysis
+@pytest.mark.integration
+class TestAnalysisQueue:
+    """Test the queue wait report for staff"""
+
+    url = "/api/analysis/queue/"
+
+    def test_url(self):
+        assert reverse("analysis-queue") == self.url
+
+    def test_report(self, admin_client, medical_image):
+        """Test per-class waits of jobs started in the window"""
+        enqueue_analysis(medical_image, priority=AnalysisJob.Priority.URGENT)
+        lease_jobs("worker-a")
+
+        response = admin_client.get(self.url, {"minutes": 5})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert list(response.data["priorities"]) == [
+            "stat",
+            "urgent",
+            "routine",
+            "backfill",
+        ]
+        urgent = response.data["priorities"]["urgent"]
+        assert urgent["started"] == 1
+        assert urgent["pending"] == 0
+        assert urgent["max_wait"] >= 0
+
+    def test_staff_only(self, authenticated_client):
+        response = authenticated_client.get(self.url)
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_invalid_window(self, admin_client):
+        response = admin_client.get(self.url, {"minutes": "soon"})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
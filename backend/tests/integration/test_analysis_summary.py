@@ -0,0 +1,62 @@
+"""
+Integration tests for the analysis summary endpoint
+"""
+import pytest
+from apps.analysis.models import AnalysisSummary
+from apps.analysis.pipeline import save_analysis
+from django.urls import reverse
+from rest_framework import status
+
+
+@pytest.mark.analysis
+@pytest.mark.integration
+class TestAnalysisSummary:
+    """Test the per-user dashboard summary"""
+
+    url = "/api/analysis/summary/"
+
+    def test_url(self):
+        assert reverse("analysis-summary") == self.url
+
+    def test_summary(
+        self,
+        authenticated_client,
+        create_medical_image,
+        user,
+        sample_image,
+        django_assert_max_num_queries,
+    ):
+        """Test counts, average processing time and per-model means"""
+        images = [create_medical_image(user=user, image=sample_image) for _ in range(3)]
+        save_analysis(images[0], {}, 1.0, "v1", dice_score=0.9, iou_score=0.8)
+        save_analysis(images[1], {}, 2.0, "v1", dice_score=0.7)
+
+        # Authentication plus one read of the summary row
+        with django_assert_max_num_queries(2):
+            response = authenticated_client.get(self.url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["uploaded"] == 3
+        assert response.data["analyzed"] == 2
+        assert response.data["pending"] == 1
+        assert response.data["average_processing_time"] == pytest.approx(1.5)
+        v1 = response.data["models"]["v1"]
+        assert v1["analyses"] == 2
+        assert v1["mean_dice"] == pytest.approx(0.8)
+        assert v1["mean_iou"] == pytest.approx(0.8)
+
+    def test_summary_built_on_first_read(self, authenticated_client, user):
+        """Test that a user without a summary row gets one"""
+        AnalysisSummary.objects.filter(user=user).delete()
+
+        response = authenticated_client.get(self.url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["uploaded"] == 0
+        assert response.data["average_processing_time"] is None
+        assert AnalysisSummary.objects.filter(user=user).exists()
+
+    def test_summary_unauthenticated(self, api_client):
+        response = api_client.get(self.url)
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,181 @@
+"""
+Integration tests for bulk image ingest
+"""
+import io
+import zipfile
+
+import pytest
+from apps.analysis.jobs import enqueue_jobs
+from apps.analysis.models import AnalysisJob
+from apps.images.models import ImageBlob, MedicalImage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+
+BULK_URL = "/api/images/bulk/"
+
+
+def png_bytes(color="red", size=(32, 24)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def upload(name, content):
+    return SimpleUploadedFile(name, content, content_type="application/octet-stream")
+
+
+def zip_bytes(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in entries.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestBulkUpload:
+    """Test POST /api/images/bulk/"""
+
+    def test_url(self):
+        """Test that the action is routed on the image list"""
+        assert reverse("images-bulk") == BULK_URL
+
+    def test_multiple_files(self, authenticated_client, user):
+        """Test that every form file becomes an image, in order"""
+        colors = ["red", "green", "blue"]
+        files = [upload(f"slice-{i}.png", png_bytes(c)) for i, c in enumerate(colors)]
+
+        response = authenticated_client.post(
+            BULK_URL, {"files": files, "description": "Study"}, format="multipart"
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data["created"] == 3
+        assert [r["filename"] for r in response.data["results"]] == [
+            "slice-0.png",
+            "slice-1.png",
+            "slice-2.png",
+        ]
+        ids = [r["id"] for r in response.data["results"]]
+        images = MedicalImage.objects.in_bulk(ids)
+        assert [images[pk].title for pk in ids] == ["slice-0", "slice-1", "slice-2"]
+        for image in images.values():
+            assert image.user == user
+            assert image.description == "Study"
+            assert (image.width, image.height) == (32, 24)
+            assert image.blob.ref_count == 1
+        assert (
+            AnalysisJob.objects.filter(
+                image_id__in=ids, kind=AnalysisJob.Kind.TILES
+            ).count()
+            == 3
+        )
+
+    def test_zip_archive(self, authenticated_client):
+        """Test per-entry results for an archive, skipping metadata entries"""
+        archive = zip_bytes(
+            {
+                "study/a.png": png_bytes("red"),
+                "study/b.png": png_bytes("blue"),
+                "study/notes.txt": b"not an image",
+                "study/fake.png": b"not a png either",
+                "__MACOSX/study/._a.png": b"resource fork",
+            }
+        )
+
+        response = authenticated_client.post(
+            BULK_URL,
+            {"archive": upload("study.zip", archive), "title": "CT"},
+            format="multipart",
+        )
+
+        assert response.status_code == status.HTTP_207_MULTI_STATUS
+        assert (response.data["created"], response.data["failed"]) == (2, 2)
+        results = {r["filename"]: r for r in response.data["results"]}
+        assert set(results) == {"a.png", "b.png", "notes.txt", "fake.png"}
+        assert results["notes.txt"]["error"] == "File extension is not allowed"
+        assert results["fake.png"]["status"] == "error"
+        assert MedicalImage.objects.filter(title="CT").count() == 2
+
+    def test_duplicates_share_a_blob(self, authenticated_client):
+        """Test that identical files in one request store one blob"""
+        content = png_bytes("purple")
+        archive = zip_bytes({"one.png": content, "two.png": content})
+
+        response = authenticated_client.post(
+            BULK_URL,
+            {
+                "files": [upload("three.png", content)],
+                "archive": upload("s.zip", archive),
+            },
+            format="multipart",
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert ImageBlob.objects.get().ref_count == 3
+        assert MedicalImage.objects.count() == 3
+
+    def test_oversized_entry(self, authenticated_client, settings):
+        """Test the per-file size limit on decompressed archive entries"""
+        settings.BULK_UPLOADS = {**settings.BULK_UPLOADS, "MAX_FILE_SIZE": 100}
+        archive = zip_bytes({"big.png": png_bytes(size=(256, 256))})
+
+        response = authenticated_client.post(
+            BULK_URL, {"archive": upload("s.zip", archive)}, format="multipart"
+        )
+
+        assert response.status_code == status.HTTP_207_MULTI_STATUS
+        assert response.data["results"][0]["error"].startswith("File size")
+        assert not MedicalImage.objects.exists()
+
+    def test_too_many_files(self, authenticated_client, settings):
+        """Test that the file count is checked before any work is done"""
+        settings.BULK_UPLOADS = {**settings.BULK_UPLOADS, "MAX_FILES": 2}
+        archive = zip_bytes({f"{i}.png": png_bytes() for i in range(3)})
+
+        response = authenticated_client.post(
+            BULK_URL, {"archive": upload("s.zip", archive)}, format="multipart"
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not ImageBlob.objects.exists()
+
+    def test_invalid_archive(self, authenticated_client):
+        """Test a corrupt archive"""
+        response = authenticated_client.post(
+            BULK_URL,
+            {"archive": upload("s.zip", b"not a zip")},
+            format="multipart",
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["error"] == "Archive is not a valid zip file"
+
+    def test_no_files(self, authenticated_client):
+        """Test an empty request"""
+        response = authenticated_client.post(BULK_URL, {}, format="multipart")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_requires_authentication(self, api_client):
+        """Test that anonymous bulk uploads are rejected"""
+        response = api_client.post(BULK_URL, {}, format="multipart")
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.analysis
+@pytest.mark.integration
+def test_enqueue_jobs_skips_active(medical_image, create_medical_image, sample_image):
+    """Test that bulk enqueue only adds jobs for images without one"""
+    other = create_medical_image(user=medical_image.user, image=sample_image)
+    AnalysisJob.objects.filter(kind=AnalysisJob.Kind.TILES).delete()
+    enqueue_jobs([medical_image.id])
+
+    jobs = enqueue_jobs([medical_image.id, other.id, other.id])
+
+    assert [job.image_id for job in jobs] == [other.id]
+    assert AnalysisJob.objects.filter(kind=AnalysisJob.Kind.ANALYSIS).count() == 2
@@ -0,0 +1,168 @@
+"""
+Integration tests for resumable chunked uploads
+"""
+import io
+
+import pytest
+from apps.images.models import MedicalImage, UploadSession
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(settings, tmp_path):
+    """Stage partial uploads in a temporary directory"""
+    settings.CHUNKED_UPLOADS = {**settings.CHUNKED_UPLOADS, "DIR": str(tmp_path)}
+    return tmp_path
+
+
+@pytest.fixture
+def png_bytes():
+    """Encoded PNG payload to upload in pieces"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color="blue").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def create_session(client, payload, filename="scan.png"):
+    url = reverse("uploads-list")
+    return client.post(
+        url,
+        {"filename": filename, "total_size": len(payload), "title": "Chunked"},
+        format="json",
+    )
+
+
+def put_chunk(client, session_id, payload, start, end=None):
+    end = len(payload) if end is None else end
+    url = reverse("uploads-detail", kwargs={"pk": session_id})
+    return client.put(
+        url,
+        data=payload[start:end],
+        content_type="application/octet-stream",
+        HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(payload)}",
+    )
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestChunkedUpload:
+    """Test the create / PUT / finalize flow"""
+
+    def test_upload_in_chunks_creates_image(self, authenticated_client, png_bytes):
+        """Test uploading a file in three chunks and finalizing it"""
+        session_id = create_session(authenticated_client, png_bytes).data["id"]
+        third = len(png_bytes) // 3
+
+        for start, end in [(0, third), (third, 2 * third), (2 * third, None)]:
+            response = put_chunk(
+                authenticated_client, session_id, png_bytes, start, end
+            )
+            assert response.status_code == status.HTTP_200_OK
+
+        assert response.data["offset"] == len(png_bytes)
+
+        url = reverse("uploads-finalize", kwargs={"pk": session_id})
+        response = authenticated_client.post(url)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        image = MedicalImage.objects.get(id=response.data["id"])
+        assert image.title == "Chunked"
+        assert image.file_size == len(png_bytes)
+        assert (image.width, image.height) == (64, 48)
+        with image.image.open("rb") as fh:
+            assert fh.read() == png_bytes
+
+    def test_resume_after_interruption(self, authenticated_client, png_bytes):
+        """Test that a client can resume from the committed offset"""
+        session_id = create_session(authenticated_client, png_bytes).data["id"]
+        half = len(png_bytes) // 2
+        put_chunk(authenticated_client, session_id, png_bytes, 0, half)
+
+        # The client lost track and retries the first chunk
+        response = put_chunk(authenticated_client, session_id, png_bytes, 0, half)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.data["offset"] == half
+
+        url = reverse("uploads-detail", kwargs={"pk": session_id})
+        offset = authenticated_client.get(url).data["offset"]
+        response = put_chunk(authenticated_client, session_id, png_bytes, offset)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["offset"] == len(png_bytes)
+
+    def test_resume_after_staged_bytes_are_lost(self, authenticated_client, png_bytes):
+        """Test that a short staging file moves the offset back, not zero-fills"""
+        session_id = create_session(authenticated_client, png_bytes).data["id"]
+        half = len(png_bytes) // 2
+        put_chunk(authenticated_client, session_id, png_bytes, 0, half)
+        part_path = UploadSession.objects.get(pk=session_id).part_path
+        with open(part_path, "r+b") as part:
+            part.truncate(10)
+
+        response = put_chunk(authenticated_client, session_id, png_bytes, half)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.data["offset"] == 10
+
+        response = put_chunk(authenticated_client, session_id, png_bytes, 10)
+        assert response.status_code == status.HTTP_200_OK
+        assert part_path.read_bytes() == png_bytes
+
+    def test_finalize_incomplete_upload(self, authenticated_client, png_bytes):
+        """Test that finalizing before all bytes arrive is rejected"""
+        session_id = create_session(authenticated_client, png_bytes).data["id"]
+        put_chunk(authenticated_client, session_id, png_bytes, 0, 10)
+
+        url = reverse("uploads-finalize", kwargs={"pk": session_id})
+        response = authenticated_client.post(url)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not MedicalImage.objects.exists()
+
+    def test_finalize_rejects_non_image_bytes(self, authenticated_client, upload_dir):
+        """Test that the finished upload is checked by content, not extension"""
+        payload = bytes(range(256)) * 8
+        session_id = create_session(authenticated_client, payload).data["id"]
+        put_chunk(authenticated_client, session_id, payload, 0)
+
+        url = reverse("uploads-finalize", kwargs={"pk": session_id})
+        response = authenticated_client.post(url)
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert not MedicalImage.objects.exists()
+        assert not list(upload_dir.iterdir())
+        assert UploadSession.objects.get(id=session_id).status == "aborted"
+
+    def test_create_rejects_bad_extension(self, authenticated_client, png_bytes):
+        """Test that session creation validates the file name"""
+        response = create_session(authenticated_client, png_bytes, filename="a.exe")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_abort_removes_staging_file(
+        self, authenticated_client, png_bytes, upload_dir
+    ):
+        """Test that deleting a session discards partial data"""
+        session_id = create_session(authenticated_client, png_bytes).data["id"]
+        put_chunk(authenticated_client, session_id, png_bytes, 0, 10)
+
+        url = reverse("uploads-detail", kwargs={"pk": session_id})
+        response = authenticated_client.delete(url)
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert not list(upload_dir.iterdir())
+        assert UploadSession.objects.get(id=session_id).status == "aborted"
+
+    def test_other_user_session_not_found(
+        self, authenticated_client, create_user, png_bytes
+    ):
+        """Test that sessions are isolated per user"""
+        from apps.images.uploads import create_session as open_session
+
+        other = create_user(email="other@example.com")
+        session = open_session(other, "scan.png", len(png_bytes))
+
+        response = put_chunk(authenticated_client, session.id, png_bytes, 0)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
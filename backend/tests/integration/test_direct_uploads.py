@@ -0,0 +1,201 @@
+"""
+Integration tests for presigned direct-to-S3 uploads, against moto
+"""
+import hashlib
+import io
+
+import numpy as np
+import pytest
+from apps.analysis.models import AnalysisJob
+from apps.images.models import ImageBlob, MedicalImage
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+
+moto = pytest.importorskip("moto")
+requests = pytest.importorskip("requests")
+
+BUCKET = "medscan-test"
+
+
+@pytest.fixture
+def s3(settings, monkeypatch):
+    """Point media storage at a mocked private bucket"""
+    import boto3
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        settings.USE_S3 = True
+        settings.AWS_STORAGE_BUCKET_NAME = BUCKET
+        settings.AWS_S3_REGION_NAME = "us-east-1"
+        settings.AWS_LOCATION = "media"
+        settings.AWS_DEFAULT_ACL = None
+        settings.AWS_QUERYSTRING_AUTH = True
+        settings.STORAGES = {
+            **settings.STORAGES,
+            "default": {"BACKEND": "storages.backends.s3boto3.S3Boto3Storage"},
+        }
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def png_bytes(color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def keys(client, prefix):
+    listing = client.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
+    return [item["Key"] for item in listing.get("Contents", [])]
+
+
+def presign(api, content, **extra):
+    response = api.post(
+        reverse("direct-uploads-list"),
+        {"filename": "scan.png", "size": len(content), "title": "Direct", **extra},
+        format="json",
+    )
+    assert response.status_code == status.HTTP_201_CREATED, response.data
+    return response.data
+
+
+def upload_to_bucket(presigned, content):
+    return requests.post(
+        presigned["url"], data=presigned["fields"], files={"file": content}
+    )
+
+
+def commit(api, presigned):
+    return api.post(
+        reverse("direct-uploads-commit"), {"token": presigned["token"]}, format="json"
+    )
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestDirectUploads:
+    """Test the presign and commit flow"""
+
+    def test_presign_upload_commit(self, authenticated_client, s3):
+        """Test that a committed upload becomes a content-addressed image"""
+        content = png_bytes()
+        presigned = presign(authenticated_client, content)
+        assert presigned["fields"]["key"].startswith("media/incoming/")
+
+        assert upload_to_bucket(presigned, content).status_code == 204
+        response = commit(authenticated_client, presigned)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        image = MedicalImage.objects.get(pk=response.data["id"])
+        digest = hashlib.sha256(content).hexdigest()
+        assert image.blob.sha256 == digest
+        assert (image.width, image.height, image.file_size) == (64, 48, len(content))
+        assert keys(s3, "media/incoming/") == []
+        assert keys(s3, "media/blobs/") == [f"media/{image.image.name}"]
+        assert AnalysisJob.objects.filter(
+            image=image, kind=AnalysisJob.Kind.TILES
+        ).exists()
+
+    def test_duplicate_is_not_copied(self, authenticated_client, s3):
+        """Test that re-uploading the same bytes only adds a reference"""
+        content = png_bytes("blue")
+        for _ in range(2):
+            presigned = presign(
+                authenticated_client,
+                content,
+                sha256=hashlib.sha256(content).hexdigest(),
+            )
+            upload_to_bucket(presigned, content)
+            assert commit(authenticated_client, presigned).status_code == 201
+
+        assert ImageBlob.objects.get().ref_count == 2
+        assert len(keys(s3, "media/blobs/")) == 1
+        assert keys(s3, "media/incoming/") == []
+
+    def test_declared_checksum_is_not_trusted(self, authenticated_client, s3):
+        """Test that the stored digest comes from the bytes, not the client"""
+        content = png_bytes("green")
+        presigned = presign(authenticated_client, content, sha256="0" * 64)
+        upload_to_bucket(presigned, content)
+
+        response = commit(authenticated_client, presigned)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert ImageBlob.objects.get().sha256 == hashlib.sha256(content).hexdigest()
+
+    def test_commit_without_upload(self, authenticated_client, s3):
+        """Test committing before the object exists"""
+        presigned = presign(authenticated_client, png_bytes())
+
+        response = commit(authenticated_client, presigned)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_commit_rejects_non_image(self, authenticated_client, s3):
+        """Test that unreadable objects are deleted and rejected"""
+        content = np.zeros(256, dtype=np.uint8).tobytes()
+        presigned = presign(authenticated_client, content)
+        upload_to_bucket(presigned, content)
+
+        response = commit(authenticated_client, presigned)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert keys(s3, "media/incoming/") == []
+        assert not MedicalImage.objects.exists()
+
+    def test_token_is_bound_to_user(
+        self, authenticated_client, api_client, create_user, s3
+    ):
+        """Test that another user cannot commit someone else's upload"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+
+        content = png_bytes()
+        presigned = presign(authenticated_client, content)
+        upload_to_bucket(presigned, content)
+
+        other = create_user(email="other@example.com")
+        api_client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(other).access_token}"
+        )
+        response = commit(api_client, presigned)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not MedicalImage.objects.exists()
+
+    def test_size_limits(self, authenticated_client, s3, settings):
+        """Test declared size validation and the exact-size POST policy"""
+        settings.DIRECT_UPLOADS = {**settings.DIRECT_UPLOADS, "MAX_SIZE": 10}
+        response = authenticated_client.post(
+            reverse("direct-uploads-list"),
+            {"filename": "scan.png", "size": 11},
+            format="json",
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        assert ["content-length-range", 5, 5] in self._policy(
+            presign(authenticated_client, b"12345")
+        )
+
+    @staticmethod
+    def _policy(presigned):
+        import base64
+        import json
+
+        policy = json.loads(base64.b64decode(presigned["fields"]["policy"]))
+        return policy["conditions"]
+
+
+@pytest.mark.images
+@pytest.mark.integration
+def test_requires_s3(authenticated_client):
+    """Test that presigning is refused with local media storage"""
+    response = authenticated_client.post(
+        reverse("direct-uploads-list"),
+        {"filename": "scan.png", "size": 100},
+        format="json",
+    )
+
+    assert response.status_code == status.HTTP_409_CONFLICT
@@ -0,0 +1,146 @@
+"""
+Integration tests for streaming image exports
+"""
+import csv
+import io
+import json
+
+import pytest
+from apps.analysis.pipeline import save_analysis
+from apps.images.export import EXPORT_COLUMNS
+from django.core.management import call_command
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from rest_framework import status
+
+
+def read_ndjson(response):
+    body = b"".join(response.streaming_content).decode()
+    return [json.loads(line) for line in body.splitlines()]
+
+
+@pytest.fixture
+def images(create_medical_image, user, sample_image):
+    """Three images of which the newest is analyzed"""
+    created = [
+        create_medical_image(user=user, title=f"Image {index}", image=sample_image)
+        for index in range(3)
+    ]
+    save_analysis(
+        created[2],
+        {"foreground_fraction": 0.25, "confidence": 0.9},
+        1.5,
+        "v1",
+        dice_score=0.8,
+    )
+    return created
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestImageExport:
+    """Test the streaming export endpoint"""
+
+    url = "/api/images/export/"
+
+    def test_url(self):
+        assert reverse("images-export") == self.url
+
+    def test_ndjson(self, authenticated_client, images, settings):
+        """Test that every image streams with its analysis, newest first"""
+        settings.IMAGE_EXPORT = {"CHUNK_SIZE": 2}
+
+        response = authenticated_client.get(self.url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert isinstance(response, StreamingHttpResponse)
+        assert response["Content-Type"] == "application/x-ndjson"
+        assert "images.ndjson" in response["Content-Disposition"]
+        rows = read_ndjson(response)
+        assert [row["id"] for row in rows] == [image.pk for image in images[::-1]]
+        assert list(rows[0]) == list(EXPORT_COLUMNS)
+        assert rows[0]["model_version"] == "v1"
+        assert rows[0]["dice_score"] == pytest.approx(0.8)
+        assert rows[0]["foreground_fraction"] == pytest.approx(0.25)
+        assert rows[0]["sha256"] == images[2].blob.sha256
+        assert rows[1]["model_version"] is None
+
+    def test_csv(self, authenticated_client, images):
+        """Test the CSV header and rows"""
+        response = authenticated_client.get(self.url, {"output": "csv"})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"].startswith("text/csv")
+        body = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        assert len(rows) == 3
+        assert list(rows[0]) == list(EXPORT_COLUMNS)
+        assert rows[0]["processing_time"] == "1.5"
+        assert rows[1]["dice_score"] == ""
+
+    def test_filters_and_owner(
+        self, authenticated_client, images, create_user, create_medical_image
+    ):
+        """Test that list filters apply and other users' images are excluded"""
+        create_medical_image(user=create_user(email="other@example.com"))
+
+        response = authenticated_client.get(self.url, {"analyzed": "false"})
+
+        assert {row["id"] for row in read_ndjson(response)} == {
+            images[0].pk,
+            images[1].pk,
+        }
+
+    def test_single_query(
+        self, authenticated_client, images, django_assert_max_num_queries
+    ):
+        """Test that images and analyses are read with one joined query"""
+        # Authentication plus the export query
+        with django_assert_max_num_queries(2):
+            response = authenticated_client.get(self.url)
+            rows = read_ndjson(response)
+
+        assert len(rows) == 3
+
+    def test_invalid_output(self, authenticated_client):
+        response = authenticated_client.get(self.url, {"output": "xml"})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_unauthenticated(self, api_client):
+        response = api_client.get(self.url)
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestExportCommand:
+    """Test the export_images management command"""
+
+    def test_stdout(self, images, user):
+        """Test NDJSON on standard output filtered by user"""
+        stdout = io.StringIO()
+
+        call_command("export_images", "--user", user.email, stdout=stdout)
+
+        assert len(stdout.getvalue().splitlines()) == 3
+
+    def test_csv_file(self, images, tmp_path):
+        """Test CSV written to a file"""
+        path = tmp_path / "images.csv"
+
+        call_command(
+            "export_images",
+            "--output",
+            "csv",
+            "--analyzed",
+            "true",
+            "--file",
+            str(path),
+            stderr=io.StringIO(),
+        )
+
+        with open(path, newline="") as file:
+            rows = list(csv.DictReader(file))
+        assert [int(row["id"]) for row in rows] == [images[2].pk]
@@ -0,0 +1,116 @@
+"""
+Integration tests for authenticated original file delivery
+"""
+import pytest
+from apps.images.delivery import parse_range
+from django.urls import reverse
+from rest_framework import status
+
+
+def file_url(image):
+    return reverse("images-file", kwargs={"pk": image.id})
+
+
+def body(response):
+    return b"".join(response.streaming_content)
+
+
+@pytest.mark.unit
+@pytest.mark.images
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=10-", (10, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=90-500", (90, 99)),
+        ("bytes=0-1,5-6", None),
+        ("items=0-1", None),
+        (None, None),
+    ],
+)
+def test_parse_range(header, expected):
+    """Test single byte range parsing against a 100 byte file"""
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestFileEndpoint:
+    """Test /api/images/{id}/file/"""
+
+    def test_full_file(self, authenticated_client, medical_image):
+        """Test streaming the whole file with validators"""
+        response = authenticated_client.get(file_url(medical_image))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"] == "image/png"
+        assert response["Accept-Ranges"] == "bytes"
+        assert response["ETag"] == f'"{medical_image.blob.sha256}"'
+        with medical_image.image.open("rb") as fh:
+            assert body(response) == fh.read()
+
+    def test_byte_range(self, authenticated_client, medical_image):
+        """Test partial content for a single range"""
+        response = authenticated_client.get(
+            file_url(medical_image), HTTP_RANGE="bytes=1-3"
+        )
+
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response["Content-Range"] == f"bytes 1-3/{medical_image.file_size}"
+        assert body(response) == b"PNG"
+
+    def test_unsatisfiable_range(self, authenticated_client, medical_image):
+        """Test 416 for a range past the end of the file"""
+        response = authenticated_client.get(
+            file_url(medical_image), HTTP_RANGE="bytes=999999-"
+        )
+
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        assert response["Content-Range"] == f"bytes */{medical_image.file_size}"
+
+    def test_if_none_match(self, authenticated_client, medical_image):
+        """Test 304 when the client already has the file"""
+        etag = f'"{medical_image.blob.sha256}"'
+
+        response = authenticated_client.get(
+            file_url(medical_image), HTTP_IF_NONE_MATCH=f'"stale", {etag}'
+        )
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response["ETag"] == etag
+
+    def test_x_accel_redirect(self, authenticated_client, medical_image, settings):
+        """Test that nginx mode hands off the transfer without a body"""
+        settings.MEDIA_DELIVERY = {**settings.MEDIA_DELIVERY, "BACKEND": "nginx"}
+
+        response = authenticated_client.get(file_url(medical_image))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["X-Accel-Redirect"] == (
+            "/protected-media/" + medical_image.image.name
+        )
+        assert response.content == b""
+        assert response["ETag"] == f'"{medical_image.blob.sha256}"'
+
+    def test_other_users_file(
+        self, authenticated_client, create_user, create_medical_image, sample_image
+    ):
+        """Test that only the owner can fetch the file"""
+        other = create_user(email="other@example.com")
+        image = create_medical_image(user=other, image=sample_image)
+
+        response = authenticated_client.get(file_url(image))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_image_url_points_to_endpoint(self, authenticated_client, medical_image):
+        """Test that serialized image_url is the authenticated endpoint"""
+        detail = authenticated_client.get(
+            reverse("images-detail", kwargs={"pk": medical_image.id})
+        )
+        listing = authenticated_client.get(reverse("images-list"))
+
+        expected = "http://testserver" + file_url(medical_image)
+        assert detail.data["image_url"] == expected
+        assert listing.data["results"][0]["image_url"] == expected
@@ -1,9 +1,14 @@
 """
 Integration tests for images API endpoints
 """
+import io
+
+import numpy as np
 import pytest
+from apps.analysis.models import AnalysisJob
 from apps.images.models import MedicalImage
 from django.urls import reverse
+from PIL import Image
 from rest_framework import status
 
 
@@ -56,6 +61,70 @@ class TestImageList:
         assert len(response.data["results"]) == 1
         assert response.data["results"][0]["title"] == "My Image"
 
+    def test_list_images_query_count(
+        self,
+        authenticated_client,
+        user,
+        create_medical_image,
+        sample_image,
+        django_assert_num_queries,
+    ):
+        """Test that a page costs one query regardless of its length"""
+        for n in range(5):
+            create_medical_image(user=user, title=f"Image {n}", image=sample_image)
+
+        # One query authenticates the token's user, one fetches the page
+        with django_assert_num_queries(2):
+            response = authenticated_client.get(reverse("images-list"))
+
+        assert len(response.data["results"]) == 5
+
+    def test_list_matches_image_serializer(
+        self, authenticated_client, user, create_medical_image, sample_image
+    ):
+        """Test that the fast list rows equal ImageSerializer output"""
+        from apps.images.serializers import ImageSerializer
+
+        create_medical_image(user=user, title="Pending", image=sample_image)
+        analyzed = create_medical_image(user=user, title="Done", image=sample_image)
+        analyzed.analyzed = True
+        analyzed.save()
+
+        response = authenticated_client.get(reverse("images-list"))
+
+        request = response.wsgi_request
+        expected = ImageSerializer(
+            MedicalImage.objects.filter(user=user),
+            many=True,
+            context={"request": request},
+        ).data
+        assert response.json()["results"] == expected
+
+    def test_list_images_cursor_pagination(
+        self, authenticated_client, user, create_medical_image, sample_image
+    ):
+        """Test walking every page with cursors, including timestamp ties"""
+        images = [
+            create_medical_image(user=user, title=f"Image {n}", image=sample_image)
+            for n in range(5)
+        ]
+        tied = images[0].uploaded_at
+        MedicalImage.objects.filter(pk__in=[i.pk for i in images[:3]]).update(
+            uploaded_at=tied
+        )
+
+        seen = []
+        url = reverse("images-list") + "?page_size=2"
+        while url:
+            response = authenticated_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            assert "count" not in response.data
+            seen.extend(item["id"] for item in response.data["results"])
+            url = response.data["next"]
+
+        expected = MedicalImage.objects.order_by("-uploaded_at", "-id")
+        assert seen == list(expected.values_list("id", flat=True))
+
 
 @pytest.mark.images
 @pytest.mark.integration
@@ -78,6 +147,21 @@ class TestImageUpload:
         assert response.data["description"] == "MRI scan of the brain"
         assert MedicalImage.objects.filter(title="Test Brain Scan").exists()
 
+    def test_upload_image_above_pixel_limit(
+        self, authenticated_client, sample_image, settings
+    ):
+        """Test that PNG and JPEG files too large to decode are refused"""
+        settings.IMAGE_MAX_PIXELS = 100 * 100 - 1
+        url = reverse("images-list")
+
+        response = authenticated_client.post(
+            url, {"image": sample_image}, format="multipart"
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "9,999 pixels" in response.data["image"][0]
+        assert not MedicalImage.objects.exists()
+
     def test_upload_image_without_file(self, authenticated_client):
         """Test upload without image file"""
         url = reverse("images-list")
@@ -220,18 +304,37 @@ class TestImageAnalysis:
     def test_start_analysis(
         self, authenticated_client, create_medical_image, user, sample_image
     ):
-        """Test starting image analysis"""
+        """Test starting image analysis queues a job"""
         image = create_medical_image(user=user, title="To Analyze", image=sample_image)
         url = reverse("images-start-analysis", kwargs={"pk": image.id})
 
         response = authenticated_client.post(url)
 
-        assert response.status_code == status.HTTP_200_OK
+        assert response.status_code == status.HTTP_202_ACCEPTED
         assert "message" in response.data
         assert response.data["image_id"] == image.id
+        assert response.data["status"] == AnalysisJob.Status.PENDING
+        assert AnalysisJob.objects.filter(
+            id=response.data["job_id"], image=image
+        ).exists()
 
         image.refresh_from_db()
         assert image.analysis_started_at is not None
+        assert image.analyzed is False
+
+    def test_start_analysis_twice_reuses_job(
+        self, authenticated_client, create_medical_image, user, sample_image
+    ):
+        """Test that a second request returns the already queued job"""
+        image = create_medical_image(user=user, title="To Analyze", image=sample_image)
+        url = reverse("images-start-analysis", kwargs={"pk": image.id})
+
+        first = authenticated_client.post(url)
+        second = authenticated_client.post(url)
+
+        assert second.status_code == status.HTTP_202_ACCEPTED
+        assert first.data["job_id"] == second.data["job_id"]
+        assert AnalysisJob.objects.filter(image=image).count() == 1
 
     def test_start_analysis_already_analyzed(
         self, authenticated_client, create_medical_image, user, sample_image
@@ -253,6 +356,43 @@ class TestImageAnalysis:
         assert response.status_code == status.HTTP_400_BAD_REQUEST
         assert "error" in response.data
 
+    def test_start_analysis_with_model_version(
+        self, authenticated_client, create_medical_image, user, sample_image
+    ):
+        """Test that a job records the registered model version it asks for"""
+        image = create_medical_image(user=user, title="To Analyze", image=sample_image)
+        url = reverse("images-start-analysis", kwargs={"pk": image.id})
+
+        response = authenticated_client.post(
+            url, {"model_version": "otsu-baseline"}, format="json"
+        )
+        unknown = authenticated_client.post(
+            url, {"model_version": "missing-v9"}, format="json"
+        )
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        job = AnalysisJob.objects.get(id=response.data["job_id"])
+        assert job.model_version == "otsu-baseline"
+        assert unknown.status_code == status.HTTP_400_BAD_REQUEST
+        assert "model_version" in unknown.data
+
+    def test_start_analysis_with_priority(
+        self, authenticated_client, create_medical_image, user, sample_image
+    ):
+        """Test that a job is queued in the requested priority class"""
+        image = create_medical_image(user=user, title="To Analyze", image=sample_image)
+        url = reverse("images-start-analysis", kwargs={"pk": image.id})
+
+        routine = authenticated_client.post(url)
+        stat = authenticated_client.post(url, {"priority": "stat"}, format="json")
+        unknown = authenticated_client.post(url, {"priority": "asap"}, format="json")
+
+        assert routine.data["priority"] == AnalysisJob.Priority.ROUTINE
+        assert stat.data["job_id"] == routine.data["job_id"]
+        assert stat.data["priority"] == AnalysisJob.Priority.STAT
+        assert unknown.status_code == status.HTTP_400_BAD_REQUEST
+        assert "priority" in unknown.data
+
     def test_start_analysis_other_user_image(
         self, authenticated_client, create_user, create_medical_image, sample_image
     ):
@@ -266,3 +406,289 @@ class TestImageAnalysis:
         response = authenticated_client.post(url)
 
         assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestBatchAnalysis:
+    """Test starting analysis for many images at once"""
+
+    url = "/api/images/start_analysis/"
+
+    @pytest.fixture
+    def images(self, create_medical_image, user, sample_image):
+        return [
+            create_medical_image(user=user, title=f"Slice {i}", image=sample_image)
+            for i in range(3)
+        ]
+
+    def test_url(self):
+        """Test that the list-level action does not shadow the detail one"""
+        assert reverse("images-start-batch-analysis") == self.url
+        assert reverse("images-start-analysis", kwargs={"pk": 1}) == (
+            "/api/images/1/start_analysis/"
+        )
+
+    def test_start_by_ids(
+        self, authenticated_client, images, django_assert_max_num_queries
+    ):
+        """Test that selected images are queued without saving each one"""
+        ids = [image.id for image in images[:2]]
+
+        with django_assert_max_num_queries(11):
+            response = authenticated_client.post(self.url, {"ids": ids}, format="json")
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert sorted(response.data["image_ids"]) == sorted(ids)
+        assert response.data["queued"] == 2
+        jobs = AnalysisJob.objects.filter(kind=AnalysisJob.Kind.ANALYSIS)
+        assert sorted(jobs.values_list("image_id", flat=True)) == sorted(ids)
+        assert {job.batch_id for job in jobs} == {response.data["batch_id"]}
+        started = MedicalImage.objects.filter(analysis_started_at__isnull=False)
+        assert sorted(started.values_list("id", flat=True)) == sorted(ids)
+
+    def test_start_by_filter_skips_analyzed_and_queued(
+        self, authenticated_client, images
+    ):
+        """Test filter selection and that finished or queued images are left out"""
+        MedicalImage.objects.filter(pk=images[0].pk).update(analyzed=True)
+        authenticated_client.post(
+            reverse("images-start-analysis", kwargs={"pk": images[1].pk})
+        )
+
+        response = authenticated_client.post(
+            self.url, {"filter": {"analyzed": False}}, format="json"
+        )
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data["image_ids"] == [images[2].id]
+
+    def test_other_users_images_are_ignored(
+        self, authenticated_client, create_user, create_medical_image, sample_image
+    ):
+        """Test that ids of another user's images select nothing"""
+        other = create_user(email="other@example.com")
+        image = create_medical_image(user=other, image=sample_image)
+
+        response = authenticated_client.post(
+            self.url, {"ids": [image.id]}, format="json"
+        )
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data["queued"] == 0
+        assert not AnalysisJob.objects.filter(kind=AnalysisJob.Kind.ANALYSIS).exists()
+
+    @pytest.mark.parametrize(
+        "payload",
+        [
+            {},
+            {"ids": [1], "filter": {}},
+            {"ids": []},
+            {"filter": {"min_width": 10, "max_width": 5}},
+        ],
+    )
+    def test_invalid_selection(self, authenticated_client, payload):
+        """Test that exactly one valid selection is required"""
+        response = authenticated_client.post(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_batch_priority(self, authenticated_client, images):
+        """Test that batches take any priority class but stat"""
+        ids = [image.id for image in images]
+
+        stat = authenticated_client.post(
+            self.url, {"ids": ids, "priority": "stat"}, format="json"
+        )
+        backfill = authenticated_client.post(
+            self.url, {"ids": ids, "priority": "backfill"}, format="json"
+        )
+
+        assert stat.status_code == status.HTTP_400_BAD_REQUEST
+        assert "priority" in stat.data
+        assert backfill.status_code == status.HTTP_202_ACCEPTED
+        assert set(AnalysisJob.objects.values_list("priority", flat=True)) == {
+            AnalysisJob.Priority.BACKFILL
+        }
+
+    def test_too_many_ids(self, authenticated_client, settings):
+        """Test the MAX_BATCH_IDS bound"""
+        settings.ANALYSIS_QUEUE = {**settings.ANALYSIS_QUEUE, "MAX_BATCH_IDS": 2}
+
+        response = authenticated_client.post(
+            self.url, {"ids": [1, 2, 3]}, format="json"
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_batch_progress(self, authenticated_client, images):
+        """Test polling the aggregated progress of a batch"""
+        response = authenticated_client.post(
+            self.url, {"ids": [image.id for image in images]}, format="json"
+        )
+        batch_id = response.data["batch_id"]
+        assert response.data["status_url"].endswith(
+            f"/api/analysis/batches/{batch_id}/"
+        )
+        jobs = AnalysisJob.objects.filter(batch_id=batch_id).order_by("id")
+        jobs.filter(pk=jobs[0].pk).update(status=AnalysisJob.Status.SUCCEEDED)
+        jobs.filter(pk=jobs[1].pk).update(status=AnalysisJob.Status.RUNNING)
+
+        progress = authenticated_client.get(response.data["status_url"]).data[
+            "progress"
+        ]
+
+        assert progress["total"] == 3
+        assert (progress["pending"], progress["running"]) == (1, 1)
+        assert (progress["succeeded"], progress["failed"]) == (1, 0)
+        assert progress["finished"] == 1
+        assert progress["complete"] is False
+        assert progress["percent"] == 33.3
+
+    def test_other_users_batch(
+        self, authenticated_client, api_client, create_user, images
+    ):
+        """Test that batches are only visible to their owner"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+
+        response = authenticated_client.post(
+            self.url, {"ids": [images[0].id]}, format="json"
+        )
+        other = create_user(email="other@example.com")
+        api_client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(other).access_token}"
+        )
+
+        assert api_client.get(response.data["status_url"]).status_code == 404
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestImageMask:
+    """Test /api/images/{id}/mask/"""
+
+    @pytest.fixture
+    def analyzed_image(self, medical_image):
+        from apps.analysis.inference import InferenceEngine, ThresholdModel
+        from apps.analysis.pipeline import analyze_image
+
+        engine = InferenceEngine(ThresholdModel(), max_batch_size=1, max_wait_ms=1)
+        analyze_image(medical_image, engine=engine)
+        engine.close()
+        return medical_image
+
+    def test_binary_payload(self, authenticated_client, analyzed_image):
+        """Test that the stored MSK1 bytes are returned as is"""
+        from apps.analysis.masks import MASK_CONTENT_TYPE, decode_mask
+
+        response = authenticated_client.get(
+            reverse("images-mask", kwargs={"pk": analyzed_image.id})
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"] == MASK_CONTENT_TYPE
+        np.testing.assert_array_equal(
+            decode_mask(response.content), analyzed_image.analysis.mask
+        )
+
+    def test_png(self, authenticated_client, analyzed_image):
+        """Test the 1-bit PNG rendering"""
+        response = authenticated_client.get(
+            reverse("images-mask", kwargs={"pk": analyzed_image.id}), {"output": "png"}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        mask = Image.open(io.BytesIO(response.content))
+        assert mask.mode == "1"
+        np.testing.assert_array_equal(np.asarray(mask), analyzed_image.analysis.mask)
+
+    def test_not_modified(self, authenticated_client, analyzed_image):
+        """Test revalidation with the ETag"""
+        url = reverse("images-mask", kwargs={"pk": analyzed_image.id})
+        etag = authenticated_client.get(url)["ETag"]
+
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_no_mask(self, authenticated_client, medical_image):
+        """Test an image that has not been analyzed"""
+        response = authenticated_client.get(
+            reverse("images-mask", kwargs={"pk": medical_image.id})
+        )
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_invalid_format(self, authenticated_client, analyzed_image):
+        """Test an unknown output format"""
+        response = authenticated_client.get(
+            reverse("images-mask", kwargs={"pk": analyzed_image.id}), {"output": "json"}
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestDicomImages:
+    """Test DICOM upload, preview and analysis"""
+
+    @pytest.fixture
+    def ct_upload(self, make_dicom):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        pixels = np.linspace(0, 2000, 64 * 48).astype(np.uint16).reshape(64, 48)
+        content = make_dicom(pixels, window=(40, 400), rescale=(1.0, -1024.0))
+        return SimpleUploadedFile("ct.dcm", content, "application/dicom")
+
+    def test_upload_dicom(self, authenticated_client, ct_upload):
+        """Test that DICOM passes validation and gets its dimensions"""
+        url = reverse("images-list")
+        response = authenticated_client.post(
+            url, {"image": ct_upload, "title": "CT"}, format="multipart"
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        image = MedicalImage.objects.get(title="CT")
+        assert (image.width, image.height) == (48, 64)
+
+    def test_upload_unreadable_file(self, authenticated_client, sample_dicom_file):
+        """Test that files with a valid extension but no header are rejected"""
+        url = reverse("images-list")
+        response = authenticated_client.post(
+            url, {"image": sample_dicom_file}, format="multipart"
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_preview(self, authenticated_client, create_medical_image, ct_upload):
+        """Test rendering a windowed, downscaled preview"""
+        image = create_medical_image(image=ct_upload)
+        url = reverse("images-preview", kwargs={"pk": image.id})
+
+        response = authenticated_client.get(url, {"size": 32})
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"] == "image/png"
+        preview = Image.open(io.BytesIO(response.content))
+        assert preview.mode == "L" and max(preview.size) <= 32
+
+        wide = authenticated_client.get(url, {"center": 0, "width": 4000})
+        narrow = authenticated_client.get(url, {"center": 0, "width": 10})
+        assert wide.content != narrow.content
+
+        bad = authenticated_client.get(url, {"center": "soft-tissue"})
+        assert bad.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_analyze_dicom(self, create_medical_image, ct_upload):
+        """Test that the analysis pipeline decodes DICOM pixel data"""
+        from apps.analysis.inference import InferenceEngine, ThresholdModel
+        from apps.analysis.pipeline import analyze_image
+
+        image = create_medical_image(image=ct_upload)
+        engine = InferenceEngine(ThresholdModel(), max_batch_size=1, max_wait_ms=0)
+        try:
+            analysis = analyze_image(image, engine=engine)
+        finally:
+            engine.close()
+
+        assert analysis.results["source_shape"] == [64, 48]
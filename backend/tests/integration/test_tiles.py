@@ -0,0 +1,221 @@
+"""
+Integration tests for Deep Zoom tile pyramids
+"""
+import io
+
+import pytest
+from apps.analysis.models import AnalysisJob
+from apps.analysis.worker import AnalysisWorkerPool
+from apps.images.tiles import build_pyramid, level_size, max_level, tile_grid, tile_path
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+
+
+@pytest.fixture
+def wide_image(create_medical_image):
+    """A 600x300 grayscale image with a gradient"""
+    source = Image.linear_gradient("L").resize((600, 300))
+    buffer = io.BytesIO()
+    source.save(buffer, format="PNG")
+    upload = SimpleUploadedFile("wide.png", buffer.getvalue(), "image/png")
+    return create_medical_image(title="Wide", image=upload)
+
+
+def tile_url(image, level, column, row):
+    return reverse(
+        "images-tile",
+        kwargs={"pk": image.id, "level": level, "column": column, "row": row},
+    )
+
+
+@pytest.mark.unit
+@pytest.mark.images
+def test_pyramid_geometry():
+    """Test level sizes and tile grids follow the Deep Zoom layout"""
+    assert max_level(600, 300) == 10
+    assert level_size(600, 300, 10) == (600, 300)
+    assert level_size(600, 300, 9) == (300, 150)
+    assert level_size(600, 300, 0) == (1, 1)
+    assert tile_grid(600, 300, 10, tile_size=256) == (3, 2)
+    assert tile_grid(600, 300, 8, tile_size=256) == (1, 1)
+
+
+@pytest.mark.images
+@pytest.mark.integration
+class TestTileEndpoint:
+    """Test pyramid generation and tile serving"""
+
+    def test_upload_schedules_pyramid(self, authenticated_client, sample_image):
+        """Test that ingesting an image queues a tile job"""
+        url = reverse("images-list")
+        response = authenticated_client.post(
+            url, {"image": sample_image}, format="multipart"
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        job = AnalysisJob.objects.get(kind=AnalysisJob.Kind.TILES)
+        assert job.status == AnalysisJob.Status.PENDING
+
+    def test_worker_builds_pyramid(self, wide_image):
+        """Test that the worker pool runs tile jobs"""
+        from apps.images.tiles import schedule_pyramid
+
+        schedule_pyramid(wide_image)
+        AnalysisWorkerPool(workers=1).run_once()
+
+        wide_image.refresh_from_db()
+        assert wide_image.pyramid_levels == 11
+
+    def test_serve_tile(self, authenticated_client, wide_image):
+        """Test fetching tiles with cache headers"""
+        written = build_pyramid(wide_image)
+        assert written == sum(
+            cols * rows
+            for cols, rows in (tile_grid(600, 300, level) for level in range(11))
+        )
+
+        response = authenticated_client.get(tile_url(wide_image, 10, 2, 1))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"] == "image/png"
+        assert "immutable" in response["Cache-Control"]
+        tile = Image.open(io.BytesIO(response.content))
+        assert tile.size == (600 - 512, 300 - 256)
+
+    @pytest.mark.slow
+    def test_pyramid_of_png_above_pillow_limit(
+        self, create_medical_image, large_png, settings
+    ):
+        """Test that a PNG past Pillow's default bomb limit is tiled"""
+        settings.IMAGE_TILES = {**settings.IMAGE_TILES, "TILE_SIZE": 4096}
+        upload = SimpleUploadedFile("large.png", large_png, "image/png")
+        image = create_medical_image(title="Large", image=upload)
+
+        written = build_pyramid(image)
+
+        assert image.pyramid_levels == max_level(13400, 13400) + 1
+        assert written == sum(
+            cols * rows
+            for cols, rows in (
+                tile_grid(13400, 13400, level) for level in range(image.pyramid_levels)
+            )
+        )
+        with default_storage.open(tile_path(image.pk, 14, 1, 1)) as fh:
+            assert Image.open(fh).getpixel((0, 0)) == 255
+
+    def test_conditional_request(self, authenticated_client, wide_image):
+        """Test that a matching ETag returns 304 without a body"""
+        build_pyramid(wide_image)
+        url = tile_url(wide_image, 9, 0, 0)
+        etag = authenticated_client.get(url)["ETag"]
+
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b""
+        for header in (f'"other", W/{etag}', "*"):
+            response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=header)
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=f"{etag}-stale")
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_tile_info(self, authenticated_client, wide_image):
+        """Test the pyramid descriptor before and after generation"""
+        url = reverse("images-tile-info", kwargs={"pk": wide_image.id})
+        assert authenticated_client.get(url).data["ready"] is False
+
+        build_pyramid(wide_image)
+        data = authenticated_client.get(url).data
+
+        assert data["ready"] is True
+        assert data["levels"] == 11
+        assert (data["width"], data["height"]) == (600, 300)
+
+    def test_replaced_file_rebuilds_pyramid(
+        self,
+        authenticated_client,
+        wide_image,
+        sample_image,
+        django_capture_on_commit_callbacks,
+    ):
+        """Test that a new file drops the stale tiles and queues new ones"""
+        build_pyramid(wide_image)
+        stale = tile_path(wide_image.pk, 10, 2, 1)
+        url = reverse("images-detail", kwargs={"pk": wide_image.id})
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = authenticated_client.patch(
+                url, {"image": sample_image}, format="multipart"
+            )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["pyramid_levels"] is None
+        assert not default_storage.exists(stale)
+        job = AnalysisJob.objects.get(image=wide_image, kind=AnalysisJob.Kind.TILES)
+        assert job.status == AnalysisJob.Status.PENDING
+
+        AnalysisWorkerPool(workers=1).run_once()
+        wide_image.refresh_from_db()
+        assert wide_image.pyramid_levels == max_level(100, 100) + 1
+
+    def test_metadata_update_keeps_pyramid(
+        self, authenticated_client, wide_image, django_capture_on_commit_callbacks
+    ):
+        build_pyramid(wide_image)
+        url = reverse("images-detail", kwargs={"pk": wide_image.id})
+
+        with django_capture_on_commit_callbacks(execute=True):
+            authenticated_client.patch(url, {"title": "Renamed"}, format="json")
+
+        assert default_storage.exists(tile_path(wide_image.pk, 10, 2, 1))
+        assert not AnalysisJob.objects.filter(kind=AnalysisJob.Kind.TILES).exists()
+
+    def test_pyramid_levels_read_only(self, authenticated_client, wide_image):
+        """Test that clients cannot point the tile endpoint at other levels"""
+        build_pyramid(wide_image)
+        url = reverse("images-detail", kwargs={"pk": wide_image.id})
+
+        response = authenticated_client.patch(url, {"pyramid_levels": 7}, format="json")
+
+        assert response.status_code == status.HTTP_200_OK
+        wide_image.refresh_from_db()
+        assert wide_image.pyramid_levels == 11
+
+    def test_missing_tiles(self, authenticated_client, wide_image):
+        """Test 404s for unbuilt pyramids and out-of-range tiles"""
+        url = tile_url(wide_image, 10, 0, 0)
+        assert authenticated_client.get(url).status_code == 404
+
+        build_pyramid(wide_image)
+        url = tile_url(wide_image, 10, 5, 5)
+        assert authenticated_client.get(url).status_code == 404
+
+    def test_delete_removes_tiles(
+        self, authenticated_client, wide_image, django_capture_on_commit_callbacks
+    ):
+        """Test that deleting an image removes its stored tiles"""
+        build_pyramid(wide_image)
+        name = tile_path(wide_image.pk, 0, 0, 0)
+        assert default_storage.exists(name)
+
+        url = reverse("images-detail", kwargs={"pk": wide_image.id})
+        with django_capture_on_commit_callbacks(execute=True):
+            response = authenticated_client.delete(url)
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert not default_storage.exists(name)
+
+    def test_other_user_tile(
+        self, authenticated_client, create_user, create_medical_image, sample_image
+    ):
+        """Test that tiles are only served to the owner"""
+        other = create_user(email="other@example.com")
+        image = create_medical_image(user=other, image=sample_image)
+        build_pyramid(image)
+
+        response = authenticated_client.get(tile_url(image, 0, 0, 0))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,300 @@
+"""
+Unit tests for the analysis job queue and worker pool
+"""
+import time
+from datetime import timedelta
+
+import pytest
+from apps.analysis.jobs import (
+    complete_job,
+    enqueue_analysis,
+    enqueue_batch,
+    fail_job,
+    lease_jobs,
+    queue_wait_report,
+)
+from apps.analysis.models import Analysis, AnalysisJob
+from apps.analysis.worker import AnalysisWorkerPool
+from apps.images.models import MedicalImage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.utils import timezone
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestJobLeasing:
+    """Test leasing, completion and retries"""
+
+    def test_lease_claims_job_once(self, medical_image):
+        """Test that a leased job is hidden from other workers"""
+        job = enqueue_analysis(medical_image)
+
+        leased = lease_jobs("worker-a")
+        assert [j.id for j in leased] == [job.id]
+        assert leased[0].status == AnalysisJob.Status.RUNNING
+        assert leased[0].attempts == 1
+
+        assert lease_jobs("worker-b") == []
+
+    def test_expired_lease_is_visible_again(self, medical_image):
+        """Test that an expired lease can be claimed by another worker"""
+        job = enqueue_analysis(medical_image)
+        lease_jobs("worker-a")
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            leased_until=timezone.now() - timedelta(seconds=1)
+        )
+
+        leased = lease_jobs("worker-b")
+
+        assert [j.id for j in leased] == [job.id]
+        assert leased[0].leased_by == "worker-b"
+        assert leased[0].attempts == 2
+
+    def test_complete_after_lost_lease_is_rejected(self, medical_image):
+        """Test that a worker cannot complete a job it no longer owns"""
+        enqueue_analysis(medical_image)
+        (stale,) = lease_jobs("worker-a")
+        AnalysisJob.objects.filter(pk=stale.pk).update(
+            leased_until=timezone.now() - timedelta(seconds=1)
+        )
+        (current,) = lease_jobs("worker-b")
+
+        assert complete_job(stale) is False
+        assert complete_job(current) is True
+
+    def test_failed_job_is_retried_with_backoff(self, medical_image):
+        """Test that a failure reschedules the job while attempts remain"""
+        enqueue_analysis(medical_image, max_attempts=2)
+        (job,) = lease_jobs("worker-a")
+
+        fail_job(job, RuntimeError("boom"))
+        job.refresh_from_db()
+
+        assert job.status == AnalysisJob.Status.PENDING
+        assert job.available_at > timezone.now()
+        assert job.last_error == "boom"
+
+    def test_job_fails_after_max_attempts(self, medical_image):
+        """Test that the final failed attempt marks the job failed"""
+        enqueue_analysis(medical_image, max_attempts=1)
+        (job,) = lease_jobs("worker-a")
+
+        fail_job(job, RuntimeError("boom"))
+        job.refresh_from_db()
+
+        assert job.status == AnalysisJob.Status.FAILED
+        assert job.finished_at is not None
+        assert lease_jobs("worker-a") == []
+
+    def test_expired_final_lease_is_failed(self, medical_image):
+        """Test that a crashed final attempt does not stay running forever"""
+        job = enqueue_analysis(medical_image, max_attempts=1)
+        lease_jobs("worker-a")
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            leased_until=timezone.now() - timedelta(seconds=1)
+        )
+
+        assert lease_jobs("worker-b") == []
+        job.refresh_from_db()
+        assert job.status == AnalysisJob.Status.FAILED
+
+    def test_batch_leaves_out_jobs_queued_concurrently(
+        self, create_medical_image, user, sample_image, monkeypatch
+    ):
+        """Test that a job inserted by a racing request is not the batch's"""
+        content = sample_image.read()
+        images = [
+            create_medical_image(
+                user=user, image=SimpleUploadedFile("scan.png", content, "image/png")
+            )
+            for _ in range(2)
+        ]
+        bulk_create = AnalysisJob.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # Another request queues the first image between the check for
+            # active jobs and the INSERT
+            AnalysisJob.objects.create(image=images[0])
+            return bulk_create(objs, **kwargs)
+
+        monkeypatch.setattr(AnalysisJob.objects, "bulk_create", racing_bulk_create)
+        batch, queued = enqueue_batch(user, MedicalImage.objects.all())
+
+        assert queued == [images[1].pk]
+        assert batch.progress()["total"] == 1
+        started = MedicalImage.objects.filter(analysis_started_at__isnull=False)
+        assert list(started.values_list("pk", flat=True)) == [images[1].pk]
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestFairScheduling:
+    """Test priority classes, per-user fair share and concurrency caps"""
+
+    @pytest.fixture
+    def queue(self, create_medical_image, sample_image):
+        """Factory queueing ``count`` analysis jobs of ``priority`` for a user"""
+        content = sample_image.read()
+
+        def enqueue(user, count=1, priority=AnalysisJob.Priority.ROUTINE):
+            return [
+                enqueue_analysis(
+                    create_medical_image(
+                        user=user,
+                        image=SimpleUploadedFile("scan.png", content, "image/png"),
+                    ),
+                    priority=priority,
+                )
+                for _ in range(count)
+            ]
+
+        return enqueue
+
+    @pytest.fixture
+    def researcher(self, create_user):
+        return create_user(email="researcher@example.com")
+
+    def owners(self, count):
+        """Owners of the next ``count`` jobs leased one at a time"""
+        return [lease_jobs(f"worker-{i}")[0].image.user for i in range(count)]
+
+    def test_priority_classes_in_order(self, queue, user):
+        """Test that more pressing classes are leased first, whatever their age"""
+        for priority in reversed(AnalysisJob.Priority):
+            queue(user, priority=priority)
+
+        leased = [lease_jobs(f"worker-{i}")[0].priority for i in range(4)]
+
+        assert leased == list(AnalysisJob.Priority)
+
+    def test_bulk_backlog_shares_workers(self, queue, user, researcher):
+        """Test that a later user's job runs next to an earlier bulk backlog"""
+        queue(researcher, 5)
+        (clinician_job,) = queue(user)
+
+        leased = lease_jobs("worker-a", limit=3)
+
+        assert clinician_job.id in [job.id for job in leased]
+        assert [job.image.user for job in leased].count(researcher) == 2
+
+    def test_user_weights(self, queue, user, researcher, settings):
+        """Test that a heavier user runs proportionally more jobs"""
+        settings.ANALYSIS_QUEUE = {
+            **settings.ANALYSIS_QUEUE,
+            "USER_WEIGHTS": {researcher.pk: 3.0},
+        }
+        queue(researcher, 5)
+        queue(user, 5)
+
+        assert self.owners(4) == [researcher, user, researcher, researcher]
+
+    def test_user_concurrency_cap(self, queue, user, researcher, settings):
+        """Test that a capped user waits, except for stat jobs"""
+        settings.ANALYSIS_QUEUE = {**settings.ANALYSIS_QUEUE, "USER_CONCURRENCY": 2}
+        queue(researcher, 4)
+
+        assert self.owners(2) == [researcher, researcher]
+        assert lease_jobs("worker-c") == []
+
+        (stat,) = queue(researcher, priority=AnalysisJob.Priority.STAT)
+        (routine,) = queue(user)
+        assert [job.id for job in lease_jobs("worker-d", limit=3)] == [
+            stat.id,
+            routine.id,
+        ]
+
+    def test_requeue_raises_priority(self, queue, user):
+        """Test that asking again with a more pressing class moves the job up"""
+        (job,) = queue(user, priority=AnalysisJob.Priority.BACKFILL)
+
+        again = enqueue_analysis(job.image, priority=AnalysisJob.Priority.URGENT)
+        lower = enqueue_analysis(job.image, priority=AnalysisJob.Priority.ROUTINE)
+
+        assert again.id == lower.id == job.id
+        job.refresh_from_db()
+        assert job.priority == AnalysisJob.Priority.URGENT
+
+    def test_queue_wait_report(self, queue, user):
+        """Test waits of started jobs and backlog per class"""
+        queue(user, 2, priority=AnalysisJob.Priority.URGENT)
+        queue(user, priority=AnalysisJob.Priority.BACKFILL)
+        (leased,) = lease_jobs("worker-a")
+        fail_job(leased, RuntimeError("boom"))
+        lease_jobs("worker-a")
+
+        report = queue_wait_report()
+
+        assert list(report) == ["stat", "urgent", "routine", "backfill"]
+        assert report["urgent"]["started"] == 2
+        assert report["urgent"]["pending"] == 1
+        assert 0 <= report["urgent"]["p50_wait"] <= report["urgent"]["max_wait"]
+        leased.refresh_from_db()
+        assert leased.queue_wait <= report["urgent"]["max_wait"]
+        assert report["backfill"]["pending"] == 1
+        assert report["backfill"]["oldest_pending"] >= 0
+        assert report["stat"]["started"] == 0
+        assert report["stat"]["mean_wait"] is None
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestWorkerPool:
+    """Test job processing by the worker pool"""
+
+    def test_run_once_writes_analysis(self, medical_image):
+        """Test that processing a job stores an Analysis row"""
+        job = enqueue_analysis(medical_image)
+
+        processed = AnalysisWorkerPool(workers=1).run_once()
+
+        assert processed == 1
+        job.refresh_from_db()
+        medical_image.refresh_from_db()
+        assert job.status == AnalysisJob.Status.SUCCEEDED
+        assert medical_image.analyzed is True
+        assert medical_image.analysis_completed_at is not None
+        analysis = Analysis.objects.get(image=medical_image)
+        assert analysis.model_version
+        assert analysis.processing_time is not None
+
+    def test_handler_error_is_recorded(self, medical_image):
+        """Test that handler exceptions become failed attempts"""
+
+        def broken(image):
+            raise ValueError("cannot decode")
+
+        job = enqueue_analysis(medical_image, max_attempts=1)
+
+        AnalysisWorkerPool(workers=1, handler=broken).run_once()
+
+        job.refresh_from_db()
+        assert job.status == AnalysisJob.Status.FAILED
+        assert "cannot decode" in job.last_error
+        assert not Analysis.objects.filter(image=medical_image).exists()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_lease_is_renewed_while_job_runs(self, medical_image):
+        """Test that a job outlasting the visibility timeout stays leased"""
+        stolen = []
+
+        def slow(image):
+            time.sleep(1.5)
+            stolen.extend(lease_jobs("worker-b"))
+
+        job = enqueue_analysis(medical_image)
+
+        AnalysisWorkerPool(workers=1, visibility_timeout=1, handler=slow).run_once()
+
+        job.refresh_from_db()
+        assert stolen == []
+        assert job.status == AnalysisJob.Status.SUCCEEDED
+        assert job.attempts == 1
+
+    def test_management_command_once(self, medical_image):
+        """Test draining the queue through the management command"""
+        enqueue_analysis(medical_image)
+
+        call_command("run_analysis_workers", "--once")
+
+        assert Analysis.objects.filter(image=medical_image).exists()
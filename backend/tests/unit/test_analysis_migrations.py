@@ -0,0 +1,56 @@
+"""
+Unit tests for analysis data migrations
+"""
+import pytest
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+BEFORE = [("analysis", "0007_analysisjob_model_version")]
+AFTER = [("analysis", "0008_analysisjob_active_unique")]
+
+
+@pytest.fixture
+def migrate():
+    """Migrate the analysis app to a target, and back to the latest after"""
+
+    def run(targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    yield run
+    executor = MigrationExecutor(connection)
+    executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+@pytest.mark.django_db(transaction=True)
+def test_active_unique_fails_duplicate_jobs(migrate):
+    """Test that duplicate active jobs are resolved before the constraint"""
+    apps = migrate(BEFORE)
+    User = apps.get_model("authentication", "User")
+    MedicalImage = apps.get_model("images", "MedicalImage")
+    AnalysisJob = apps.get_model("analysis", "AnalysisJob")
+    user = User.objects.create(email="migrate@example.com")
+    image = MedicalImage.objects.create(user=user, title="Scan", image="scan.png")
+    pending = [AnalysisJob.objects.create(image=image) for _ in range(2)]
+    running = AnalysisJob.objects.create(image=image, status="running")
+    other_kind = AnalysisJob.objects.create(image=image, kind="tiles")
+    finished = AnalysisJob.objects.create(image=image, status="succeeded")
+
+    apps = migrate(AFTER)
+
+    AnalysisJob = apps.get_model("analysis", "AnalysisJob")
+    statuses = dict(AnalysisJob.objects.values_list("pk", "status"))
+    assert statuses == {
+        pending[0].pk: "failed",
+        pending[1].pk: "failed",
+        running.pk: "running",
+        other_kind.pk: "pending",
+        finished.pk: "succeeded",
+    }
+    failed = AnalysisJob.objects.get(pk=pending[0].pk)
+    assert failed.last_error == f"Duplicate of job {running.pk}"
+    assert failed.finished_at is not None
@@ -0,0 +1,154 @@
+"""
+Unit tests for content-addressed image storage
+"""
+import hashlib
+import io
+
+import pytest
+from apps.analysis.inference import InferenceEngine, ThresholdModel
+from apps.analysis.pipeline import analyze_image
+from apps.images.blobs import blob_path
+from apps.images.models import ImageBlob, MedicalImage
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+
+
+def png_bytes(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def upload(content, name="scan.png"):
+    return SimpleUploadedFile(name, content, content_type="image/png")
+
+
+@pytest.mark.unit
+@pytest.mark.images
+class TestImageBlobs:
+    """Test deduplication and reference counting"""
+
+    def test_duplicates_share_a_blob(self, create_medical_image):
+        """Test that identical bytes are stored once"""
+        content = png_bytes("red")
+        first = create_medical_image(image=upload(content, "a.png"))
+        second = create_medical_image(image=upload(content, "b.PNG"))
+
+        digest = hashlib.sha256(content).hexdigest()
+        blob = ImageBlob.objects.get(sha256=digest)
+        assert first.blob == second.blob == blob
+        assert blob.ref_count == 2
+        assert first.image.name == second.image.name == blob_path(digest, "a.png")
+        assert (second.width, second.height, second.file_size) == (
+            40,
+            30,
+            len(content),
+        )
+
+    def test_distinct_bytes(self, create_medical_image):
+        """Test that different content gets separate blobs"""
+        first = create_medical_image(image=upload(png_bytes("red")))
+        second = create_medical_image(image=upload(png_bytes("blue")))
+
+        assert first.blob != second.blob
+
+    def test_delete_releases_reference(
+        self, create_medical_image, django_capture_on_commit_callbacks
+    ):
+        """Test that the file is removed with the last reference"""
+        content = png_bytes("green")
+        first = create_medical_image(image=upload(content))
+        second = create_medical_image(image=upload(content))
+        name = first.image.name
+
+        first.delete()
+        assert ImageBlob.objects.get(pk=second.blob_id).ref_count == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            MedicalImage.objects.filter(pk=second.pk).delete()
+
+        assert not ImageBlob.objects.filter(pk=second.blob_id).exists()
+        assert not default_storage.exists(name)
+
+    def test_replacing_file_moves_reference(
+        self, create_medical_image, django_capture_on_commit_callbacks
+    ):
+        """Test that saving a new file releases the old blob"""
+        image = create_medical_image(image=upload(png_bytes("red")))
+        old_blob = image.blob_id
+
+        with django_capture_on_commit_callbacks(execute=True):
+            image.image = upload(png_bytes("blue"))
+            image.save()
+
+        assert image.blob_id != old_blob
+        assert not ImageBlob.objects.filter(pk=old_blob).exists()
+
+    def test_upload_during_release_keeps_the_file(
+        self, create_medical_image, django_capture_on_commit_callbacks
+    ):
+        """Test that bytes uploaded again before the release commits survive"""
+        content = png_bytes("orange")
+        first = create_medical_image(image=upload(content))
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            first.delete()
+        second = create_medical_image(image=upload(content))
+        for callback in callbacks:
+            callback()
+
+        blob = ImageBlob.objects.get(pk=second.blob_id)
+        assert blob.pk == first.blob_id
+        assert blob.ref_count == 1
+        assert default_storage.exists(blob.file.name)
+
+
+@pytest.mark.unit
+@pytest.mark.images
+@pytest.mark.parametrize("max_memory_size", [2_621_440, 0])
+def test_upload_is_hashed_while_streaming(
+    authenticated_client, settings, monkeypatch, max_memory_size
+):
+    """Test that multipart uploads are hashed by the upload handlers"""
+    from apps.images import blobs
+
+    settings.FILE_UPLOAD_MAX_MEMORY_SIZE = max_memory_size
+    monkeypatch.setattr(
+        blobs, "hash_file", lambda fh: pytest.fail("upload was hashed twice")
+    )
+    content = png_bytes("purple")
+
+    response = authenticated_client.post(
+        reverse("images-list"), {"image": upload(content)}, format="multipart"
+    )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert ImageBlob.objects.get().sha256 == hashlib.sha256(content).hexdigest()
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+def test_duplicate_reuses_analysis(create_medical_image):
+    """Test that identical bytes analyzed by the same model skip inference"""
+    content = png_bytes("white")
+    first = create_medical_image(image=upload(content))
+    second = create_medical_image(image=upload(content))
+    engine = InferenceEngine(ThresholdModel(), max_batch_size=1, max_wait_ms=0)
+    try:
+        original = analyze_image(first, engine=engine)
+        engine.predict = lambda tensor: pytest.fail("inference ran again")
+        reused = analyze_image(second, engine=engine)
+    finally:
+        engine.close()
+
+    assert reused.pk != original.pk
+    assert reused.results["reused_from"] == first.pk
+    assert reused.results["foreground_fraction"] == (
+        original.results["foreground_fraction"]
+    )
+    assert reused.model_version == original.model_version
+    second.refresh_from_db()
+    assert second.analyzed
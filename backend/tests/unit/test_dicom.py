@@ -0,0 +1,128 @@
+"""
+Unit tests for DICOM pixel mapping and window/level rendering
+"""
+import io
+
+import numpy as np
+import pytest
+from apps.images.dicom import (
+    DicomError,
+    map_pixels,
+    read_dicom_header,
+    render,
+    window_level,
+)
+
+
+@pytest.fixture
+def dicom_path(tmp_path, make_dicom):
+    """Write DICOM bytes to disk and return the path"""
+
+    def write(pixels, **kwargs):
+        path = tmp_path / "scan.dcm"
+        path.write_bytes(make_dicom(pixels, **kwargs))
+        with open(path, "rb") as fh:
+            return path, read_dicom_header(fh)
+
+    return write
+
+
+@pytest.mark.unit
+@pytest.mark.images
+class TestMapPixels:
+    """Test memory-mapping pixel data in place"""
+
+    @pytest.mark.parametrize("explicit", [True, False])
+    @pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.uint16])
+    def test_values_match(self, dicom_path, explicit, dtype):
+        """Test that mapped pixels equal the encoded array"""
+        source = (np.arange(24 * 16) % 200).astype(dtype).reshape(24, 16)
+        path, header = dicom_path(source, explicit=explicit)
+
+        pixels = map_pixels(path, header)
+
+        assert isinstance(pixels, np.memmap)
+        assert pixels.shape == (1, 24, 16)
+        np.testing.assert_array_equal(pixels[0], source)
+
+    def test_compressed_is_rejected(self, dicom_path):
+        """Test that encapsulated transfer syntaxes are refused"""
+        path, header = dicom_path(np.zeros((4, 4), dtype=np.uint16))
+        header.transfer_syntax = "1.2.840.10008.1.2.4.50"
+
+        with pytest.raises(DicomError):
+            map_pixels(path, header)
+
+    def test_short_pixel_data(self, dicom_path):
+        """Test that truncated pixel data is refused"""
+        path, header = dicom_path(np.zeros((4, 4), dtype=np.uint16))
+        header.rows = 8
+
+        with pytest.raises(DicomError):
+            map_pixels(path, header)
+
+
+@pytest.mark.unit
+@pytest.mark.images
+class TestWindowLevel:
+    """Test VOI LUT rendering"""
+
+    def test_linear_window(self):
+        """Test clipping below and above the window and the midpoint"""
+        pixels = np.array([[-1000, 40, 1000]], dtype=np.int16)
+
+        out = window_level(pixels, center=40, width=400)
+
+        assert out.dtype == np.uint8
+        assert out[0, 0] == 0 and out[0, 2] == 255
+        assert 126 <= out[0, 1] <= 128
+
+    def test_rescale_and_invert(self):
+        """Test that rescale applies before windowing and MONOCHROME1 inverts"""
+        pixels = np.array([[0, 2000]], dtype=np.uint16)
+
+        out = window_level(
+            pixels, center=0, width=2, slope=1.0, intercept=-1000.0, invert=True
+        )
+
+        np.testing.assert_array_equal(out, [[255, 0]])
+
+    def test_render_uses_header_window(self, dicom_path):
+        """Test rendering with the stored window and rescale"""
+        source = np.array([[0, 1000], [1040, 3000]], dtype=np.uint16)
+        path, header = dicom_path(source, window=(40, 80), rescale=(1.0, -1024.0))
+
+        out = render(header, map_pixels(path, header))
+
+        assert out.tolist() == [[0, 0], [51, 255]]
+
+    def test_render_downscales_by_striding(self, dicom_path):
+        """Test that previews sample rows in blocks without a full copy"""
+        source = np.tile(np.arange(300, dtype=np.uint16), (200, 1))
+        path, header = dicom_path(source)
+
+        out = render(header, map_pixels(path, header), max_size=100, block_rows=7)
+
+        assert out.shape == (67, 100)
+        assert out[0, 0] == 0 and out[0, -1] == 255
+        assert (out == out[0]).all()
+
+
+@pytest.mark.unit
+@pytest.mark.images
+def test_header_is_not_pixel_bound(make_dicom):
+    """Test that header parsing stops at the pixel data element"""
+    content = make_dicom(np.zeros((512, 512), dtype=np.int16))
+
+    class CountingFile(io.BytesIO):
+        consumed = 0
+
+        def read(self, size=-1):
+            data = super().read(size)
+            CountingFile.consumed += len(data)
+            return data
+
+    header = read_dicom_header(CountingFile(content))
+
+    assert header.pixel_data_length == 512 * 512 * 2
+    assert CountingFile.consumed < 1024
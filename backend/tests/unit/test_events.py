@@ -0,0 +1,148 @@
+"""
+Unit tests for analysis progress events
+"""
+import asyncio
+import socket
+import threading
+
+import pytest
+from apps.analysis import events
+from apps.analysis.events import LocalBroker, UDPBroker, format_event
+from apps.analysis.jobs import enqueue_analysis
+from apps.analysis.worker import AnalysisWorkerPool
+
+
+class RecordingBroker(LocalBroker):
+    """Local broker that also keeps every published event"""
+
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, user_id, event):
+        self.published.append((user_id, event))
+        super().publish(user_id, event)
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = RecordingBroker()
+    monkeypatch.setattr(events, "_broker", broker)
+    return broker
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestBrokers:
+    """Test fan-out of events to subscriptions"""
+
+    def test_events_reach_only_their_user(self):
+        """Test delivery from another thread to the subscribed user"""
+        broker = LocalBroker()
+
+        async def scenario():
+            with broker.subscribe(1) as mine, broker.subscribe(2) as theirs:
+                publisher = threading.Thread(
+                    target=broker.publish, args=(1, {"type": "started"})
+                )
+                publisher.start()
+                publisher.join()
+                return await mine.get(timeout=1), await theirs.get(timeout=0.05)
+
+        assert asyncio.run(scenario()) == ({"type": "started"}, None)
+        assert broker.subscribers(1) == 0
+
+    def test_slow_subscriber_drops_newest(self):
+        """Test that a full queue drops events instead of growing"""
+        broker = LocalBroker(queue_size=2)
+
+        async def scenario():
+            with broker.subscribe(1) as subscription:
+                for index in range(5):
+                    broker.publish(1, {"type": "progress", "done": index})
+                await asyncio.sleep(0)
+                received = [await subscription.get(timeout=0.05) for _ in range(3)]
+                return received, subscription.dropped
+
+        received, dropped = asyncio.run(scenario())
+        assert [event and event["done"] for event in received] == [0, 1, None]
+        assert dropped == 3
+
+    def test_udp_relay(self):
+        """Test that datagrams from a publisher reach the listening process"""
+        address = f"127.0.0.1:{free_port()}"
+        listener, publisher = UDPBroker(address), UDPBroker(address)
+
+        async def scenario():
+            with listener.subscribe(7) as subscription:
+                publisher.publish(7, {"type": "completed", "image_id": 3})
+                return await subscription.get(timeout=2)
+
+        try:
+            assert asyncio.run(scenario()) == {"type": "completed", "image_id": 3}
+        finally:
+            listener.close()
+            publisher.close()
+
+    def test_format_event(self):
+        """Test the server-sent events encoding"""
+        message = format_event({"type": "progress", "done": 1})
+
+        assert message == 'event: progress\ndata: {"type":"progress","done":1}\n\n'
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestWorkerEvents:
+    """Test events published while jobs are processed"""
+
+    def test_successful_job(self, broker, medical_image, user):
+        """Test started, progress and completed events for the owner"""
+        job = enqueue_analysis(medical_image)
+
+        AnalysisWorkerPool(workers=1).run_once()
+
+        assert {user_id for user_id, _ in broker.published} == {user.pk}
+        types = [event["type"] for _, event in broker.published]
+        assert types[0] == "started"
+        assert "progress" in types
+        assert types[-1] == "completed"
+        completed = broker.published[-1][1]
+        assert completed["job_id"] == job.pk
+        assert completed["image_id"] == medical_image.pk
+        assert completed["analysis"]["model_version"]
+
+    def test_failed_job(self, broker, medical_image):
+        """Test that a failed attempt says whether it will be retried"""
+
+        def broken(image):
+            raise ValueError("cannot decode")
+
+        enqueue_analysis(medical_image, max_attempts=2)
+
+        AnalysisWorkerPool(workers=1, handler=broken).run_once()
+
+        failed = broker.published[-1][1]
+        assert failed["type"] == "failed"
+        assert failed["retrying"] is True
+        assert "cannot decode" in failed["error"]
+
+    def test_broken_channel_does_not_fail_jobs(self, monkeypatch, medical_image):
+        """Test that publishing errors are swallowed"""
+
+        class BrokenBroker(LocalBroker):
+            def publish(self, user_id, event):
+                raise OSError("channel down")
+
+        monkeypatch.setattr(events, "_broker", BrokenBroker())
+        enqueue_analysis(medical_image)
+
+        assert AnalysisWorkerPool(workers=1).run_once() == 1
+        medical_image.refresh_from_db()
+        assert medical_image.analyzed is True
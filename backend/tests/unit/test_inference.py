@@ -0,0 +1,98 @@
+"""
+Unit tests for the micro-batching inference engine
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from apps.analysis.inference import InferenceEngine, ThresholdModel, preprocess
+from apps.analysis.models import Analysis
+from apps.analysis.pipeline import analyze_image
+
+
+class RecordingModel:
+    """Model stub that records the size of each batch it receives"""
+
+    version = "recording-v1"
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, batch):
+        self.batch_sizes.append(len(batch))
+        return batch
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestInferenceEngine:
+    """Test request batching"""
+
+    def test_concurrent_requests_share_a_batch(self):
+        """Test that requests arriving together run in one forward pass"""
+        model = RecordingModel()
+        engine = InferenceEngine(model, max_batch_size=4, max_wait_ms=2000)
+        tensors = [np.full((8, 8, 1), 0.9, dtype=np.float32) for _ in range(4)]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            predictions = list(pool.map(engine.predict, tensors))
+        engine.close()
+
+        assert model.batch_sizes == [4]
+        assert all(p.batch_size == 4 for p in predictions)
+        assert all(p.mask.all() for p in predictions)
+        assert all(p.model_version == "recording-v1" for p in predictions)
+
+    def test_partial_batch_runs_after_max_wait(self):
+        """Test that a lone request is not held beyond max_wait_ms"""
+        model = RecordingModel()
+        engine = InferenceEngine(model, max_batch_size=8, max_wait_ms=5)
+
+        prediction = engine.predict(np.zeros((8, 8, 1), dtype=np.float32))
+        engine.close()
+
+        assert model.batch_sizes == [1]
+        assert not prediction.mask.any()
+
+    def test_model_error_fails_every_request(self):
+        """Test that a failed forward pass is raised to each caller"""
+
+        class BrokenModel:
+            version = "broken"
+
+            def predict(self, batch):
+                raise RuntimeError("out of memory")
+
+        engine = InferenceEngine(BrokenModel(), max_batch_size=2, max_wait_ms=5)
+
+        with pytest.raises(RuntimeError, match="out of memory"):
+            engine.predict(np.zeros((8, 8, 1), dtype=np.float32))
+        engine.close()
+
+    def test_threshold_model_separates_foreground(self):
+        """Test the fallback model on a two-level image"""
+        pixels = np.zeros((16, 16), dtype=np.uint8)
+        pixels[:, 8:] = 200
+        batch = preprocess(pixels, 16)[None]
+
+        probs = ThresholdModel().predict(batch)
+
+        assert probs.shape == (1, 16, 16, 1)
+        assert probs[0, :, 8:].all()
+        assert not probs[0, :, :8].any()
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+def test_analyze_image_records_batch_details(medical_image):
+    """Test that the pipeline stores timing and model version per image"""
+    model = RecordingModel()
+    engine = InferenceEngine(model, max_batch_size=1, max_wait_ms=1)
+
+    analysis = analyze_image(medical_image, engine=engine)
+    engine.close()
+
+    assert Analysis.objects.get(pk=analysis.pk).model_version == "recording-v1"
+    assert analysis.processing_time > 0
+    assert analysis.results["batch_size"] == 1
+    assert analysis.results["source_shape"] == [100, 100]
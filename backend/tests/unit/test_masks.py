@@ -0,0 +1,125 @@
+"""
+Unit tests for MSK1 mask storage
+"""
+import numpy as np
+import pytest
+from apps.analysis.inference import InferenceEngine, ThresholdModel
+from apps.analysis.masks import (
+    MaskError,
+    decode_mask,
+    encode_mask,
+    mask_name,
+    read_mask_header,
+)
+from apps.analysis.models import Analysis
+from apps.analysis.pipeline import analyze_image, save_analysis
+from django.core.files.storage import default_storage
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestMaskFormat:
+    """Test encoding and decoding of MSK1 payloads"""
+
+    @pytest.mark.parametrize("shape", [(1, 1), (7, 13), (256, 256)])
+    def test_round_trip(self, shape):
+        """Test that any mask size survives encoding exactly"""
+        mask = np.random.default_rng(0).random(shape) > 0.5
+
+        data = encode_mask(mask)
+
+        assert read_mask_header(data) == shape
+        decoded = decode_mask(data)
+        assert decoded.dtype == bool
+        np.testing.assert_array_equal(decoded, mask)
+
+    def test_compact(self):
+        """Test that a typical blob-shaped mask is far smaller than JSON"""
+        yy, xx = np.mgrid[:512, :512]
+        mask = (yy - 256) ** 2 + (xx - 200) ** 2 < 120**2
+
+        data = encode_mask(mask)
+
+        assert len(data) < 2048
+        assert len(data) * 100 < len(str(mask.astype(int).tolist()))
+
+    @pytest.mark.parametrize(
+        "data",
+        [b"MSK1", b"NOPE" + bytes(12), encode_mask(np.ones((4, 4)))[:-3]],
+    )
+    def test_invalid_data(self, data):
+        """Test truncated, foreign and corrupt payloads"""
+        with pytest.raises(MaskError):
+            decode_mask(data)
+
+    def test_rejects_non_2d(self):
+        """Test that only single masks are encoded"""
+        with pytest.raises(MaskError):
+            encode_mask(np.zeros((2, 4, 4)))
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestStoredMasks:
+    """Test masks written by the analysis pipeline"""
+
+    @pytest.fixture
+    def engine(self):
+        engine = InferenceEngine(ThresholdModel(), max_batch_size=1, max_wait_ms=1)
+        yield engine
+        engine.close()
+
+    def test_pipeline_stores_mask_reference(self, medical_image, engine):
+        """Test that results hold a small reference and the mask decodes lazily"""
+        analysis = analyze_image(medical_image, engine=engine)
+
+        reference = Analysis.objects.get(pk=analysis.pk).results["mask"]
+        assert reference["name"] == mask_name(medical_image, "otsu-baseline")
+        assert reference["name"].startswith(f"blobs/{medical_image.blob.sha256[:2]}/")
+        assert default_storage.exists(reference["name"])
+
+        stored = Analysis.objects.get(pk=analysis.pk)
+        assert "mask" not in stored.__dict__
+        assert stored.mask.shape == tuple(reference["shape"])
+        assert stored.mask.mean() == pytest.approx(
+            stored.results["foreground_fraction"]
+        )
+
+    def test_mask_deleted_with_last_analysis(
+        self,
+        medical_image,
+        create_medical_image,
+        sample_image,
+        engine,
+        django_capture_on_commit_callbacks,
+    ):
+        """Test that a shared mask outlives all but the last analysis"""
+        twin = create_medical_image(user=medical_image.user, image=sample_image)
+        analyze_image(medical_image, engine=engine)
+        analyze_image(twin, engine=engine)
+        name = Analysis.objects.get(image=twin).results["mask"]["name"]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Analysis.objects.get(image=medical_image).delete()
+        assert default_storage.exists(name)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Analysis.objects.get(image=twin).delete()
+        assert not default_storage.exists(name)
+
+    def test_replaced_mask_is_released(
+        self, medical_image, engine, django_capture_on_commit_callbacks
+    ):
+        """Test that re-analysis by another model drops the old mask"""
+        analysis = analyze_image(medical_image, engine=engine)
+        old = analysis.results["mask"]["name"]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            save_analysis(
+                medical_image,
+                {"mask": {"name": "blobs/other.msk"}},
+                processing_time=0.0,
+                model_version="other",
+            )
+
+        assert not default_storage.exists(old)
@@ -0,0 +1,125 @@
+"""
+Unit tests for bit-packed segmentation metrics
+"""
+import numpy as np
+import pytest
+from apps.analysis import metrics as metrics_module
+from apps.analysis import pipeline
+from apps.analysis.inference import InferenceEngine, ThresholdModel
+from apps.analysis.metrics import pack_masks, popcount, segmentation_metrics
+from apps.analysis.models import Analysis
+from apps.analysis.pipeline import analyze_image
+from django.core.management import call_command
+from PIL import Image
+
+
+def naive_metrics(predicted, reference):
+    """Reference implementation over boolean arrays"""
+    tp = (predicted & reference).sum()
+    fp = (predicted & ~reference).sum()
+    fn = (~predicted & reference).sum()
+    if tp + fp + fn == 0:
+        return 1.0, 1.0, 1.0, 1.0
+    dice = 2 * tp / (2 * tp + fp + fn)
+    iou = tp / (tp + fp + fn)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return dice, iou, precision, recall
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestSegmentationMetrics:
+    """Test the vectorized metrics against per-pair boolean arithmetic"""
+
+    def test_matches_naive(self):
+        """Test random stacks with a pixel count that is not a word multiple"""
+        rng = np.random.default_rng(0)
+        predicted = rng.random((12, 37, 41)) > 0.6
+        reference = rng.random((12, 37, 41)) > 0.4
+
+        scores = segmentation_metrics(predicted, reference)
+
+        expected = np.array([naive_metrics(p, r) for p, r in zip(predicted, reference)])
+        np.testing.assert_allclose(scores.dice, expected[:, 0])
+        np.testing.assert_allclose(scores.iou, expected[:, 1])
+        np.testing.assert_allclose(scores.precision, expected[:, 2])
+        np.testing.assert_allclose(scores.recall, expected[:, 3])
+
+    def test_empty_masks(self):
+        """Test the conventions for empty predictions and references"""
+        empty = np.zeros((1, 8, 8), dtype=bool)
+        full = np.ones((1, 8, 8), dtype=bool)
+
+        both_empty = segmentation_metrics(empty, empty)
+        missed = segmentation_metrics(empty, full)
+        spurious = segmentation_metrics(full, empty)
+
+        assert both_empty.fields(0) == {
+            "dice_score": 1.0,
+            "iou_score": 1.0,
+            "precision": 1.0,
+            "recall": 1.0,
+        }
+        assert (missed.dice[0], missed.precision[0], missed.recall[0]) == (0, 0, 0)
+        assert (spurious.iou[0], spurious.precision[0]) == (0, 0)
+
+    def test_packed_input(self):
+        """Test scoring rows that were packed ahead of time"""
+        masks = np.eye(16, dtype=bool)[None].repeat(3, axis=0)
+
+        packed = pack_masks(masks)
+        scores = segmentation_metrics(packed, packed, packed=True)
+
+        assert packed.shape == (3, 32)
+        assert np.all(scores.dice == 1.0)
+
+    def test_popcount_fallback(self, monkeypatch):
+        """Test the lookup table used on numpy releases without bitwise_count"""
+        rng = np.random.default_rng(1)
+        masks = rng.random((4, 50, 50)) > 0.5
+        packed = pack_masks(masks)
+        monkeypatch.delattr(np, "bitwise_count", raising=False)
+
+        counts = popcount(packed)
+
+        np.testing.assert_array_equal(counts, masks.sum(axis=(1, 2)))
+        assert metrics_module.POPCOUNT16[0xFFFF] == 16
+
+    def test_shape_mismatch(self):
+        """Test that stacks of different mask sizes are rejected"""
+        with pytest.raises(ValueError):
+            segmentation_metrics(np.zeros((1, 8, 8)), np.zeros((1, 16, 16)))
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+def test_recompute_metrics_command(
+    medical_image, create_medical_image, sample_image, tmp_path
+):
+    """Test that the command scores analyses against masks by id or SHA-256"""
+    other = create_medical_image(user=medical_image.user, image=sample_image)
+    engine = InferenceEngine(ThresholdModel(), max_batch_size=4, max_wait_ms=1)
+    predicted = {}
+    for image in (medical_image, other):
+        analyze_image(image, engine=engine)
+        pixels = pipeline.load_grayscale(image)
+        tensor = pipeline.preprocess(pixels, pipeline.model_setting("INPUT_SIZE"))
+        predicted[image.pk] = engine.predict(tensor).mask
+
+    # Exact mask for one image; the inverse, keyed by content hash, for the other
+    Image.fromarray(predicted[medical_image.pk]).save(
+        tmp_path / f"{medical_image.pk}.png"
+    )
+    Image.fromarray(~predicted[other.pk]).save(tmp_path / f"{other.blob.sha256}.png")
+
+    call_command("recompute_metrics", str(tmp_path), "--images", str(medical_image.pk))
+    assert Analysis.objects.get(image=other).dice_score is None
+
+    call_command("recompute_metrics", str(tmp_path), "--chunk-size", "1")
+    engine.close()
+
+    exact = Analysis.objects.get(image=medical_image)
+    inverse = Analysis.objects.get(image=other)
+    assert (exact.dice_score, exact.iou_score, exact.recall) == (1.0, 1.0, 1.0)
+    assert (inverse.dice_score, inverse.precision) == (0.0, 0.0)
@@ -0,0 +1,106 @@
+"""
+Unit tests for the shared-memory preprocess pool
+"""
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from apps.analysis import preprocessing
+from apps.analysis.inference import (
+    InferenceEngine,
+    ThresholdModel,
+    model_setting,
+    preprocess,
+)
+from apps.analysis.pipeline import analyze_image, load_grayscale
+from apps.analysis.preprocessing import PreprocessPool, TensorRing
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+
+
+def noise_png(seed, size=(90, 70)):
+    """PNG of random grayscale pixels"""
+    pixels = np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return SimpleUploadedFile(f"noise-{seed}.png", buffer.getvalue(), "image/png")
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = PreprocessPool(2, model_setting("INPUT_SIZE"), slots=2)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestTensorRing:
+    """Test shared tensor slots"""
+
+    def test_attached_ring_shares_memory(self):
+        """Test that writes through one ring are visible through another"""
+        ring = TensorRing(3, (4, 4, 1))
+        attached = TensorRing(3, (4, 4, 1), name=ring.name)
+
+        attached.view(1)[:] = 0.5
+
+        assert (ring.view(1) == 0.5).all()
+        assert not ring.view(0).any() and not ring.view(2).any()
+        attached.close()
+        ring.close()
+
+    def test_preprocess_into_existing_array(self):
+        pixels = np.random.default_rng(0).integers(0, 256, (50, 30), dtype=np.uint8)
+        out = np.full((16, 16, 1), 7, dtype=np.float32)
+
+        result = preprocess(pixels, 16, out=out)
+
+        assert result is out
+        np.testing.assert_array_equal(out, preprocess(pixels, 16))
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestPreprocessPool:
+    """Test preprocessing in pool processes"""
+
+    def test_matches_in_thread_preprocessing(self, pool, create_medical_image):
+        """Test that the shared tensor equals the tensor built in-thread"""
+        image = create_medical_image(image=noise_png(1))
+        expected = preprocess(load_grayscale(image), pool.input_size)
+
+        with pool.preprocess(image) as (tensor, source_shape, seconds):
+            np.testing.assert_array_equal(tensor, expected)
+            assert source_shape == (90, 70)
+            assert seconds > 0
+
+    def test_more_images_than_slots(self, pool, create_medical_image):
+        """Test that threads wait for free slots and each gets its own input"""
+        images = [create_medical_image(image=noise_png(seed)) for seed in range(6)]
+        expected = [preprocess(load_grayscale(i), pool.input_size) for i in images]
+
+        def check(index):
+            with pool.preprocess(images[index]) as (tensor, _, _):
+                return bool((tensor == expected[index]).all())
+
+        with ThreadPoolExecutor(4) as threads:
+            assert all(threads.map(check, range(len(images))))
+        assert pool._free.qsize() == pool.slots
+
+    def test_analysis_through_pool(self, pool, create_medical_image, monkeypatch):
+        """Test that the pipeline reads its input from the running pool"""
+        in_thread = create_medical_image(image=noise_png(2))
+        pooled = create_medical_image(image=noise_png(2, size=(90, 71)))
+        engine = InferenceEngine(ThresholdModel(), max_batch_size=1, max_wait_ms=1)
+        expected = analyze_image(in_thread, engine=engine)
+
+        monkeypatch.setattr(preprocessing, "_pool", pool)
+        analysis = analyze_image(pooled, engine=engine)
+        engine.close()
+
+        assert analysis.results["source_shape"] == [90, 71]
+        assert analysis.results["foreground_fraction"] == pytest.approx(
+            expected.results["foreground_fraction"], abs=0.05
+        )
@@ -0,0 +1,114 @@
+"""
+Unit tests for header-only metadata probing
+"""
+import io
+
+import numpy as np
+import pytest
+from apps.images import probe
+from apps.images.models import MedicalImage
+from apps.images.probe import probe_image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+
+
+def encode(fmt, size=(120, 80), **save_kwargs):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color="green").save(buffer, format=fmt, **save_kwargs)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.unit
+@pytest.mark.images
+class TestProbeImage:
+    """Test format detection and dimension parsing"""
+
+    def test_png(self):
+        """Test reading dimensions from the PNG IHDR chunk"""
+        header = probe_image(encode("PNG"))
+
+        assert (header.format, header.width, header.height) == ("png", 120, 80)
+
+    @pytest.mark.parametrize("progressive", [False, True])
+    def test_jpeg(self, progressive):
+        """Test reading dimensions from baseline and progressive SOF segments"""
+        exif = Image.Exif()
+        exif[0x010F] = "Scanner"
+        fh = encode("JPEG", progressive=progressive, exif=exif.tobytes())
+
+        header = probe_image(fh)
+
+        assert (header.format, header.width, header.height) == ("jpeg", 120, 80)
+
+    @pytest.mark.parametrize("explicit", [True, False])
+    def test_dicom(self, make_dicom, explicit):
+        """Test reading Rows/Columns from explicit and implicit VR DICOM"""
+        pixels = np.zeros((30, 40), dtype=np.uint16)
+        fh = io.BytesIO(make_dicom(pixels, explicit=explicit))
+
+        header = probe_image(fh)
+
+        assert (header.format, header.width, header.height) == ("dicom", 40, 30)
+
+    def test_unknown_or_truncated(self, sample_dicom_file):
+        """Test that unreadable headers return None"""
+        assert probe_image(io.BytesIO(b"not an image")) is None
+        assert probe_image(io.BytesIO(encode("PNG").read(12))) is None
+        assert probe_image(sample_dicom_file) is None
+
+    def test_position_is_restored(self):
+        """Test that probing does not move the caller's file position"""
+        fh = encode("PNG")
+        fh.seek(5)
+
+        probe_image(fh)
+
+        assert fh.tell() == 5
+
+
+@pytest.mark.unit
+@pytest.mark.images
+class TestMetadataExtraction:
+    """Test when MedicalImage.save probes the file"""
+
+    def test_probe_runs_once_at_ingest(self, user, sample_image, monkeypatch):
+        """Test that saves which do not touch the file skip probing"""
+        calls = []
+        real_probe = probe.probe_image
+        monkeypatch.setattr(
+            probe, "probe_image", lambda fh: calls.append(1) or real_probe(fh)
+        )
+
+        image = MedicalImage.objects.create(user=user, image=sample_image)
+        assert len(calls) == 1
+        assert (image.width, image.height) == (100, 100)
+
+        image.title = "Renamed"
+        image.save()
+        reloaded = MedicalImage.objects.get(pk=image.pk)
+        reloaded.description = "Updated"
+        reloaded.save()
+
+        assert len(calls) == 1
+        assert reloaded.width == 100
+
+    def test_new_file_is_probed(self, medical_image):
+        """Test that replacing the file refreshes the metadata"""
+        medical_image.image = SimpleUploadedFile(
+            "wide.png", encode("PNG", size=(300, 20)).read(), content_type="image/png"
+        )
+        medical_image.save()
+
+        medical_image.refresh_from_db()
+        assert (medical_image.width, medical_image.height) == (300, 20)
+
+    def test_dicom_dimensions(self, user, make_dicom):
+        """Test that DICOM uploads get width and height"""
+        content = make_dicom(np.zeros((64, 32), dtype=np.int16))
+        upload = SimpleUploadedFile("scan.dcm", content, "application/dicom")
+
+        image = MedicalImage.objects.create(user=user, image=upload)
+
+        assert (image.width, image.height) == (32, 64)
+        assert image.file_size == len(content)
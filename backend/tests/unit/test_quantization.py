@@ -0,0 +1,163 @@
+"""
+Unit tests for quantized TFLite exports and their accuracy gate
+"""
+import io
+
+import numpy as np
+import pytest
+from apps.analysis import registry as registry_module
+from apps.analysis.inference import KerasModel, TFLiteModel
+from apps.analysis.models import ModelValidation
+from apps.analysis.pipeline import analyze_image
+from apps.analysis.quantization import export_int8, is_validated
+from apps.analysis.registry import ModelRegistry
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from PIL import Image
+
+SIZE = 16
+
+
+def gradient_png(offset):
+    """PNG whose columns brighten left to right, shifted by ``offset``"""
+    row = np.clip(np.linspace(0, 255, SIZE) + offset, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(np.tile(row, (SIZE, 1))).save(buffer, format="PNG")
+    return SimpleUploadedFile("gradient.png", buffer.getvalue(), "image/png")
+
+
+@pytest.fixture
+def keras_path(tmp_path):
+    """Per-pixel model thresholding intensity at 0.5"""
+    import tensorflow as tf
+
+    inputs = tf.keras.Input((SIZE, SIZE, 1))
+    outputs = tf.keras.layers.Conv2D(1, 1, activation="sigmoid")(inputs)
+    model = tf.keras.Model(inputs, outputs)
+    model.set_weights([np.full((1, 1, 1, 1), 20.0), np.array([-10.0])])
+    path = tmp_path / "seg.keras"
+    model.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def quantized(settings, keras_path, tmp_path):
+    """Model settings with ``seg`` registered as float32 and as a TFLite export"""
+    path = str(tmp_path / "seg-int8.tflite")
+    settings.ANALYSIS_MODEL = {
+        **settings.ANALYSIS_MODEL,
+        "MODELS": {"seg": keras_path},
+        "QUANTIZED_MODELS": {"seg": path},
+        "DEFAULT_VERSION": "seg",
+        "BACKEND": "tflite",
+        "INPUT_SIZE": SIZE,
+        "MAX_QUANTIZATION_DROP": 0.05,
+    }
+    return path
+
+
+@pytest.fixture
+def references(create_medical_image, user, tmp_path):
+    """Gradient images and reference masks named by image id"""
+    directory = tmp_path / "references"
+    directory.mkdir()
+    images = []
+    for offset in (-60, 0, 60):
+        image = create_medical_image(user=user, image=gradient_png(offset))
+        pixels = np.asarray(Image.open(image.image).convert("L"))
+        Image.fromarray(pixels > 127).save(directory / f"{image.pk}.png")
+        images.append(image)
+    return str(directory), images
+
+
+def tensors(count=4):
+    ramp = np.linspace(0, 1, SIZE, dtype=np.float32)
+    return [
+        np.clip(np.tile(ramp, (SIZE, 1)) + shift, 0, 1)[..., None]
+        for shift in np.linspace(-0.3, 0.3, count)
+    ]
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestTFLiteBackend:
+    """Test the int8 export and its interpreter"""
+
+    def test_int8_export_matches_float32(self, keras_path, tmp_path):
+        """Test that quantized probabilities stay close to float32"""
+        path = export_int8(keras_path, tmp_path / "seg.tflite", tensors())
+        batch = np.stack(tensors(3))
+
+        expected = KerasModel(keras_path, version="seg").predict(batch)
+        model = TFLiteModel(path, version="seg")
+        actual = model.predict(batch)
+
+        assert model.version == "seg+tflite"
+        assert actual.shape == expected.shape
+        assert np.abs(actual - expected).max() < 0.05
+        # A different batch size resizes the interpreter input
+        assert model.predict(batch[:1]).shape == (1, SIZE, SIZE, 1)
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestAccuracyGate:
+    """Test validation and activation of quantized exports"""
+
+    def test_export_within_threshold_is_served(
+        self, quantized, references, monkeypatch
+    ):
+        """Test that a passing export serves analyses recorded with its backend"""
+        directory, images = references
+
+        call_command(
+            "validate_quantized_model", directory, "--export", stdout=io.StringIO()
+        )
+
+        validation = ModelValidation.objects.get()
+        assert validation.passed
+        assert validation.images == len(images)
+        assert validation.dice_drop <= 0.05
+        registry = ModelRegistry.from_settings()
+        monkeypatch.setattr(registry_module, "_registry", registry)
+        assert registry.result_version() == "seg+tflite"
+        analysis = analyze_image(images[0])
+        registry.close()
+        assert analysis.model_version == "seg+tflite"
+
+    def test_export_past_threshold_is_refused(self, quantized, references):
+        """Test that a failed validation keeps the float32 model in service"""
+        directory, _ = references
+
+        with pytest.raises(CommandError, match="Refusing to activate"):
+            call_command(
+                "validate_quantized_model",
+                directory,
+                "--export",
+                "--max-drop",
+                "-1",
+                stdout=io.StringIO(),
+            )
+
+        assert not ModelValidation.objects.get().passed
+        assert ModelRegistry.from_settings().result_version("seg") == "seg"
+
+    def test_changed_export_needs_validation(self, quantized, references):
+        """Test that activation is tied to the exact export file"""
+        directory, _ = references
+        call_command(
+            "validate_quantized_model", directory, "--export", stdout=io.StringIO()
+        )
+        assert is_validated("seg", "tflite", quantized)
+
+        with open(quantized, "ab") as fh:
+            fh.write(b"\0")
+
+        assert not is_validated("seg", "tflite", quantized)
+
+    def test_missing_export_setting(self, quantized, references, settings):
+        settings.ANALYSIS_MODEL = {**settings.ANALYSIS_MODEL, "QUANTIZED_MODELS": {}}
+
+        with pytest.raises(CommandError, match="ANALYSIS_QUANTIZED_MODELS"):
+            call_command("validate_quantized_model", references[0])
@@ -0,0 +1,169 @@
+"""
+Unit tests for the model registry
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from apps.analysis import pipeline
+from apps.analysis.inference import ThresholdModel
+from apps.analysis.jobs import enqueue_analysis
+from apps.analysis.models import Analysis
+from apps.analysis.registry import ModelRegistry, UnknownModelVersion
+from apps.analysis.worker import AnalysisWorkerPool
+
+
+class SizedModel(ThresholdModel):
+    """Threshold model reporting a version and weight size of its own"""
+
+    def __init__(self, version, memory_bytes=100, delay=0.0):
+        time.sleep(delay)
+        self.version = version
+        self.memory_bytes = memory_bytes
+
+
+def make_registry(versions=("v1", "v2", "v3"), loads=None, delay=0.0, **kwargs):
+    loads = loads if loads is not None else []
+
+    def loader(version):
+        def load():
+            loads.append(version)
+            return SizedModel(version, delay=delay)
+
+        return load
+
+    loaders = {version: loader(version) for version in versions}
+    return ModelRegistry(
+        loaders, versions[0], max_batch_size=4, max_wait_ms=1, **kwargs
+    )
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestModelRegistry:
+    """Test lazy loading, leasing and eviction"""
+
+    def test_loads_once_under_concurrency(self):
+        """Test that concurrent first requests share a single load"""
+        loads = []
+        registry = make_registry(loads=loads, delay=0.05)
+        tensor = np.full((8, 8, 1), 0.9, dtype=np.float32)
+
+        def predict(_):
+            with registry.acquire("v2") as lease:
+                return lease.engine.predict(tensor).model_version
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            versions = list(pool.map(predict, range(8)))
+        registry.close()
+
+        assert versions == ["v2"] * 8
+        assert loads == ["v2"]
+        assert registry.stats["v2"].loads == 1
+        assert registry.stats["v2"].hits >= 1
+
+    def test_cold_start_is_reported(self):
+        """Test that only callers that waited for a load see a cold start"""
+        registry = make_registry(delay=0.05)
+
+        with registry.acquire() as cold:
+            assert cold.engine.model_version == "v1"
+        with registry.acquire("v1") as warm:
+            pass
+        registry.close()
+
+        assert cold.cold_start >= 0.05
+        assert warm.cold_start == 0.0
+        assert registry.stats["v1"].load_time >= 0.05
+
+    def test_warmup_pass_on_load(self):
+        """Test that a model runs one forward pass before serving"""
+        calls = []
+
+        class Recording(SizedModel):
+            def predict(self, batch):
+                calls.append(batch.shape)
+                return super().predict(batch)
+
+        registry = ModelRegistry({"v1": lambda: Recording("v1")}, "v1", warmup_size=16)
+        registry.preload()
+        registry.close()
+
+        assert calls == [(1, 16, 16, 1)]
+
+    def test_least_recently_used_model_is_evicted(self):
+        """Test that the pool stays under its memory limit, LRU first"""
+        loads = []
+        registry = make_registry(loads=loads, memory_limit=200)
+
+        registry.preload(["v1", "v2"])
+        registry.preload(["v1"])
+        registry.preload(["v3"])
+
+        assert registry.loaded_versions == ["v1", "v3"]
+        assert registry.stats["v2"].evictions == 1
+        registry.preload(["v2"])
+        assert loads == ["v1", "v2", "v3", "v2"]
+        assert registry.loaded_versions == ["v3", "v2"]
+        registry.close()
+
+    def test_leased_model_is_not_evicted(self):
+        """Test that a model in use outlives the limit, even when least recent"""
+        registry = make_registry(memory_limit=100)
+
+        with registry.acquire("v1") as lease:
+            with registry.acquire("v2"):
+                assert registry.loaded_versions == ["v1", "v2"]
+            assert registry.loaded_versions == ["v1"]
+            lease.engine.predict(np.zeros((8, 8, 1), dtype=np.float32))
+
+        assert registry.stats["v2"].evictions == 1
+        registry.close()
+
+    def test_unknown_version(self):
+        """Test that unregistered versions are rejected"""
+        registry = make_registry()
+
+        with pytest.raises(UnknownModelVersion):
+            with registry.acquire("v9"):
+                pass
+        with pytest.raises(UnknownModelVersion):
+            ModelRegistry({"v1": ThresholdModel}, "v2")
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+def test_worker_routes_jobs_to_their_model(medical_image, monkeypatch):
+    """Test that a job naming a version is analyzed by that model"""
+    registry = make_registry(delay=0.01)
+    monkeypatch.setattr(pipeline, "get_registry", lambda: registry)
+    enqueue_analysis(medical_image, model_version="v2")
+
+    AnalysisWorkerPool(workers=1).run_once()
+
+    analysis = Analysis.objects.get(image=medical_image)
+    assert analysis.model_version == "v2"
+    assert analysis.results["model_load_time"] >= 0.01
+    assert registry.loaded_versions == ["v2"]
+    registry.close()
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+def test_reuse_does_not_load_the_model(
+    medical_image, create_medical_image, sample_image, monkeypatch
+):
+    """Test that reused analyses skip loading and drop the load time"""
+    loads = []
+    registry = make_registry(loads=loads)
+    monkeypatch.setattr(pipeline, "get_registry", lambda: registry)
+    twin = create_medical_image(user=medical_image.user, image=sample_image)
+    pipeline.analyze_image(medical_image)
+    registry.close()
+
+    analysis = pipeline.analyze_image(twin)
+
+    assert loads == ["v1"]
+    assert analysis.results["reused_from"] == medical_image.pk
+    assert "model_load_time" not in analysis.results
@@ -0,0 +1,188 @@
+"""
+Unit tests for the analysis result cache and request coalescing
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from apps.analysis import pipeline
+from apps.analysis.cache import SingleFlight, content_key, result_cache
+from apps.analysis.inference import InferenceEngine, ThresholdModel
+from apps.analysis.jobs import enqueue_job, enqueue_jobs
+from apps.analysis.models import Analysis, AnalysisJob
+from apps.analysis.pipeline import analyze_image
+from apps.images.models import MedicalImage
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+
+
+class SlowModel(ThresholdModel):
+    """Threshold model that counts images and takes a while per batch"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.images = 0
+
+    def predict(self, batch):
+        time.sleep(self.delay)
+        self.images += len(batch)
+        return super().predict(batch)
+
+
+@pytest.fixture
+def model():
+    return SlowModel()
+
+
+@pytest.fixture
+def engine(model):
+    engine = InferenceEngine(model, max_batch_size=8, max_wait_ms=1)
+    yield engine
+    engine.close()
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestResultCache:
+    """Test reuse of cached results"""
+
+    def test_same_image_is_not_inferred_twice(self, medical_image, model, engine):
+        """Test that re-analysis by the same model hits the cache"""
+        first = analyze_image(medical_image, engine=engine)
+        second = analyze_image(medical_image, engine=engine)
+
+        assert model.images == 1
+        assert second.pk == first.pk
+        assert second.results == first.results
+        assert "reused_from" not in second.results
+
+    def test_identical_bytes_outlive_the_source_row(
+        self, medical_image, create_medical_image, sample_image, model, engine
+    ):
+        """Test that the cache serves bytes whose first analysis is gone"""
+        twin = create_medical_image(user=medical_image.user, image=sample_image)
+        source = analyze_image(medical_image, engine=engine)
+        mask = source.results["mask"]["name"]
+        Analysis.objects.filter(pk=source.pk).update(image=twin)
+        Analysis.objects.filter(pk=source.pk).delete()
+        assert default_storage.exists(mask)
+
+        analysis = analyze_image(medical_image, engine=engine)
+
+        assert model.images == 1
+        assert analysis.results["mask"]["name"] == mask
+
+    def test_entry_with_deleted_mask_is_dropped(self, medical_image, model, engine):
+        """Test that a result whose mask file is gone is inferred again"""
+        analysis = analyze_image(medical_image, engine=engine)
+        default_storage.delete(analysis.results["mask"]["name"])
+
+        analyze_image(medical_image, engine=engine)
+
+        assert model.images == 2
+        assert default_storage.exists(analysis.results["mask"]["name"])
+
+    def test_cache_key_follows_model_version(self, medical_image):
+        """Test that each model version has its own entry"""
+        assert content_key(medical_image, "v1") != content_key(medical_image, "v2")
+        assert medical_image.blob.sha256 in content_key(medical_image, "v1")
+
+    def test_cache_ttl(self, medical_image, engine):
+        """Test that entries are written with the analysis cache timeout"""
+        analyze_image(medical_image, engine=engine)
+        key = content_key(medical_image, engine.model_version)
+
+        assert result_cache().has_key(key)
+        assert result_cache().default_timeout == 86400
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestCoalescing:
+    """Test single-flight analysis of concurrent identical requests"""
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_identical_images_share_one_inference(
+        self, create_medical_image, user, sample_image, monkeypatch
+    ):
+        """Test that concurrent rows with the same bytes run inference once"""
+        # SQLite locks whole tables, so writes from the threads take turns
+        save_analysis, writing = pipeline.save_analysis, threading.Lock()
+
+        def serialized(*args, **kwargs):
+            with writing:
+                return save_analysis(*args, **kwargs)
+
+        monkeypatch.setattr(pipeline, "save_analysis", serialized)
+        for _ in range(4):
+            create_medical_image(user=user, image=sample_image)
+        images = list(MedicalImage.objects.select_related("blob"))
+        model = SlowModel(delay=0.3)
+        engine = InferenceEngine(model, max_batch_size=1, max_wait_ms=1)
+        started = threading.Barrier(len(images))
+
+        def analyze(image):
+            started.wait()
+            return analyze_image(image, engine=engine)
+
+        with ThreadPoolExecutor(max_workers=len(images)) as pool:
+            analyses = list(pool.map(analyze, images))
+        engine.close()
+
+        assert model.images == 1
+        assert len({analysis.results["mask"]["name"] for analysis in analyses}) == 1
+        reused = [
+            analysis for analysis in analyses if "reused_from" in analysis.results
+        ]
+        assert len(reused) == len(images) - 1
+        assert MedicalImage.objects.filter(analyzed=True).count() == len(images)
+
+    def test_failure_reaches_every_waiter(self):
+        """Test that waiters see the leader's exception"""
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait()
+            raise RuntimeError("inference failed")
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(flight.do, "key", fail) for _ in range(3)]
+            time.sleep(0.05)
+            release.set()
+            errors = [future.exception() for future in futures]
+
+        assert all(isinstance(error, RuntimeError) for error in errors)
+        assert flight.do("key", lambda: 1) == (1, False)
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestActiveJobConstraint:
+    """Test that an image cannot have two queued jobs for one model"""
+
+    def test_duplicate_active_job_is_rejected(self, medical_image):
+        """Test the database constraint behind start_analysis"""
+        enqueue_job(medical_image)
+
+        with pytest.raises(IntegrityError), transaction.atomic():
+            AnalysisJob.objects.create(image=medical_image)
+
+    def test_finished_jobs_do_not_conflict(self, medical_image):
+        """Test that a new job can follow a finished one"""
+        job = enqueue_job(medical_image)
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            status=AnalysisJob.Status.SUCCEEDED
+        )
+
+        assert enqueue_job(medical_image).pk != job.pk
+        assert enqueue_job(medical_image, model_version="v2").pk != job.pk
+
+    def test_bulk_enqueue_skips_conflicts(self, medical_image):
+        """Test that a job queued concurrently is dropped by the INSERT"""
+        enqueue_job(medical_image)
+
+        enqueue_jobs([medical_image.pk, medical_image.pk])
+
+        assert AnalysisJob.objects.filter(image=medical_image).count() == 1
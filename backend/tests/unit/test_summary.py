@@ -0,0 +1,113 @@
+"""
+Unit tests for incrementally maintained analysis summaries
+"""
+import pytest
+from apps.analysis import summary as summary_module
+from apps.analysis.inference import InferenceEngine, ThresholdModel
+from apps.analysis.models import Analysis, AnalysisSummary
+from apps.analysis.pipeline import analyze_image, save_analysis
+from apps.analysis.summary import rebuild_summaries
+from django.core.management import call_command
+from django.db import IntegrityError
+
+
+def summary_fields(summary):
+    return {
+        "uploaded": summary.uploaded,
+        "analyzed": summary.analyzed,
+        "processing_time_total": pytest.approx(summary.processing_time_total),
+        "processing_time_count": summary.processing_time_count,
+        "by_model": {
+            version: {key: pytest.approx(value) for key, value in stats.items()}
+            for version, stats in summary.by_model.items()
+        },
+    }
+
+
+def assert_matches_rebuild(user):
+    incremental = AnalysisSummary.objects.get(user=user)
+    (rebuilt,) = rebuild_summaries([user.pk])
+    assert summary_fields(incremental) == summary_fields(rebuilt)
+    return rebuilt
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestIncrementalSummary:
+    """Test that deltas keep the summary equal to a full rebuild"""
+
+    def test_uploads_and_deletes(self, create_medical_image, user, sample_image):
+        """Test image counts through creation and deletion"""
+        images = [create_medical_image(user=user, image=sample_image) for _ in range(3)]
+        create_medical_image(user=user, image=sample_image, analyzed=True)
+        images[0].delete()
+
+        summary = assert_matches_rebuild(user)
+        assert (summary.uploaded, summary.analyzed, summary.pending) == (3, 1, 2)
+
+    def test_analyses_saved_replaced_and_deleted(
+        self, create_medical_image, user, sample_image
+    ):
+        """Test processing time and per-model metrics through analysis writes"""
+        first, second, third = [
+            create_medical_image(user=user, image=sample_image) for _ in range(3)
+        ]
+        save_analysis(first, {}, 1.0, "v1", dice_score=0.8, iou_score=0.6)
+        save_analysis(second, {}, 3.0, "v1", dice_score=0.6)
+        save_analysis(third, {}, 2.0, "v2")
+        # Re-analysis by another model replaces the first result
+        save_analysis(first, {}, 5.0, "v2", dice_score=0.4, iou_score=0.2)
+        Analysis.objects.get(image=second).delete()
+
+        summary = assert_matches_rebuild(user)
+        assert summary.analyzed == 3
+        assert summary.average_processing_time == pytest.approx(3.5)
+        assert set(summary.by_model) == {"v2"}
+        assert summary.by_model["v2"]["analyses"] == 2
+        assert summary.by_model["v2"]["dice_sum"] == pytest.approx(0.4)
+
+    def test_deleting_analyzed_image(self, medical_image, user):
+        """Test that the cascade removes both the image and its analysis"""
+        engine = InferenceEngine(ThresholdModel(), max_batch_size=1, max_wait_ms=1)
+        analyze_image(medical_image, engine=engine)
+        engine.close()
+        medical_image.delete()
+
+        summary = assert_matches_rebuild(user)
+        assert summary.uploaded == 0
+        assert summary.by_model == {}
+
+    def test_users_are_independent(self, create_user, create_medical_image, user):
+        """Test that one user's writes leave another's summary alone"""
+        other = create_user(email="other@example.com")
+        create_medical_image(user=user)
+        create_medical_image(user=other)
+        create_medical_image(user=other)
+
+        assert AnalysisSummary.objects.get(user=user).uploaded == 1
+        assert AnalysisSummary.objects.get(user=other).uploaded == 2
+
+    def test_row_built_concurrently(
+        self, create_medical_image, user, sample_image, monkeypatch
+    ):
+        """Test that a row another transaction inserts first gets the delta"""
+        create_medical_image(user=user, image=sample_image)
+        AnalysisSummary.objects.filter(user=user).delete()
+
+        def racing_rebuild(user_ids):
+            # Committed by a request that could not see this upload yet
+            AnalysisSummary.objects.create(user_id=user_ids[0], uploaded=1)
+            raise IntegrityError("duplicate key value")
+
+        monkeypatch.setattr(summary_module, "rebuild_summaries", racing_rebuild)
+        create_medical_image(user=user, image=sample_image)
+
+        assert AnalysisSummary.objects.get(user=user).uploaded == 2
+
+    def test_rebuild_command_fixes_drift(self, medical_image, user):
+        """Test that the command recomputes drifted counters"""
+        AnalysisSummary.objects.filter(user=user).update(uploaded=42, by_model={})
+
+        call_command("rebuild_analysis_summaries", "--users", str(user.pk))
+
+        assert AnalysisSummary.objects.get(user=user).uploaded == 1
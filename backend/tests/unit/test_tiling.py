@@ -0,0 +1,244 @@
+"""
+Unit tests for tiled sliding-window inference
+"""
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+from apps.analysis.inference import InferenceEngine, ThresholdModel
+from apps.analysis.masks import MaskWriter, decode_mask
+from apps.analysis.pipeline import analyze_image
+from apps.analysis.tiling import (
+    ArraySource,
+    blend_window,
+    coverage,
+    predict_tiled,
+    tile_positions,
+)
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+
+
+class IdentityModel:
+    """Model whose foreground probability is the input intensity"""
+
+    version = "identity-v1"
+
+    def predict(self, batch):
+        return batch
+
+
+class StripeSource:
+    """Procedural image of vertical stripes, generated one band at a time"""
+
+    def __init__(self, height, width, period):
+        self.shape = (height, width)
+        columns = (np.arange(width) // period) % 2
+        self.row = (columns * 255).astype(np.uint8)
+
+    def read_rows(self, start, stop):
+        return np.broadcast_to(self.row, (stop - start, self.shape[1]))
+
+
+class CountingSink:
+    """Binary file stand-in that only counts bytes"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def tiled_mask(pixels, tile_size, overlap, budget=4):
+    engine = InferenceEngine(IdentityModel(), max_batch_size=4, max_wait_ms=1)
+    buffer = io.BytesIO()
+    writer = MaskWriter(buffer, *pixels.shape)
+    prediction = predict_tiled(
+        ArraySource(pixels), engine, writer, tile_size, overlap, budget
+    )
+    writer.close()
+    engine.close()
+    return prediction, decode_mask(buffer.getvalue())
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+class TestTiledInference:
+    """Test tile layout and blending"""
+
+    def test_tile_positions(self):
+        """Test that tiles cover the image and the last one ends flush"""
+        assert tile_positions(100, 64, 48) == [0, 36]
+        assert tile_positions(200, 64, 48) == [0, 48, 96, 136]
+        assert tile_positions(40, 64, 48) == [0]
+
+    def test_coverage_is_positive(self):
+        """Test that every pixel has blend weight, including image edges"""
+        window = blend_window(64, 16)
+        total = coverage(tile_positions(517, 64, 48), 517, window)
+
+        assert window.min() > 0 and window.max() == 1.0
+        assert total.min() > 0
+
+    @pytest.mark.parametrize(
+        "shape, tile_size, overlap",
+        [((300, 517), 64, 16), ((30, 50), 64, 16), ((128, 128), 64, 0)],
+    )
+    def test_blending_reconstructs_full_resolution(self, shape, tile_size, overlap):
+        """Test that blended tiles equal thresholding the whole image"""
+        pixels = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+
+        prediction, mask = tiled_mask(pixels, tile_size, overlap)
+
+        np.testing.assert_array_equal(mask, pixels > 127)
+        assert prediction.shape == shape
+        assert prediction.foreground_fraction == pytest.approx((pixels > 127).mean())
+        expected = np.maximum(pixels / 255, 1 - pixels / 255).mean()
+        assert prediction.confidence == pytest.approx(expected, rel=1e-4)
+
+    def test_budget_bounds_tiles_in_flight(self):
+        """Test that no more than ``budget`` tiles are awaiting blending"""
+        in_flight = []
+
+        class CountingEngine:
+            model_version = "counting"
+
+            def __init__(self):
+                self.engine = InferenceEngine(IdentityModel(), max_wait_ms=1)
+                self.pending = 0
+
+            def submit(self, tensor):
+                self.pending += 1
+                in_flight.append(self.pending)
+                return _Tracked(self.engine.submit(tensor), self)
+
+        class _Tracked:
+            def __init__(self, future, owner):
+                self.future, self.owner = future, owner
+
+            def result(self):
+                self.owner.pending -= 1
+                return self.future.result()
+
+        engine = CountingEngine()
+        writer = MaskWriter(CountingSink(), 200, 400)
+        predict_tiled(StripeSource(200, 400, 10), engine, writer, 32, 8, budget=3)
+        engine.engine.close()
+
+        assert max(in_flight) == 3
+
+    def test_rejects_overlap_of_whole_tile(self):
+        """Test the overlap bound"""
+        with pytest.raises(ValueError):
+            tiled_mask(np.zeros((10, 10), np.uint8), 16, 16)
+
+
+@pytest.mark.unit
+@pytest.mark.analysis
+def test_pipeline_tiles_large_images(create_medical_image, user, settings):
+    """Test that images above the model input keep their full resolution"""
+    settings.ANALYSIS_MODEL = {
+        **settings.ANALYSIS_MODEL,
+        "INPUT_SIZE": 64,
+        "TILE_OVERLAP": 16,
+    }
+    pixels = np.zeros((150, 230), dtype=np.uint8)
+    pixels[:, 100:] = 255
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    image = create_medical_image(
+        user=user,
+        image=SimpleUploadedFile("wide.png", buffer.getvalue(), "image/png"),
+    )
+    engine = InferenceEngine(ThresholdModel(), max_batch_size=8, max_wait_ms=1)
+
+    analysis = analyze_image(image, engine=engine)
+    engine.close()
+
+    assert analysis.results["mask_shape"] == [150, 230]
+    assert analysis.results["tiles"] == 3 * 5
+    np.testing.assert_array_equal(analysis.mask, pixels > 127)
+    assert analysis.results["foreground_fraction"] == pytest.approx(130 / 230)
+
+
+@pytest.mark.slow
+@pytest.mark.unit
+@pytest.mark.analysis
+def test_pipeline_tiles_png_above_pillow_limit(
+    create_medical_image, user, settings, large_png
+):
+    """Test that a PNG past Pillow's default bomb limit is analyzed"""
+    settings.ANALYSIS_MODEL = {
+        **settings.ANALYSIS_MODEL,
+        "INPUT_SIZE": 2048,
+        "TILE_OVERLAP": 32,
+    }
+    image = create_medical_image(
+        user=user, image=SimpleUploadedFile("large.png", large_png, "image/png")
+    )
+    engine = InferenceEngine(ThresholdModel(), max_batch_size=8, max_wait_ms=1)
+
+    analysis = analyze_image(image, engine=engine)
+    engine.close()
+
+    assert analysis.results["mask_shape"] == [13400, 13400]
+    assert analysis.results["tiles"] == 7 * 7
+    assert analysis.results["foreground_fraction"] == pytest.approx(
+        7000 * 5000 / 13400**2, abs=0.01
+    )
+
+
+def resident_bytes():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+@pytest.mark.slow
+@pytest.mark.unit
+@pytest.mark.analysis
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs procfs")
+def test_gigapixel_image_within_memory_ceiling():
+    """
+    Test that a 32768 x 32768 image is segmented with bounded memory.
+
+    The source is generated band by band, so the 1 GiB of pixels, 4 GiB of
+    float32 probabilities and 128 MiB of packed mask never exist at once.
+    """
+    size, tile_size = 32768, 256
+    source = StripeSource(size, size, period=1000)
+    engine = InferenceEngine(IdentityModel(), max_batch_size=16, max_wait_ms=1)
+    sink = CountingSink()
+    writer = MaskWriter(sink, size, size)
+
+    baseline = resident_bytes()
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, resident_bytes())
+            time.sleep(0.005)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    try:
+        prediction = predict_tiled(source, engine, writer, tile_size, 32, budget=32)
+        writer.close()
+    finally:
+        done.set()
+        sampler.join()
+        engine.close()
+
+    # One tile-high band plus its scratch copy is 64 MiB at this width
+    assert peak - baseline < 256 * 1024**2
+    assert writer.rows == size
+    assert prediction.foreground_fraction == pytest.approx(
+        (StripeSource(1, size, 1000).row > 127).mean()
+    )
+    assert sink.size < 1024**2